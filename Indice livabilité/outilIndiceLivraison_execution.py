@@ -31,18 +31,26 @@
 #--------------------------------------------------------
 
 
-import arcpy, requests, math, datetime, pandas, json
+import arcpy, requests, math, datetime, pandas, numpy, json, threading, sqlite3, time, zlib, os, hashlib, io
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from urllib3.util.retry import Retry
 from sys import argv
+import tempfile
+
+# pyarrow (fourni avec ArcGIS Pro) n'est utilisé que pour le stockage Parquet des données SpeedData
+try:
+    import pyarrow, pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 
 
 # liste des noms de champs des notes d'indicateurs, simplifie le calcul des moyennes ensuite
+# Remplies par executerCriteres avec les critères calculés, dans l'ordre du registre (registre_criteres)
 liste_note_circulation = []
 liste_note_accessibilite = []
-
-def unique_values(table , field):
-    with arcpy.da.SearchCursor(table, [field]) as cursor:
-        return sorted({str(row[0]) for row in cursor})
+listes_notes_groupes = {"circulation" : liste_note_circulation, "accessibilite" : liste_note_accessibilite}
 
 def seuilStringToList(parametre_seuil):
     parameter_list = parametre_seuil.split(";",1) #permet d'enlever les cas ou l'utilisateur aurait entré plus de lignes dans la table des seuils => Ex output pour 2 lignes de 4 colonnes : "a b c d;e f g h"
@@ -50,112 +58,367 @@ def seuilStringToList(parametre_seuil):
     seuil_list = seuil_string.split()
     return seuil_list
 
+#-------------- Noyaux de notation vectorisés -----------------
+# Les notes sont calculées sur des colonnes entières (tableaux numpy d'une valeur par lien), avec les seuils lus par seuilStringToList.
+# Les conditions sont évaluées dans le même ordre que les anciens if/elif ligne par ligne : numpy.select garde la première vraie,
+# et une valeur qui ne vérifie aucune condition (ex : NaN) reçoit la note par défaut.
+
+def noteBandesCroissantes(valeur, seuil_bon, seuil_mauv, defaut=0):
+    # Plus la valeur est grande, meilleure est la note : 3 si >= seuil_bon, 2 si > seuil_mauv, 1 si <= seuil_mauv
+    valeur = numpy.asarray(valeur, dtype=float)
+    return numpy.select([valeur >= seuil_bon, valeur > seuil_mauv, valeur <= seuil_mauv], [3, 2, 1], defaut)
+
+def noteBandesDecroissantes(valeur, seuil_bon, seuil_mauv, defaut=0):
+    # Plus la valeur est petite, meilleure est la note : 3 si <= seuil_bon, 2 si < seuil_mauv, 1 si >= seuil_mauv
+    valeur = numpy.asarray(valeur, dtype=float)
+    return numpy.select([valeur <= seuil_bon, valeur < seuil_mauv, valeur >= seuil_mauv], [3, 2, 1], defaut)
+
+def valeurMinDirections(valeur_T, valeur_F):
+    # Plus petite valeur non nulle des deux directions, 0 si les deux sont nulles
+    valeur_T = numpy.asarray(valeur_T, dtype=float)
+    valeur_F = numpy.asarray(valeur_F, dtype=float)
+    return numpy.where(valeur_T == 0, valeur_F, numpy.where(valeur_F == 0, valeur_T, numpy.minimum(valeur_T, valeur_F)))
+
+
+#-------------- Index des LINK_ID et table attributaire en mémoire -----------------
+# Les LINK_ID du réseau étudié sont stockés une seule fois, triés, dans un tableau numpy d'entiers (index_liens).
+# La position d'un lien dans ce tableau est son numéro de ligne dans la table attributaire : les critères adressent les liens par position,
+# les tests d'appartenance au réseau sont vectorisés (searchsorted) et les LINK_ID ne sont plus convertis en texte.
+# Les critères n'écrivent pas directement dans la couche réseau : chacun ajoute ses colonnes à la table en mémoire.
+# Les champs sont ensuite ajoutés en une fois et toutes les colonnes enregistrées en un seul passage d'UpdateCursor (ecrireTableAttributs).
+
+index_liens = numpy.array([], dtype=numpy.int64) # LINK_ID triés du réseau étudié
+position_liens = {} # {LINK_ID : position dans index_liens}, pour les lectures ligne à ligne des curseurs
+table_attributs = pandas.DataFrame()
+types_champs = {} # {nom du champ : type ArcGIS} des colonnes à enregistrer dans la couche
+
+# Les critères exécutés en parallèle (executerCriteres) n'écrivent pas dans la table : leurs colonnes sont gardées par le thread
+# de la tâche (tache_courante.colonnes) puis fusionnées dans la table dans l'ordre des tâches.
+# Les lectures arcpy (curseurs, FeatureClassToNumPyArray, outils de géotraitement) ne sont pas faites en parallèle (verrou_arcpy)
+tache_courante = threading.local()
+verrou_arcpy = threading.RLock()
+
+def positionsLiens(link_ids):
+    # Position de chaque LINK_ID dans index_liens, -1 si le lien n'appartient pas au réseau étudié
+    link_ids = numpy.atleast_1d(numpy.asarray(link_ids, dtype=numpy.int64))
+    if len(index_liens) == 0:
+        return numpy.full(len(link_ids), -1, dtype=numpy.int64)
+    positions = numpy.minimum(numpy.searchsorted(index_liens, link_ids), len(index_liens)-1)
+    return numpy.where(index_liens[positions] == link_ids, positions, -1)
+
+def chargerTableAttributs(Streets_network, champs):
+    # Lecture des champs de la couche réseau utilisés par les critères, une ligne par LINK_ID, dans l'ordre de index_liens
+    global index_liens, position_liens, table_attributs, types_champs
+    df = arcgis_table_to_df(Streets_network, ["LINK_ID"]+champs)
+    df["LINK_ID"] = df["LINK_ID"].astype(numpy.int64)
+    table_attributs = df.drop_duplicates(subset="LINK_ID").sort_values("LINK_ID").reset_index(drop=True)
+    index_liens = table_attributs["LINK_ID"].to_numpy()
+    position_liens = {link : i for i, link in enumerate(index_liens.tolist())}
+    types_champs = {}
+
+def ajouterColonne(nom_champ, type_champ, valeurs, defaut):
+    # valeurs : soit un dictionnaire {link_id : valeur}, les liens absents du dictionnaire prennent la valeur par défaut,
+    #           soit une séquence d'une valeur par lien, dans l'ordre de index_liens
+    if isinstance(valeurs, dict):
+        colonne = numpy.full(len(index_liens), defaut, dtype=object)
+        if valeurs:
+            positions = positionsLiens(list(valeurs.keys()))
+            trouve = positions >= 0
+            valeurs_liens = numpy.empty(len(valeurs), dtype=object)
+            valeurs_liens[:] = list(valeurs.values())
+            colonne[positions[trouve]] = valeurs_liens[trouve]
+    else:
+        colonne = numpy.empty(len(index_liens), dtype=object)
+        colonne[:] = valeurs.tolist() if isinstance(valeurs, numpy.ndarray) else list(valeurs) # types python pour l'UpdateCursor
+    colonnes_tache = getattr(tache_courante, "colonnes", None)
+    if colonnes_tache is not None:
+        colonnes_tache.append((nom_champ, type_champ, colonne))
+        return
+    table_attributs[nom_champ] = colonne
+    types_champs[nom_champ] = type_champ
+
+def ecrireTableAttributs(Streets_network):
+    # Ajout en une fois des champs manquants, puis un seul passage sur la couche pour enregistrer toutes les colonnes
+    champs_existants = [f.name for f in arcpy.ListFields(Streets_network)]
+    nouveaux_champs = [[nom_champ, type_champ] for nom_champ, type_champ in types_champs.items() if nom_champ not in champs_existants]
+    if nouveaux_champs:
+        arcpy.management.AddFields(Streets_network, nouveaux_champs)
+
+    colonnes = list(types_champs)
+    valeurs = table_attributs[colonnes].astype(object)
+    lignes = valeurs.where(valeurs.notna(), None).values.tolist()
+
+    arcpy.AddMessage("Enregistrement de {} champs dans la couche {}".format(len(colonnes), Streets_network))
+    with arcpy.da.UpdateCursor(Streets_network, ["LINK_ID"]+colonnes) as cursor:
+        for row in cursor:
+            position = position_liens.get(row[0])
+            if position is None:
+                continue
+            cursor.updateRow([row[0]]+lignes[position])
+
+#-------------- Index spatial en grille uniforme -----------------
+# Chaque emprise (rectangle englobant xmin, ymin, xmax, ymax) est enregistrée dans toutes les cellules de la grille qu'elle recouvre.
+# Une requête ne compare ensuite que les emprises partageant une cellule avec elle, au lieu de tester toutes les paires.
+
+def cellulesEmprises(index, xmin, ymin, xmax, ymax):
+    # Retourne, pour chaque emprise, la liste des cellules de la grille recouvertes sous forme de deux tableaux (position de l'emprise, clé de cellule)
+    taille = index["taille"]
+    cx0 = numpy.clip(numpy.floor((xmin - index["x0"])/taille).astype(numpy.int64), 0, index["nx"]-1)
+    cx1 = numpy.clip(numpy.floor((xmax - index["x0"])/taille).astype(numpy.int64), 0, index["nx"]-1)
+    cy0 = numpy.clip(numpy.floor((ymin - index["y0"])/taille).astype(numpy.int64), 0, index["ny"]-1)
+    cy1 = numpy.clip(numpy.floor((ymax - index["y0"])/taille).astype(numpy.int64), 0, index["ny"]-1)
+
+    nb_y = cy1-cy0+1
+    nb_cellules = (cx1-cx0+1)*nb_y
+    positions = numpy.repeat(numpy.arange(len(xmin)), nb_cellules)
+    rang = numpy.arange(len(positions)) - numpy.repeat(numpy.cumsum(nb_cellules)-nb_cellules, nb_cellules)
+    cx = cx0[positions] + rang//nb_y[positions]
+    cy = cy0[positions] + rang%nb_y[positions]
+    return positions, cx*index["ny"]+cy
+
+def creerIndexEmprises(xmin, ymin, xmax, ymax, taille_cellule=None):
+    # Création de l'index à partir de tableaux numpy de coordonnées des emprises
+    # Par défaut, la taille des cellules est la médiane de la plus grande dimension des emprises
+    xmin, ymin, xmax, ymax = [numpy.asarray(e, dtype=float) for e in (xmin, ymin, xmax, ymax)]
+    if taille_cellule is None:
+        dimensions = numpy.maximum(xmax-xmin, ymax-ymin)
+        taille_cellule = float(numpy.median(dimensions)) if len(dimensions) else 1.0
+    if taille_cellule <= 0:
+        taille_cellule = 1.0
+
+    index = {
+        "taille" : taille_cellule,
+        "x0" : float(xmin.min()) if len(xmin) else 0.0,
+        "y0" : float(ymin.min()) if len(ymin) else 0.0,
+        "emprises" : (xmin, ymin, xmax, ymax)
+    }
+    index["nx"] = int(math.floor((float(xmax.max()) - index["x0"])/taille_cellule))+1 if len(xmax) else 1
+    index["ny"] = int(math.floor((float(ymax.max()) - index["y0"])/taille_cellule))+1 if len(ymax) else 1
+
+    positions, cles = cellulesEmprises(index, xmin, ymin, xmax, ymax)
+    ordre = numpy.argsort(cles, kind="stable")
+    index["cles"] = cles[ordre]
+    index["positions"] = positions[ordre]
+    return index
+
+def candidatsIndexEmprises(index, xmin, ymin, xmax, ymax):
+    # Retourne les paires (position de l'emprise requête, position de l'emprise indexée) dont les emprises se recouvrent (bords inclus)
+    # Les paires sont uniques et triées par requête puis par ordre d'insertion dans l'index
+    xmin, ymin, xmax, ymax = [numpy.atleast_1d(numpy.asarray(e, dtype=float)) for e in (xmin, ymin, xmax, ymax)]
+    vide = numpy.array([], dtype=numpy.int64)
+    if len(index["cles"]) == 0 or len(xmin) == 0:
+        return vide, vide
+
+    positions_req, cles_req = cellulesEmprises(index, xmin, ymin, xmax, ymax)
+    debut = numpy.searchsorted(index["cles"], cles_req, side="left")
+    nb = numpy.searchsorted(index["cles"], cles_req, side="right") - debut
+
+    req = numpy.repeat(positions_req, nb)
+    rang = numpy.arange(len(req)) - numpy.repeat(numpy.cumsum(nb)-nb, nb)
+    idx = index["positions"][numpy.repeat(debut, nb) + rang]
+
+    # Une même paire peut apparaître dans plusieurs cellules
+    nb_index = len(index["emprises"][0])
+    paires = numpy.unique(req*nb_index + idx)
+    req = paires//nb_index
+    idx = paires%nb_index
+
+    ixmin, iymin, ixmax, iymax = index["emprises"]
+    recouvre = (xmin[req] <= ixmax[idx]) & (xmax[req] >= ixmin[idx]) & (ymin[req] <= iymax[idx]) & (ymax[req] >= iymin[idx])
+    return req[recouvre], idx[recouvre]
+
+#-------------- Proximité des points aux tronçons -----------------
+# Remplace les SummarizeNearby successifs : les segments des tronçons sont indexés une seule fois (index en grille ci-dessus),
+# puis chaque lot de points est comparé uniquement aux segments voisins avec un calcul de distance point-segment vectorisé.
+# Les coordonnées géographiques (degrés) sont converties en mètres par une projection équirectangulaire locale, suffisante à l'échelle d'une étude.
+
+rayon_terre = 6371008.8 # rayon moyen en mètres
+
+def projectionMetrique(x, y, spatial_ref, lat_ref):
+    # Retourne les coordonnées en mètres, les systèmes projetés sont supposés être déjà en mètres
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    if spatial_ref.type != "Geographic":
+        return x, y
+    return numpy.radians(x)*rayon_terre*math.cos(math.radians(lat_ref)), numpy.radians(y)*rayon_terre
+
+def creerIndexTroncons(Streets_network, distance_max):
+    # Lecture des sommets des tronçons et création de l'index des segments, élargis de la plus grande distance de recherche
+    # Les sommets sont lus partie par partie : une polyligne multipartie ne forme pas de segment entre deux de ses parties
+    sommets_x, sommets_y, sommets_lien, sommets_partie = [], [], [], []
+    numero_partie = 0
+    with verrou_arcpy:
+        spatial_ref = arcpy.Describe(Streets_network).spatialReference
+        with arcpy.da.SearchCursor(Streets_network, ["LINK_ID", "SHAPE@"], spatial_reference=spatial_ref) as cursor:
+            for link_id, geometrie in cursor:
+                if geometrie is None:
+                    continue
+                for i in range(geometrie.partCount):
+                    points = [point for point in geometrie.getPart(i) if point]
+                    sommets_x += [point.X for point in points]
+                    sommets_y += [point.Y for point in points]
+                    sommets_lien += [link_id]*len(points)
+                    sommets_partie += [numero_partie]*len(points)
+                    numero_partie += 1
+    sommets_x = numpy.asarray(sommets_x, dtype=float)
+    sommets_y = numpy.asarray(sommets_y, dtype=float)
+    sommets_partie = numpy.asarray(sommets_partie, dtype=numpy.int64)
+    lat_ref = float(numpy.mean(sommets_y)) if len(sommets_y) else 0.0
+    x, y = projectionMetrique(sommets_x, sommets_y, spatial_ref, lat_ref)
+
+    # Deux sommets consécutifs d'une même partie forment un segment
+    suite = sommets_partie[1:] == sommets_partie[:-1]
+    x0, y0, x1, y1 = x[:-1][suite], y[:-1][suite], x[1:][suite], y[1:][suite]
+    positions = positionsLiens(numpy.asarray(sommets_lien, dtype=numpy.int64)[:-1][suite])
+
+    index = creerIndexEmprises(numpy.minimum(x0, x1)-distance_max, numpy.minimum(y0, y1)-distance_max, numpy.maximum(x0, x1)+distance_max, numpy.maximum(y0, y1)+distance_max)
+    index["segments"] = (x0, y0, x1, y1)
+    index["liens"] = positions
+    index["spatial_ref"] = spatial_ref
+    index["lat_ref"] = lat_ref
+    return index
+
+def lirePoints(index_troncons, couche_points, champs=None, filtre=""):
+    # Coordonnées en mètres des points de la couche (dans le système de la couche réseau) et valeurs des champs demandés
+    with verrou_arcpy:
+        points = arcpy.da.FeatureClassToNumPyArray(couche_points, ["SHAPE@X", "SHAPE@Y"]+(champs or []), where_clause=filtre, spatial_reference=index_troncons["spatial_ref"], null_value=0)
+    x, y = projectionMetrique(points["SHAPE@X"], points["SHAPE@Y"], index_troncons["spatial_ref"], index_troncons["lat_ref"])
+    return x, y, points
+
+def distancesPointsTroncons(index_troncons, x, y, distance_max, taille_lot=100000):
+    # Retourne les paires (indice du point, position du lien) à moins de distance_max, avec la distance minimale du point au tronçon
+    # Chaque paire point/tronçon n'apparaît qu'une fois, quel que soit le nombre de segments du tronçon proches du point
+    x0, y0, x1, y1 = index_troncons["segments"]
+    nb_liens = max(len(index_liens), 1)
+
+    # Les points hors de l'emprise de l'index (réseau élargi de distance_max) ne peuvent être proches d'aucun tronçon
+    xmax = index_troncons["x0"] + index_troncons["nx"]*index_troncons["taille"]
+    ymax = index_troncons["y0"] + index_troncons["ny"]*index_troncons["taille"]
+    indices = numpy.nonzero((x >= index_troncons["x0"]) & (x <= xmax) & (y >= index_troncons["y0"]) & (y <= ymax))[0]
+
+    resultats = []
+    for lot in range(0, len(indices), taille_lot):
+        indices_lot = indices[lot:lot+taille_lot]
+        px = x[indices_lot]
+        py = y[indices_lot]
+        point, segment = candidatsIndexEmprises(index_troncons, px, py, px, py)
+
+        # Distance du point à sa projection sur le segment
+        dx = x1[segment]-x0[segment]
+        dy = y1[segment]-y0[segment]
+        longueur2 = dx*dx + dy*dy
+        t = numpy.divide((px[point]-x0[segment])*dx + (py[point]-y0[segment])*dy, longueur2, out=numpy.zeros_like(longueur2), where=longueur2 > 0)
+        t = numpy.clip(t, 0, 1)
+        distance = numpy.hypot(px[point]-(x0[segment]+t*dx), py[point]-(y0[segment]+t*dy))
+
+        lien = index_troncons["liens"][segment]
+        garde = (distance <= distance_max) & (lien >= 0)
+        cles = indices_lot[point[garde]]*nb_liens + lien[garde]
+        distance = distance[garde]
+
+        # Distance minimale par paire point/tronçon
+        ordre = numpy.lexsort((distance, cles))
+        cles = cles[ordre]
+        premier = numpy.ones(len(cles), dtype=bool)
+        premier[1:] = cles[1:] != cles[:-1]
+        resultats.append((cles[premier]//nb_liens, cles[premier]%nb_liens, distance[ordre][premier]))
+
+    if not resultats:
+        vide = numpy.array([], dtype=numpy.int64)
+        return vide, vide, numpy.array([], dtype=float)
+    return tuple(numpy.concatenate(e) for e in zip(*resultats))
+
+def plusProcheTroncon(point, lien, distance):
+    # A partir des paires retournées par distancesPointsTroncons, garde pour chaque point le tronçon le plus proche
+    ordre = numpy.lexsort((distance, point))
+    point = point[ordre]
+    premier = numpy.ones(len(point), dtype=bool)
+    premier[1:] = point[1:] != point[:-1]
+    return point[premier], lien[ordre][premier], distance[ordre][premier]
+
 
    
 #-------------- Critere Voie de Circulation -----------------
+def calcNoteVoie(field_to_lane,field_from_lane,field_lane_cat,field_dir_travel, field_phys_lane, seuil_bon, seuil_mauv):
+    # Tableaux d'une valeur par lien. LANE_CAT compte pour un sens ou les deux selon DIR_TRAVEL
+    nb_voies = numpy.asarray(field_from_lane, dtype=float) + numpy.asarray(field_to_lane, dtype=float)
+    phys_lane = numpy.asarray(field_phys_lane, dtype=float)
+    lane_cat = numpy.asarray(field_lane_cat).astype(int)
+    double_sens = numpy.asarray(field_dir_travel) == 'B'
+    sens_unique = numpy.isin(field_dir_travel, ['T','F'])
+    return numpy.select([(phys_lane >= seuil_bon) | (nb_voies >= seuil_bon) | (lane_cat > seuil_bon) | ((lane_cat >= seuil_bon) & double_sens),
+                         (phys_lane > seuil_mauv) | (nb_voies > seuil_mauv) | ((lane_cat > seuil_mauv) & sens_unique) | ((lane_cat >= seuil_mauv) & double_sens),
+                         (nb_voies <= seuil_mauv) | (lane_cat < seuil_mauv) | ((lane_cat <= seuil_mauv) & sens_unique)],
+                        [3, 2, 1], 0)
+
 def calcCritereVoie(Streets_network, seuils):  
 
     field_name = "Note_NbVoie"
-    liste_note_circulation.append(field_name)
     seuils = seuilStringToList(seuils)
-
-    Calculator_Expression = """
-def calcCritereLane(field_to_lane,field_from_lane,field_lane_cat,field_dir_travel, field_phys_lane, seuil_bon, seuil_mauv):
-    field_lane_cat = int(field_lane_cat)
-    if field_phys_lane>=seuil_bon or field_from_lane+field_to_lane>=seuil_bon or field_lane_cat > seuil_bon or (field_lane_cat >= seuil_bon and field_dir_travel == 'B'):
-        return 3
-    elif field_phys_lane > seuil_mauv or field_from_lane+field_to_lane > seuil_mauv or (field_lane_cat > seuil_mauv and field_dir_travel in ['T','F']) or (field_lane_cat >= seuil_mauv and field_dir_travel == 'B'):
-        return 2
-    elif field_from_lane+field_to_lane<=seuil_mauv or field_lane_cat < seuil_mauv or (field_lane_cat <= seuil_mauv and field_dir_travel in ['T','F']): 
-        return 1
-    else :
-        return 0
-"""
-    expression = "calcCritereLane(!FROM_LANES!,!TO_LANES!,!LANE_CAT!,!DIR_TRAVEL!,!PHYS_LANES!,"+seuils[0]+","+seuils[1]+")"
+    seuil_bon = float(seuils[0].replace(",","."))
+    seuil_mauv = float(seuils[1].replace(",","."))
 
     arcpy.AddMessage("Calcul champ : {} avec seuils {}".format(field_name, seuils))
     
-    arcpy.management.CalculateField(in_table=Streets_network, field=field_name, expression=expression, code_block=Calculator_Expression, field_type="SHORT")
+    notes = calcNoteVoie(table_attributs["TO_LANES"].to_numpy(), table_attributs["FROM_LANES"].to_numpy(), table_attributs["LANE_CAT"].to_numpy(),
+                         table_attributs["DIR_TRAVEL"].to_numpy(), table_attributs["PHYS_LANES"].to_numpy(), seuil_bon, seuil_mauv)
+    ajouterColonne(field_name, "SHORT", notes, 0)
 
     
-def calcCritereVoieVelo(Streets_network, table_lane) :
-
-    param_field_name = "BANDE_CYC"
-    field_name = "Note_NbVoie"
-    liste_note_circulation.append(field_name)
-
-
-
+def lireBandesCyclables(table_lane):
     #Création de la liste des liens ayant une piste cyclable
-    Streets_join_Lane = fr"{arcpy.env.scratchGDB}\TEMP_Streets_join_Lane"
-    
     # LANE_TYPE = 65536 : bande cyclable
     # Voir manuel Here Navstreet
-     
-    table_lane, count = arcpy.management.SelectLayerByAttribute(in_layer_or_view=table_lane, where_clause="LANE_TYP = 65536" ) 
-    
-    arcpy.management.CopyFeatures(in_features=Streets_network, out_feature_class=Streets_join_Lane)
-    arcpy.management.JoinField(in_data=Streets_join_Lane, in_field="LINK_ID", join_table=table_lane, join_field="LINK_ID")
-    # arcpy.gapro.JoinFeatures(target_layer=Streets_network, join_layer=table_lane, output=Streets_join_Lane, join_operation="JOIN_ONE_TO_MANY", attribute_relationship=[["LINK_ID", "LINK_ID"]], join_condition=join_condition)
-    # JoinFeatures fait du toolbox GeoAnalytics Server qui requiert une license
+    # Dans un lot d'études, la table Lane n'est lue qu'une fois
+    bandes_lot = donnees_lot["bandes_cyclables"] if donnees_lot is not None else dict()
+    with verrou_arcpy:
+        if table_lane not in bandes_lot:
+            with arcpy.da.SearchCursor(table_lane, ["LINK_ID"], where_clause="LANE_TYP = 65536") as cursor:
+                bandes_lot[table_lane] = [row[0] for row in cursor]
+        liens_bande = bandes_lot[table_lane]
+
+    # Test d'appartenance vectorisé sur les liens du réseau
+    return numpy.isin(index_liens, numpy.asarray(liens_bande, dtype=numpy.int64))
+
+def calcNoteVoieVelo(lane_cat, bande):
+    # lane_cat, bande : tableaux d'une valeur par lien
+    return numpy.where(lane_cat <= 1, 3, numpy.where(bande, 2, 1))
+
+def calcCritereVoieVelo(Streets_network, table_lane) :
 
-    Streets_join_Lane, count = arcpy.management.SelectLayerByAttribute(in_layer_or_view=Streets_join_Lane, where_clause="LANE_TYP = 65536" ) 
-    join_liste_link_id = unique_values(Streets_join_Lane,"LINK_ID")
+    param_field_name = "BANDE_CYC"
+    field_name = "Note_NbVoie"
 
+    bande = lireBandesCyclables(table_lane)
     
     arcpy.AddMessage("Calcul champ : {} et {}".format(param_field_name,field_name))
-    
-    #Ajout des champs si pas existants
-    if param_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, param_field_name, "String")
-    if field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_name, "LONG")
-
-    #Mise à jour des champs de la couche
-    with arcpy.da.UpdateCursor(Streets_network, ["LINK_ID","LANE_CAT",param_field_name,field_name]) as cursor:
-        for row in cursor :
-            link = str(row[0])
-            lane_cat = int(row[1])
-            if link in join_liste_link_id :
-                row[2] = "Oui"
-            else :
-                row[2] = "Non"
-            
-            if lane_cat <= 1 :
-                row[3] = 3
-            elif link in join_liste_link_id :
-                row[3] = 2
-            else :
-                row[3] = 1
-            
-            cursor.updateRow(row)
-    
-    arcpy.management.Delete(fr"{arcpy.env.scratchGDB}\TEMP_Streets_join_Lane")
+
+    notes = calcNoteVoieVelo(table_attributs["LANE_CAT"].astype(int).to_numpy(), bande)
+    ajouterColonne(param_field_name, "TEXT", numpy.where(bande, "Oui", "Non"), "Non")
+    ajouterColonne(field_name, "LONG", notes, 1)
 
 #-------------- Critere Vitesse -----------------
+def calcNoteVitesse(field_to_speed, field_from_speed, seuil_bon, seuil_mauv):
+    # Tableaux d'une valeur par lien. Une limite à 0 correspond à un sens sans limite renseignée : c'est l'autre sens qui est noté
+    to_speed = numpy.asarray(field_to_speed, dtype=float)
+    from_speed = numpy.asarray(field_from_speed, dtype=float)
+    return numpy.select([((to_speed != 0) & (to_speed <= seuil_mauv)) | ((from_speed != 0) & (from_speed <= seuil_mauv)) | ((from_speed <= seuil_mauv) & (to_speed <= seuil_mauv)),
+                         ((to_speed != 0) & (to_speed < seuil_bon)) | ((from_speed != 0) & (from_speed < seuil_bon)) | ((from_speed < seuil_bon) & (to_speed < seuil_bon)),
+                         (to_speed >= seuil_bon) | (from_speed >= seuil_bon)],
+                        [1, 2, 3], 0)
+
 def calcCritereVitesse(Streets_network,seuils):  
 
     field_name = "Note_Vitesse"
-    liste_note_circulation.append(field_name)
 
     seuils = seuilStringToList(seuils)
-
-    Calculator_Expression = """
-def calcCritereVitesse(field_to_speed, field_from_speed, seuil_bon, seuil_mauv):
-    if (field_to_speed != 0 and field_to_speed <= seuil_mauv) or (field_from_speed != 0 and field_from_speed <= seuil_mauv) or (field_from_speed<=seuil_mauv and field_to_speed<=seuil_mauv):
-        return 1
-    elif (field_to_speed != 0 and field_to_speed < seuil_bon) or (field_from_speed != 0 and field_from_speed < seuil_bon) or (field_from_speed < seuil_bon and field_to_speed < seuil_bon): 
-        return 2
-    elif (field_to_speed >= seuil_bon) or (field_from_speed >= seuil_bon) or (field_from_speed >= seuil_bon and field_to_speed >= seuil_bon):
-        return 3
-    else :
-        return 0
-"""
-    expression = "calcCritereVitesse(!TO_SPD_LIM!, !FR_SPD_LIM!,"+seuils[0]+","+seuils[1]+")"
+    seuil_bon = float(seuils[0].replace(",","."))
+    seuil_mauv = float(seuils[1].replace(",","."))
     
     arcpy.AddMessage("Calcul champ : {} avec seuils {}".format(field_name, seuils))
     
-    arcpy.management.CalculateField(in_table=Streets_network, field=field_name, expression=expression, code_block=Calculator_Expression, field_type="SHORT")
+    notes = calcNoteVitesse(table_attributs["TO_SPD_LIM"].to_numpy(), table_attributs["FR_SPD_LIM"].to_numpy(), seuil_bon, seuil_mauv)
+    ajouterColonne(field_name, "SHORT", notes, 0)
 
 
 
@@ -170,81 +433,224 @@ def getTileID(lat, long, level):
     tile_id = math.floor(tileY * 2 * math.pow(2, level) + tileX)
     return tile_id
 
+def getTileIDs(lat, long, level):
+    # Version vectorisée de getTileID, pour des tableaux numpy de coordonnées
+    tile_size = 180 / math.pow(2,level)
+    tileY = numpy.floor((numpy.asarray(lat, dtype=float)  +  90) / tile_size).astype(numpy.int64)
+    tileX = numpy.floor((numpy.asarray(long, dtype=float) + 180) / tile_size).astype(numpy.int64)
+    return tileY * 2 * int(math.pow(2, level)) + tileX
+
+def calcPlanTuiles(lat, long, func_class):
+    # Calcul des tuiles réellement touchées par les sommets des tronçons
+    # Les routes de classe n (FUNC_CLASS) sont dans la couche ADAS_ATTRIB_FCn, découpée en tuiles de niveau n+8
+    # Retourne deux listes alignées (couches, tileID), sans doublon et triées par couche puis par tileID
+    lat = numpy.asarray(lat, dtype=float)
+    long = numpy.asarray(long, dtype=float)
+    func_class = numpy.asarray(func_class).astype(numpy.int64)
+
+    layer_list = []
+    tileID_list = []
+    for fc in range(1,6):
+        masque = func_class == fc
+        tile_ids = numpy.unique(getTileIDs(lat[masque], long[masque], fc+8))
+        layer_list += ["ADAS_ATTRIB_FC"+str(fc)]*len(tile_ids)
+        tileID_list += tile_ids.tolist()
+    return layer_list, tileID_list
+
+#-------------- Téléchargement des tuiles d'attributs HERE -----------------
+url_attributs_here = "https://smap.hereapi.com/v8/maps/attributes"
+
+def creerSessionHere(nb_connexions, nb_essais, facteur_attente):
+    # Session avec connexions persistantes (keep-alive) réutilisées d'une requête à l'autre
+    # Nouvelle tentative avec attente exponentielle (facteur_attente * 2^n secondes) sur les réponses 429 et 5xx, en respectant l'entête Retry-After
+    retry = Retry(total=nb_essais, backoff_factor=facteur_attente, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"], respect_retry_after_header=True)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=nb_connexions, pool_maxsize=nb_connexions, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def telechargerTuilesHere(requetes, cle_api, url=url_attributs_here, nb_workers=8, nb_essais=5, facteur_attente=0.5, timeout=60):
+    # Téléchargement des lots de tuiles avec au plus nb_workers requêtes simultanées
+    # requetes : liste de tuples (liste des couches, liste des tileID), une requête par tuple
+    # Retourne le dictionnaire fusionné {"Tiles" : [...]} dans l'ordre des requêtes, indépendamment de l'ordre d'arrivée des réponses
+    # L'url peut être remplacée par celle d'un serveur local pour tester le téléchargement
+
+    # Une session par thread, requests.Session n'étant pas garanti thread-safe
+    sessions = threading.local()
+
+    def requeteLot(lot):
+        layer_batch, tileID_batch = lot
+        if not hasattr(sessions, "session"):
+            sessions.session = creerSessionHere(nb_workers, nb_essais, facteur_attente)
+        # Paramètre au format de la requête : "tile:AAAA,BBBB,CCCC,..."
+        with sessions.session.get(url, params={
+            "layers" : layer_batch,
+            "in" : "tile:"+",".join(str(tile) for tile in tileID_batch),
+            "apiKey": cle_api
+        }, stream=True, timeout=timeout) as data:
+            data.raise_for_status()
+            # Lecture du JSON directement depuis le flux de la réponse
+            data.raw.decode_content = True
+            return json.load(data.raw).get("Tiles", [])
+
+    # Les réponses sont traitées dans l'ordre d'arrivée : une requête lente ne retarde pas les suivantes
+    # Les tuiles sont rangées par requête, puis fusionnées dans l'ordre des requêtes
+    tiles_requetes = [None]*len(requetes)
+    with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+        futures = {executor.submit(requeteLot, lot) : i for i, lot in enumerate(requetes)}
+        for future in as_completed(futures):
+            tiles_requetes[futures[future]] = future.result()
+    merge_data = {"Tiles" : []}
+    for tiles in tiles_requetes:
+        merge_data.get("Tiles").extend(tiles)
+    return merge_data
+
+#-------------- Cache local des tuiles d'attributs HERE -----------------
+# Les tuiles sont conservées dans une base SQLite, une ligne par (couche, tileID), avec le JSON compressé des tuiles retournées par l'API
+# Une tuile sans données est aussi enregistrée (liste vide) pour ne pas être redemandée
+# duree_cache_jours : durée de validité d'une tuile, au-delà elle est téléchargée à nouveau
+# taille_max_cache : taille maximale (octets) du contenu du cache, les tuiles les moins récemment lues sont supprimées en premier (LRU)
+
+duree_cache_tuiles_jours = 180
+
+def ouvrirCacheTuiles(chemin_cache):
+    connexion = sqlite3.connect(chemin_cache)
+    connexion.execute("CREATE TABLE IF NOT EXISTS tuiles (couche TEXT, tile_id INTEGER, contenu BLOB, date_maj REAL, date_acces REAL, taille INTEGER, PRIMARY KEY (couche, tile_id))")
+    return connexion
+
+def lireCacheTuiles(connexion, cles, duree_cache_jours):
+    # Retourne un dictionnaire {(couche, tileID) : liste des tuiles} pour les clés présentes et encore valides
+    date_limite = time.time() - duree_cache_jours*86400
+    tuiles_cache = {}
+    for couche, tile_id in cles:
+        row = connexion.execute("SELECT contenu FROM tuiles WHERE couche = ? AND tile_id = ? AND date_maj >= ?", (couche, tile_id, date_limite)).fetchone()
+        if row is not None:
+            tuiles_cache[(couche, tile_id)] = json.loads(zlib.decompress(row[0]))
+    if tuiles_cache:
+        with connexion:
+            connexion.executemany("UPDATE tuiles SET date_acces = ? WHERE couche = ? AND tile_id = ?", [(time.time(), couche, tile_id) for couche, tile_id in tuiles_cache])
+    return tuiles_cache
+
+def ecrireCacheTuiles(connexion, tuiles_par_cle, taille_max_cache):
+    maintenant = time.time()
+    lignes = []
+    for (couche, tile_id), tiles in tuiles_par_cle.items():
+        contenu = zlib.compress(json.dumps(tiles).encode("utf-8"))
+        lignes.append((couche, tile_id, contenu, maintenant, maintenant, len(contenu)))
+    with connexion:
+        connexion.executemany("INSERT OR REPLACE INTO tuiles VALUES (?, ?, ?, ?, ?, ?)", lignes)
+
+        # Eviction LRU si la taille maximale est dépassée
+        taille_totale = connexion.execute("SELECT COALESCE(SUM(taille), 0) FROM tuiles").fetchone()[0]
+        if taille_totale > taille_max_cache:
+            a_supprimer = []
+            for couche, tile_id, taille in connexion.execute("SELECT couche, tile_id, taille FROM tuiles ORDER BY date_acces ASC"):
+                if taille_totale <= taille_max_cache:
+                    break
+                a_supprimer.append((couche, tile_id))
+                taille_totale -= taille
+            connexion.executemany("DELETE FROM tuiles WHERE couche = ? AND tile_id = ?", a_supprimer)
+
+def etatCacheTuiles(chemin_cache):
+    # Nombre de tuiles du cache et date de la plus récente, None si le cache n'existe pas (empreinte du critère Pente)
+    # La date de dernière lecture (date_acces) n'en fait pas partie : relire le cache ne le modifie pas
+    if not chemin_cache or not os.path.exists(chemin_cache):
+        return None
+    connexion = ouvrirCacheTuiles(chemin_cache)
+    try:
+        return list(connexion.execute("SELECT COUNT(*), MAX(date_maj) FROM tuiles").fetchone())
+    finally:
+        connexion.close()
+
+def cleTuileHere(tile):
+    # Identifie une tuile de la réponse de l'API par sa couche et son tileID (même calcul que getTileID)
+    # Retourne None si la réponse ne contient pas ces informations
+    try:
+        level = int(tile["Level"])
+        return tile["Layer"], int(tile["TileY"])*2*int(math.pow(2, level)) + int(tile["TileX"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def chargerTuilesHere(layer_list, tileID_list, cle_api, chemin_cache=None, duree_cache_jours=duree_cache_tuiles_jours, taille_max_cache=500*1024*1024, hors_ligne=False, batch_size=64):
+    # Retourne le dictionnaire fusionné {"Tiles" : [...]} des tuiles demandées, dans l'ordre de layer_list/tileID_list
+    # Seules les tuiles absentes du cache sont téléchargées. En mode hors ligne, aucune requête n'est envoyée et les tuiles manquantes sont ignorées.
+    cles = list(zip(layer_list, tileID_list))
+    connexion = ouvrirCacheTuiles(chemin_cache) if chemin_cache else None
+    tuiles_par_cle = lireCacheTuiles(connexion, set(cles), duree_cache_jours) if connexion else {}
+
+    manquantes = list(dict.fromkeys(cle for cle in cles if cle not in tuiles_par_cle))
+    arcpy.AddMessage("Tuiles HERE : {} en cache, {} à télécharger".format(len(set(cles))-len(manquantes), len(manquantes)))
+
+    if manquantes and hors_ligne:
+        arcpy.AddWarning("Mode hors ligne : {} tuiles absentes du cache ne sont pas prises en compte".format(len(manquantes)))
+    elif manquantes:
+        # Découpage en lots de 64 tuiles, téléchargés en parallèle
+        requetes = []
+        for batch in range(0, len(manquantes), batch_size) :
+            lot = manquantes[batch: batch + batch_size]
+            requetes.append(([e[0] for e in lot], [e[1] for e in lot]))
+        merge_data = telechargerTuilesHere(requetes, cle_api)
+
+        # Répartition des tuiles reçues par clé. Les tuiles demandées mais absentes de la réponse n'ont pas de données.
+        telechargees = {cle : [] for cle in manquantes}
+        identifiees = True
+        for tile in merge_data.get("Tiles"):
+            cle = cleTuileHere(tile)
+            if cle not in telechargees:
+                identifiees = False
+                break
+            telechargees[cle].append(tile)
+
+        if identifiees:
+            tuiles_par_cle.update(telechargees)
+            if connexion:
+                ecrireCacheTuiles(connexion, telechargees, taille_max_cache)
+        else:
+            # Réponse impossible à répartir par tuile : utilisée telle quelle, sans mise en cache
+            arcpy.AddWarning("Tuiles HERE non identifiables dans la réponse, pas de mise en cache")
+            if connexion:
+                connexion.close()
+            return {"Tiles" : [tile for cle in cles if cle in tuiles_par_cle for tile in tuiles_par_cle[cle]] + merge_data.get("Tiles")}
+
+    if connexion:
+        connexion.close()
+
+    merge_data = {"Tiles" : []}
+    for cle in dict.fromkeys(cles):
+        merge_data.get("Tiles").extend(tuiles_par_cle.get(cle, []))
+    return merge_data
+
 #-------------- Critere Pente -----------------
-def calcCriterePente(Streets_network, seuils):
+def calcNotePente(max_slope, seuil_bon, seuil_mauv):
+    # max_slope : tableau des pentes maximales (%)
+    return noteBandesDecroissantes(max_slope, seuil_bon, seuil_mauv)
+
+def calcCriterePente(Streets_network, seuils, chemin_cache=None, hors_ligne=False):
        
     
     param_field_name = "PENTE_MAX"
     field_name = "Note_Pente"
-    liste_note_accessibilite.append(field_name)
 
     seuils = seuilStringToList(seuils)
     
     #Création d'une liste d'identifiants de tuile (tileID) et d'une liste de couche
+    # à partir des sommets des tronçons étudiés et de leur classe de route
+    with verrou_arcpy:
+        sommets = arcpy.da.FeatureClassToNumPyArray(Streets_network, ["FUNC_CLASS", "SHAPE@X", "SHAPE@Y"], explode_to_points=True)
+    layer_list, tileID_list = calcPlanTuiles(sommets["SHAPE@Y"], sommets["SHAPE@X"], sommets["FUNC_CLASS"])
 
-    # Etendue de la zone étudiée 
-    xmin = describe.extent.XMin
-    xmax = describe.extent.XMax
-    ymin = describe.extent.YMin
-    ymax = describe.extent.YMax
-
-    tileID_list = []
-    layer_list = []
-    batch_size = 64
-    merge_data = {"Tiles" :[]}
-
-    # Pour chaque niveau (level), création d'un quadrillage de point 
-    # Itération sur les point pour d'obtenir l'identifiant des tuiles sur lesquelles ils sont (avec getTileID)
-    # Ajout de la couche d'attribut qui sera appelé en requête (ex : ADAS_ATTRIBUT_FC2 = Attribut ADAS pour les routes de classes 2)
-    for level in range(10,14):
-        tile_size = 180 / math.pow(2,level)
-        lat = ymin
-        while lat <= ymax+tile_size:
-            long = xmin
-            while long <= xmax+tile_size:
-                tileID_list.append(getTileID(lat,long,level))
-                long += tile_size
-                layer_list.append("ADAS_ATTRIB_FC"+str(level-8))
-            lat += tile_size
-    
-    # Préparation du paramètre au format de la requête : "tile:AAAA,BBBB,CCCC,..."
-    for batch in range(0, len(layer_list), batch_size) :
-        layer_batch = layer_list[batch: batch + batch_size]
-        tileID_batch = tileID_list[batch: batch + batch_size]
-
-        in_string = "tile:"
-
-        for tile in tileID_batch:
-
-            in_string = in_string+str(tile)+","
-
-        in_string=in_string[:-1]
-
-        url_tile = "https://smap.hereapi.com/v8/maps/attributes"
-
-        data = requests.get(url_tile, params={
-            "layers" : layer_batch,
-            "in" : in_string,
-            "apiKey": apiKey
-        })
-
-        data_json = data.json()
-        data_dict = json.loads(data.text)
-        merge_data.get("Tiles").extend(data_dict.get("Tiles"))
-        merge_json = json.dumps(merge_data, indent=4)
+    merge_data = chargerTuilesHere(layer_list, tileID_list, apiKey, chemin_cache=chemin_cache, hors_ligne=hors_ligne)
         
 
     slope_data_dict={}
     
     arcpy.AddMessage("Calcul champ : {} et {} avec seuils {}".format(param_field_name, field_name, seuils))
     
-    # Transformation du résultat de la requête en dictionnaire 
-    # {link_id : 
-    #   {"PENTE_MAX" : max_slope,
-    #    "Note_Pente" : note_slope}}
+    # Transformation du résultat de la requête en dictionnaire {link_id : max_slope}
     # 
     # La requête retourne une liste de valeurs de pente en degré pour chaque LINK. Seul la valeur max est gardées et est transformées en pourcent
-    # Une note est attribuée en fonction de la pente max 
+    # Une note est attribuée en fonction de la pente max, sur toute la colonne
     for tile in merge_data.get("Tiles"):
         for row in tile.get("Rows"):
             slope_list_str = row.get("SLOPES").split(",")
@@ -255,40 +661,118 @@ def calcCriterePente(Streets_network, seuils):
                     max_slope_deg = slope_deg
                 
             max_slope = math.tan(math.radians(max_slope_deg))*100
+            slope_data_dict[int(row.get("LINK_ID"))] = max_slope
+
+    notes = calcNotePente(list(slope_data_dict.values()), float(seuils[0]), float(seuils[1]))
+    
+    # Les liens sans donnée de pente ont une pente nulle et la note maximale
+    ajouterColonne(param_field_name, "DOUBLE", slope_data_dict, 0)
+    ajouterColonne(field_name, "LONG", dict(zip(slope_data_dict, notes.tolist())), 3)
+
+#-------------- Jointure en mémoire des tables HERE -----------------
+# Remplace la copie du réseau et les JoinField dans la scratchGDB : seules les colonnes utiles de Cdms, CndMod et CdmsDtmod sont lues,
+# restreintes aux liens de l'étude, puis jointes par table de hachage (pandas.merge) sur LINK_ID et COND_ID.
+
+def lireTableFiltree(table, champs, champ_filtre, valeurs):
+    # Lecture des colonnes "champs" de la table, en ne gardant que les lignes dont "champ_filtre" (entier) est dans l'ensemble "valeurs"
+    i = champs.index(champ_filtre)
+    with verrou_arcpy, arcpy.da.SearchCursor(table, champs) as cursor:
+        lignes = [row for row in cursor if row[i] is not None and int(row[i]) in valeurs]
+    return pandas.DataFrame(lignes, columns=champs)
+
+def joindreTablesHere(Cdms, CndMod, CdmsDtmod, liens_etude):
+    # liens_etude : ensemble des LINK_ID (entiers) du réseau étudié
+    # Retourne deux DataFrame :
+    #   "conditions" : conditions Cdms des liens étudiés avec leurs modifiers CndMod (LINK_ID, COND_ID, COND_TYPE, MOD_TYPE, MOD_VAL, COND_VAL1)
+    #                  utilisé pour les indicateurs "Type de Carrefour", "Obstacle", "Gabarit"
+    #   "horaires" : restrictions horaires CdmsDtmod des liens étudiés avec les champs AR_AUTO, AR_TRUCKS, AR_DELIVER de leur condition Cdms
+    #                utilisé pour l'indicateur Horaire
+    # CndMod ou CdmsDtmod à None : table non lue (aucun critère actif ne l'utilise), le DataFrame correspondant est vide
+    cdms = lireTableFiltree(Cdms, ["LINK_ID", "COND_ID", "COND_TYPE", "COND_VAL1", "AR_AUTO", "AR_TRUCKS", "AR_DELIVER"], "LINK_ID", liens_etude)
+    champs_cndmod = ["COND_ID", "MOD_TYPE", "MOD_VAL"]
+    cndmod = lireTableFiltree(CndMod, champs_cndmod, "COND_ID", {int(e) for e in cdms["COND_ID"]}) if CndMod is not None else pandas.DataFrame(columns=champs_cndmod)
+    champs_dtmod = ["LINK_ID", "COND_ID", "DTTME_TYPE", "REF_DATE", "STARTTIME", "ENDTIME"]
+    dtmod = lireTableFiltree(CdmsDtmod, champs_dtmod, "LINK_ID", liens_etude) if CdmsDtmod is not None else pandas.DataFrame(columns=champs_dtmod)
+
+    conditions = cdms[["LINK_ID", "COND_ID", "COND_TYPE", "COND_VAL1"]].merge(cndmod, on="COND_ID", how="left")
+    conditions = conditions[["LINK_ID", "COND_ID", "COND_TYPE", "MOD_TYPE", "MOD_VAL", "COND_VAL1"]]
+
+    # Les champs AR_* sont propres à la condition, une seule ligne par COND_ID suffit
+    acces = cdms[["COND_ID", "AR_AUTO", "AR_TRUCKS", "AR_DELIVER"]].drop_duplicates(subset="COND_ID")
+    horaires = dtmod.merge(acces, on="COND_ID", how="left")
+
+    arcpy.AddMessage("Jointure en mémoire : {} lignes conditions, {} lignes horaires".format(len(conditions), len(horaires)))
+    return {"conditions" : conditions, "horaires" : horaires}
+
+#-------------- Lecture unique des conditions Cdms/CndMod -----------------
+# Les critères Carrefour, Obstacle et Gabarit lisent tous les conditions HERE (Cdms) et leurs modifiers (CndMod).
+# Chaque ligne (LINK_ID, COND_ID, COND_TYPE, MOD_TYPE, MOD_VAL, COND_VAL1) n'est lue qu'une fois et transmise, selon son COND_TYPE, 
+# aux fonctions d'accumulation des critères concernés. Chaque fonction applique ensuite le filtre propre à son critère (ancienne where_clause).
+# Voir manuel Here Navstreet pour la signification des codes
+
+def accumulerCarrefour(carr_dict, link_id, cond_id, cond_type, mod_type, mod_val, cond_val1):
+    # COND_TYPE = 16 : Traffic Signal
+    # COND_TYPE = 17 : Traffic Sign et MOD_TYPE = 22 : Traffic Sign Type
+    # MOD_VAL = '20' : Stop Sign
+    # MOD_VAL = '37' : Crossing with priority to the right
+    # MOD_VAL = '42' : Yield
+    # Assignation du type en valeur nominale, avec la note. La dernière condition lue pour un link est gardée.
+    if cond_type == 16:
+        carr_dict[link_id] = ("Feux", 2)
+    elif cond_type == 17 and mod_type == 22 and str(mod_val) in ('20', '37', '42'):
+        mod_val = int(mod_val)
+        if mod_val == 20 :
+            carr_dict[link_id] = ("Stop", 1)
+        elif mod_val == 37 :
+            carr_dict[link_id] = ("Priorité droite", 2)
+        else :
+            carr_dict[link_id] = ("Cédez passage", 2)
 
-            note_slope = 0
-            if max_slope <= float(seuils[0]) :
-                note_slope = 3
-            elif max_slope < float(seuils[1]) :
-                note_slope = 2
-            elif max_slope >= float(seuils[1]) :
-                note_slope = 1
-            else:
-                note_slope = 0
-
-            dict_i = {
-                param_field_name : max_slope,
-                field_name : note_slope
-            }
-            slope_data_dict[int(row.get("LINK_ID"))] = dict_i
-    
-
-    #Ajout des champs si pas existants
-    if param_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, param_field_name, "DOUBLE")
-    if field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_name, "LONG")
+def accumulerObstacle(obs_dict, link_id, cond_id, cond_type, mod_type, mod_val, cond_val1):
+    # COND_TYPE = 10 : Special Speed Situation et COND_VAL1 = SPEED BUMPS PRESENT' : Special Speed Type = Speed Bumps Present
+    # COND_TYPE = 17 : Traffic Sign et MOD_VAL='41' : Pedestrian Crossing
+    # COND_TYPE = 18 : Railway Crossing
+    # Ensemble des conditions obstacle par link : une condition avec plusieurs modifiers n'est comptée qu'une fois
+    if (cond_type == 10 and cond_val1 == 'SPEED BUMPS PRESENT') or (cond_type == 17 and str(mod_val) == '41') or cond_type == 18:
+        obs_dict.setdefault(link_id, set()).add(cond_id)
 
-    #Mise à jour des champs de la couche
-    with arcpy.da.UpdateCursor(Streets_network, ["LINK_ID",param_field_name,field_name]) as cursor:
-        for row in cursor :
-            if row[0] in slope_data_dict.keys() :
-                row[1] = slope_data_dict[row[0]][param_field_name]
-                row[2] = slope_data_dict[row[0]][field_name]
-            else :
-                row[1] = 0
-                row[2] = 3
-            cursor.updateRow(row)
+def accumulerGabarit(gabarit_dict, link_id, cond_id, cond_type, mod_type, mod_val, cond_val1):
+    # COND_TYPE = 23 : Transport Access Restriction
+    # MOD_TYPE = 41 : Height Restriction
+    # MOD_TYPE = 42 : Weight Restriction
+    # MOD_TYPE = 43 : Weight per Axle
+    # MOD_TYPE = 44 : Length Restriction
+    # MOD_TYPE = 45 : Width Restriction
+    # Valeur de restriction par link et par type, la dernière valeur lue pour un type est gardée
+    if cond_type == 23 and mod_type in (41, 42, 43, 44, 45):
+        gabarit_dict.setdefault(link_id, {})[mod_type] = mod_val
+
+# Table de répartition : COND_TYPE -> critères intéressés
+repartition_conditions = {
+    10 : [("Obstacle", accumulerObstacle)],
+    16 : [("Carrefour", accumulerCarrefour)],
+    17 : [("Carrefour", accumulerCarrefour), ("Obstacle", accumulerObstacle)],
+    18 : [("Obstacle", accumulerObstacle)],
+    23 : [("Gabarit", accumulerGabarit)]
+}
+
+def classerConditions(lignes):
+    # lignes : itérable de tuples (LINK_ID, COND_ID, COND_TYPE, MOD_TYPE, MOD_VAL, COND_VAL1)
+    # Retourne les agrégats par critère et par link :
+    # {"Carrefour" : {link_id : (type, note)},
+    #  "Obstacle" : {link_id : ensemble des COND_ID obstacle},
+    #  "Gabarit" : {link_id : {MOD_TYPE : MOD_VAL}}}
+    conditions = {"Carrefour" : {}, "Obstacle" : {}, "Gabarit" : {}}
+    for link_id, cond_id, cond_type, mod_type, mod_val, cond_val1 in lignes:
+        for critere, accumuler in repartition_conditions.get(cond_type, []):
+            accumuler(conditions[critere], link_id, cond_id, cond_type, mod_type, mod_val, cond_val1)
+    return conditions
+
+def classerConditionsCdmsMod(df_conditions):
+    # Lecture unique des conditions jointes (voir joindreTablesHere) pour les trois critères
+    # Seuls les COND_TYPE de la table de répartition sont parcourus
+    df_conditions = df_conditions[df_conditions["COND_TYPE"].isin(list(repartition_conditions))]
+    return classerConditions(df_conditions[["LINK_ID","COND_ID","COND_TYPE","MOD_TYPE","MOD_VAL","COND_VAL1"]].itertuples(index=False, name=None))
 
 def calcNoteGabarit(field_mod_val, seuil_bon, seuil_mauv):
     # Evalue la valeur du modifiers en fonction de seuils et retourne la note
@@ -303,477 +787,593 @@ def calcNoteGabarit(field_mod_val, seuil_bon, seuil_mauv):
         return 3
         
 #-------------- Critere Gabarit ----------------- #
-def calcCritereGabarit(Streets_network, Streets_join_CdmsMod, seuils):
+def calcCritereGabarit(Streets_network, conditions, seuils):
 
     param_field_name_list = ["LIM_HAUT", "LIM_POIDS", "LIM_ChESSIEU","LIM_LONG","LIM_LARG"]
+    mod_type_list = [41, 42, 43, 44, 45]
     field_name = "Note_Gabarit"
-    liste_note_accessibilite.append(field_name)
 
     seuils = seuilStringToList(seuils)
     arcpy.AddMessage("Calcul champ : {} et {} avec seuils {}".format(param_field_name_list,field_name, seuils))
 
-    # COND_TYPE = 23 : Transport Access Restriction
-    # MOD_TYPE = 41 : Height Restriction
-    # MOD_TYPE = 42 : Weight Restriction
-    # MOD_TYPE = 43 : Weight per Axle
-    # MOD_TYPE = 44 : Length Restriction
-    # MOD_TYPE = 45 : Width Restriction
-    # Voir manuel Here Navstreet
-    where_clause = "COND_TYPE = 23 AND (MOD_TYPE = 41 OR MOD_TYPE = 42 OR MOD_TYPE = 43 OR MOD_TYPE = 44 OR MOD_TYPE = 45)"
-
     gabarit_dict = dict()
     
-    #Itération sur les LINK et mise à jour du dictionnaire des restrictions
-    with arcpy.da.SearchCursor(Streets_join_CdmsMod, ["LINK_ID","COND_TYPE","MOD_TYPE", "MOD_VAL"], where_clause=where_clause) as cursor :
-
-        for row in cursor :
-            link_id = str(row[0])
-            
-            if link_id not in liste_link_id:
-                continue
-            
-            if link_id not in gabarit_dict.keys():
-                gabarit_dict[link_id]={"note" : [3,3,3,3,3]}
-            if row[2] == 41:
-                gabarit_dict[link_id][param_field_name_list[0]] = str(row[3])
-                gabarit_dict[link_id]["note"][0] = calcNoteGabarit(row[3], seuils[0], seuils[1])
-            else :
-                gabarit_dict[link_id][param_field_name_list[0]] = "Aucun"
-            if row[2] == 42:
-                gabarit_dict[link_id][param_field_name_list[1]] = str(row[3])
-                gabarit_dict[link_id]["note"][1] = calcNoteGabarit(row[3], seuils[2],seuils[3])
-            else :
-                gabarit_dict[link_id][param_field_name_list[1]] = "Aucun"
-            if row[2] == 43:
-                gabarit_dict[link_id][param_field_name_list[2]] = str(row[3])
-                gabarit_dict[link_id]["note"][2] = calcNoteGabarit(row[3], seuils[4],seuils[5])
-            else :
-                gabarit_dict[link_id][param_field_name_list[2]] = "Aucun"
-            if row[2] == 44:
-                gabarit_dict[link_id][param_field_name_list[3]] = str(row[3])
-                gabarit_dict[link_id]["note"][3] = calcNoteGabarit(row[3], seuils[6],seuils[7])
-            else :
-                gabarit_dict[link_id][param_field_name_list[3]] = "Aucun"
-            if row[2] == 45:
-                gabarit_dict[link_id][param_field_name_list[4]] = str(row[3])
-                gabarit_dict[link_id]["note"][4] = calcNoteGabarit(row[3], seuils[8],seuils[9])
+    # Valeur et note de chaque restriction, la note du link est la plus mauvaise des notes de restriction
+    for link_id, restrictions in conditions["Gabarit"].items() :
+        
+        if link_id not in position_liens:
+            continue
+        
+        gabarit_dict[link_id]={"note" : [3,3,3,3,3]}
+        for i in range(5):
+            if mod_type_list[i] in restrictions:
+                gabarit_dict[link_id][param_field_name_list[i]] = str(restrictions[mod_type_list[i]])
+                gabarit_dict[link_id]["note"][i] = calcNoteGabarit(restrictions[mod_type_list[i]], seuils[2*i], seuils[2*i+1])
             else :
-                gabarit_dict[link_id][param_field_name_list[4]] = "Aucun"
-            
+                gabarit_dict[link_id][param_field_name_list[i]] = "Aucun"
 
     for link in gabarit_dict:
         gabarit_dict[link][field_name] = min(gabarit_dict[link]["note"])
 
-    
-    #Ajout des champs si pas existants
+    # Les liens sans restriction ont la note maximale
     for param_field_name in param_field_name_list :
-        if param_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-            arcpy.management.AddField(Streets_network, param_field_name, "STRING")
-        
-    if field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_name, "LONG")
-
-   #Mise à jour des champs de la couche
-    with arcpy.da.UpdateCursor(Streets_network, ["LINK_ID"]+param_field_name_list+[field_name]) as cursor:
-        for row in cursor:
-            link_id = str(row[0])
-            if link_id in gabarit_dict.keys():
-                for i in range(1,6):
-                    row[i] = gabarit_dict[link_id][param_field_name_list[i-1]]
-                row[6] = gabarit_dict[link_id][field_name]
-            else :
-                for i in range(1,6):
-                    row[i] = "Aucun"
-                row[6] = 3
-            cursor.updateRow(row)
+        ajouterColonne(param_field_name, "TEXT", {link : e[param_field_name] for link, e in gabarit_dict.items()}, "Aucun")
+    ajouterColonne(field_name, "LONG", {link : e[field_name] for link, e in gabarit_dict.items()}, 3)
 
 #-------------- Critere Obstacle -----------------
-def calcCritereObstacle(Streets_network, Streets_join_CdmsMod, seuils):
+def calcNoteObstacle(compte, seuil_bon, seuil_mauv):
+    # compte : tableau du nombre d'obstacles par lien
+    return noteBandesDecroissantes(compte, seuil_bon, seuil_mauv)
 
-    # COND_TYPE = 10 : Special Speed Situation et COND_VAL1 = SPEED BUMPS PRESENT' : Special Speed Type = Speed Bumps Present
-    # COND_TYPE = 17 : Traffic Sign et MOD_VAL='41' : Pedestrian Crossing
-    # COND_TYPE = 18 : Railway Crossing
-    # Voir manuel Here Navstreet
-    where_clause = "(COND_TYPE=10 AND COND_VAL1='SPEED BUMPS PRESENT') OR (COND_TYPE=17 AND MOD_VAL='41') OR COND_TYPE=18"
+def calcCritereObstacle(Streets_network, conditions, seuils):
     
     param_field_name = "NB_OBSTACLE"
     field_name = "Note_Obstacle"
-    liste_note_circulation.append(field_name)
 
     seuils = seuilStringToList(seuils)
     arcpy.AddMessage("Calcul champ : {} et {} avec seuils {}".format(param_field_name, field_name, seuils))
 
-    # Compte du nombre d'obstacle par link et évaluation de la note
-    # Assignation dans un dictionnaire
-    # {link_id : 
-    #   {"NB_OBSTACLE" : compte,
-    #    "Note_Obstacle" : note}}
-    obs_dict = dict()
-    with arcpy.da.SearchCursor(Streets_join_CdmsMod, ["LINK_ID","COND_TYPE", "MOD_VAL"], where_clause=where_clause) as cursor :
-        for row in cursor :
-            link_id = str(row[0])
-            if link_id in obs_dict.keys():
-                obs_dict[link_id][param_field_name] += 1
-            else :
-                obs_dict[link_id] = {param_field_name: 1}
-    for link in obs_dict.keys():
-        compte = obs_dict[link][param_field_name]
-        if (compte <= int(seuils[0])):
-            obs_dict[link][field_name] = 3
-        elif (compte < int(seuils[1])):
-            obs_dict[link][field_name] = 2
-        elif (compte >= int(seuils[1])):
-            obs_dict[link][field_name] = 1
-        else:
-            obs_dict[link][field_name] = 0
+    # Evaluation de la note d'après le compte du nombre d'obstacle par link {link_id : compte}
+    obs_dict = {link : len(cond_ids) for link, cond_ids in conditions["Obstacle"].items()}
+    notes = calcNoteObstacle(list(obs_dict.values()), int(seuils[0]), int(seuils[1]))
     
-    #Ajout des champs si pas existants
-    if param_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, param_field_name, "LONG")
-    if field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_name, "LONG")
-
-    #Mise à jour des champs de la couche
-    with arcpy.da.UpdateCursor(Streets_network, ["LINK_ID",param_field_name,field_name]) as cursor:
-        for row in cursor :
-            link_str = str(row[0])
-            if link_str in obs_dict.keys() :
-                row[1] = obs_dict[link_str][param_field_name]
-                row[2] = obs_dict[link_str][field_name]
-            else :
-                row[1] = 0
-                row[2] = 3
-            cursor.updateRow(row)
+    # Les liens sans obstacle ont la note maximale
+    ajouterColonne(param_field_name, "LONG", obs_dict, 0)
+    ajouterColonne(field_name, "LONG", dict(zip(obs_dict, notes.tolist())), 3)
 
 #-------------- Critere Carrefour -----------------
-def calcCritereCarrefour(Streets_network, Streets_join_CdmsMod): 
-
-    # COND_TYPE = 16 : Traffic Signal
-    # COND_TYPE = 17 : Traffic Sign et MOD_TYPE = 22 : Traffic Sign Type
-    # MOD_VAL = '20' : Stop Sign
-    # MOD_VAL = '37' : Crossing with priority to the right
-    # MOD_VAL = '42' : Yield
-    # Voir manuel Here Navstreet
-    where_clause = "COND_TYPE = 16 OR ((COND_TYPE = 17 AND MOD_TYPE = 22) AND (MOD_VAL = '20' OR MOD_VAL = '37' OR MOD_VAL = '42'))"
+def calcCritereCarrefour(Streets_network, conditions): 
     
     param_field_name = "TYPE_CARR"
     field_name = "Note_Carrefour"
-    liste_note_circulation.append(field_name)
 
     arcpy.AddMessage("Calcul champ : {} et {}".format(param_field_name, field_name))
     
-    # Lecture du type et assignation dans un dictionnaire en valeur nominale, avec la note.
-    carr_dict = dict()
-    with arcpy.da.SearchCursor(Streets_join_CdmsMod, ["LINK_ID","COND_TYPE", "MOD_TYPE", "MOD_VAL"], where_clause=where_clause) as cursor :
-        for row in cursor :
-            link_id = row[0]
-            cond_type = row[1]
-            mod_type = row[2]
-            mod_val = row[3]
-            if cond_type == 16:
-                carr_dict[link_id] = {param_field_name : "Feux", field_name : 2}
-            elif cond_type == 17 and mod_type == 22:
-                mod_val = int(mod_val)
-                if mod_val == 20 :
-                    carr_dict[link_id] = {param_field_name : "Stop", field_name : 1}
-                elif mod_val == 37 :
-                    carr_dict[link_id] = {param_field_name : "Priorité droite", field_name : 2}
-                elif mod_val == 42:
-                    carr_dict[link_id] = {param_field_name : "Cédez passage", field_name : 2}
-                else :
-                    carr_dict[link_id] = {param_field_name : "Prioritaire", field_name : 3}
-            else :
-                carr_dict[link_id] = {param_field_name : "Prioritaire", field_name : 3}
+    # Type de carrefour et note par link, lus lors du classement des conditions
+    carr_dict = conditions["Carrefour"]
 
-    #Ajout des champs si pas existants
-    if param_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, param_field_name, "STRING")
-    if field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_name, "LONG")
+    # Les liens sans condition sont des giratoires ou des carrefours prioritaires
+    giratoire = (table_attributs["ROUNDABOUT"] == 'Y').to_numpy()
+    types = numpy.where(giratoire, "Giratoire", "Prioritaire").astype(object)
+    notes = numpy.where(giratoire, 2, 3).astype(object)
 
-    #Mise à jour des champs de la couche
-    with arcpy.da.UpdateCursor(Streets_network, ["LINK_ID","ROUNDABOUT",param_field_name,field_name]) as cursor:
-        for row in cursor :
-            if row[0] in carr_dict.keys() :
-                row[2] = carr_dict[row[0]][param_field_name]
-                row[3] = carr_dict[row[0]][field_name]
-            elif row[1] == 'Y' :
-                row[2] = "Giratoire"
-                row[3] = 2
-            else :
-                row[2] = "Prioritaire"
-                row[3] = 3
-            cursor.updateRow(row)
+    # Les liens ayant une condition prennent le type et la note de celle-ci
+    if carr_dict:
+        positions = positionsLiens(list(carr_dict.keys()))
+        for position, (type_carr, note) in zip(positions.tolist(), carr_dict.values()):
+            if position >= 0:
+                types[position] = type_carr
+                notes[position] = note
 
-def dureeAccesSemaine(DTTME_TYPE, REF_DATE, STARTTIME, ENDTIME, AR_AUTO, AR_TRUCKS, AR_DELIVER):
-    # Calcul du nombre d'heure autorisées (valeur positive) ou interdites (valeur négative) à la circulation des véhicule de livraison par semaine
-    
-    # Formatage des données d'heure de début/fin pour utiliser le module datetime
-    # 24:00 n'est pas reconnu par datetime donc transformatin en 00:00 et ajout d'une valeur "add_reverse" pour compenser l'inversion du calcul
-    #  Ex : 18:00 -> 24:00 => 6 (heure)
-    # Mais 18:00 -> 00:00 => -18 (heure)
-    # Donc ajout de +24 (heure) pour compenser
+    ajouterColonne(param_field_name, "TEXT", types, "Prioritaire")
+    ajouterColonne(field_name, "LONG", notes, 3)
+
+#-------------- Masques horaires de la semaine -----------------
+# Chaque restriction horaire (DTTME_TYPE = 1, Daymask) est convertie en intervalles de minutes sur une semaine de 10080 minutes (7 jours x 1440).
+# Les intervalles d'un même link sont réunis (masque booléen par minute), les restrictions qui se chevauchent ne sont donc comptées qu'une fois.
+# Voir manuel Here Navstreet
+
+minutes_jour = 1440
+minutes_semaine = 7*minutes_jour
+
+def minutesHoraire(heures):
+    # Conversion vectorisée des heures HERE "HHMM" (ex : "0730", "2400") en minutes depuis minuit
+    heures = pandas.Series(heures).astype(str).str.zfill(4)
+    return (heures.str[:-2].astype(int)*60 + heures.str[-2:].astype(int)).to_numpy()
 
+def joursSemaine(ref_date):
     # REF_DATE : Suite de 7 Y/N pour signifier si la restriction s'applique ou non durant les jours de la semaines (commence par dimanche)
     # Ex : restriction tous les jours sauf samedi et dimanche => "NYYYYYN"
-    # voir manuel Here Navstreet
-
-    # AR_AUTO et AR_DELIVER ne sont pas utilsé dans cette fonction. 
-    # La modélisation de l'accessibilité d'une route par HERE est décrite de manière floue dans le manuel.
-    # Il serait possible afinner l'analyse par tronçon en considérant ces deux champs 
-    
-    if DTTME_TYPE != '1' : # Daymask, voir manuel Here Navstreet
-        return 0
-    if ENDTIME == "2400" :
-        ENDTIME = "0000"
-        add_reverse = 24
-    else:
-        add_reverse = 0
-    STARTTIME = STARTTIME[:-2]+":"+STARTTIME[-2:]
-    ENDTIME = ENDTIME[:-2]+":"+ENDTIME[-2:]
-    STARTTIME = datetime.datetime.strptime(STARTTIME,"%H:%M")
-    ENDTIME = datetime.datetime.strptime(ENDTIME,"%H:%M")
-    delta = (ENDTIME-STARTTIME)
-    day_count = REF_DATE.count("Y")
-    hrs = day_count*(add_reverse+(delta.total_seconds()/3600))
-    if AR_TRUCKS == 'N': 
-        return(-1*hrs)
-    else:
-        return hrs
+    # Retourne un tableau booléen (nombre de restrictions, 7)
+    ref_date = pandas.Series(ref_date).astype(str).str.ljust(7, "N").str[:7]
+    return numpy.array([list(e) for e in ref_date], dtype="<U1").reshape(-1, 7) == "Y"
+
+def intervallesSemaine(debut, fin, jours):
+    # Intervalles [debut, fin[ en minutes de la semaine pour chaque jour actif de chaque restriction
+    # Une heure de fin inférieure ou égale à l'heure de début signifie que la restriction se termine le lendemain (ex : 2200 -> 0600, 0000 -> 0000 = 24h)
+    # Retourne (indice de la restriction, début, fin), les intervalles dépassant samedi minuit sont repliés sur le dimanche
+    duree = numpy.where(fin > debut, fin-debut, fin-debut+minutes_jour)
+    ligne, jour = numpy.nonzero(jours)
+    debut_sem = jour*minutes_jour + debut[ligne]
+    fin_sem = debut_sem + duree[ligne]
+
+    replie = fin_sem > minutes_semaine
+    ligne = numpy.concatenate([ligne, ligne[replie]])
+    debut_sem = numpy.concatenate([debut_sem, numpy.zeros(replie.sum(), dtype=debut_sem.dtype)])
+    fin_sem = numpy.concatenate([numpy.minimum(fin_sem, minutes_semaine), fin_sem[replie]-minutes_semaine])
+    return ligne, debut_sem, fin_sem
+
+def masquesSemaine(groupes, debut, fin, nb_groupes):
+    # Réunion des intervalles [debut, fin[ de chaque groupe en un masque booléen (nb_groupes, 10080)
+    # Tableau de différences (+1 au début, -1 à la fin) puis somme cumulée : une minute est couverte si au moins un intervalle la contient
+    differences = numpy.zeros((nb_groupes, minutes_semaine+1), dtype=numpy.int32)
+    numpy.add.at(differences, (groupes, debut), 1)
+    numpy.add.at(differences, (groupes, fin), -1)
+    return numpy.cumsum(differences, axis=1)[:, :minutes_semaine] > 0
+
+def calcAccesSemaine(positions, interdit, debut, fin, jours, jours_etude, taille_bloc=1024):
+    # positions : position du link de chaque restriction dans index_liens
+    # interdit : True si la restriction est une interdiction pour les poids lourds (AR_TRUCKS = 'N'), False si c'est une plage autorisée
+    # debut, fin : minutes depuis minuit, jours : tableau booléen (nombre de restrictions, 7)
+    # jours_etude : tableau booléen de 7 jours (commence par dimanche), seuls ces jours sont pris en compte dans la moyenne
+    # Retourne les positions des links restreints et leur nombre d'heures d'accès moyen par jour étudié
+    #   accès = (plages autorisées, ou toute la semaine si le link n'en a pas) moins les plages interdites
+    liens = numpy.unique(positions)
+    acces_pjour = numpy.zeros(len(liens))
+    jours_minutes = numpy.repeat(jours_etude, minutes_jour)
+    nb_jours_etude = int(jours_etude.sum())
+
+    ligne, debut_sem, fin_sem = intervallesSemaine(debut, fin, jours)
+    rang_lien = numpy.searchsorted(liens, positions[ligne])
+
+    # Traitement par blocs de links pour limiter la mémoire des masques
+    for bloc in range(0, len(liens), taille_bloc):
+        dans_bloc = (rang_lien >= bloc) & (rang_lien < bloc+taille_bloc)
+        nb = min(taille_bloc, len(liens)-bloc)
+        groupes = (rang_lien[dans_bloc]-bloc)*2 + interdit[ligne[dans_bloc]] # 2 masques par link : autorisé et interdit
+        masques = masquesSemaine(groupes, debut_sem[dans_bloc], fin_sem[dans_bloc], 2*nb).reshape(nb, 2, minutes_semaine)
+
+        a_autorisation = numpy.zeros(nb, dtype=bool)
+        a_autorisation[numpy.unique(rang_lien[dans_bloc][~interdit[ligne[dans_bloc]]]-bloc)] = True
+        autorise = numpy.where(a_autorisation[:, None], masques[:, 0, :], True)
+        acces = autorise & ~masques[:, 1, :] & jours_minutes
+
+        acces_pjour[bloc:bloc+nb] = acces.sum(axis=1)/60/nb_jours_etude if nb_jours_etude else 0
+    return liens, acces_pjour
 
 #-------------- Critere Horaire ----------------- 
-def calcCritereHoraire(Streets_network, Streets_join_CdmsDTMod, seuils):
-    # Amélioration possible : 
-    #   - ENLEVER DIMANCHE dans le calcul
-    #   - Paramètres de l'utilsateur pour choisir les jours
+def calcNoteHoraire(acces, seuil_bon, seuil_mauv):
+    # acces : tableau du nombre d'heures d'accès par jour de chaque lien, note 0 si la durée n'est pas définie (comme le code d'origine)
+    return noteBandesCroissantes(acces, seuil_bon, seuil_mauv)
+
+def calcCritereHoraire(Streets_network, horaires, seuils, jours_etude="YYYYYYY"):
+    # jours_etude : jours pris en compte dans la moyenne par jour, même format que REF_DATE (ex : "NYYYYYY" pour exclure le dimanche)
 
     param_field_name = "ACCES_PJOUR"
     field_name = "Note_Horaire"
-    liste_note_accessibilite.append(field_name)
 
     seuils = seuilStringToList(seuils)
-    arcpy.AddMessage("Calcul champ : {} et {} avec seuils {}".format(param_field_name, field_name, seuils))
-    hor_dict = dict()
-    # Compte du nombre d'heure moyen par jour par link et évaluation de la note
-    # Assignation dans un dictionnaire
-    # {link_id : 
-    #   {   "total" : hrs total par semaine,
-    #       "ACCES_PJOUR" : hrs moyen par jour,
-    #       "Note_Horaire" : note}}
-
-    with arcpy.da.SearchCursor(Streets_join_CdmsDTMod, ["LINK_ID","DTTME_TYPE","REF_DATE","STARTTIME","ENDTIME", "AR_AUTO","AR_TRUCKS", "AR_DELIVER"], where_clause=" AR_DELIVER <> 'N' ") as cursor :
-        # where_clause : les link qui ne sont pas accessible aux livraisons ne sont pas pris en compte.
-        for row in cursor :
-            LINK_ID, DTTME_TYPE, REF_DATE, STARTTIME, ENDTIME, AR_AUTO, AR_TRUCKS, AR_DELIVER = [str(e) for e in row]
-        
-            hrs = dureeAccesSemaine(DTTME_TYPE, REF_DATE, STARTTIME, ENDTIME, AR_AUTO, AR_TRUCKS, AR_DELIVER)
-            if LINK_ID in hor_dict.keys():
-                hor_dict[LINK_ID]["total"] += hrs
-            else :
-                hor_dict[LINK_ID] = {"total" : hrs}
-        for link in hor_dict.keys():
-            total = hor_dict[link]["total"]
-            # si négatif : nombre d'heure où l'accès est interdit aux véhicules de livraison
-            # sinon nombre d'heure où l'accès est autorisé
-
-            # Moyenne/jour
-            if total < 0 : 
-                param_field_val = (total/7)+24
-            else :
-                param_field_val = total/7
-
-            # Note
-            if param_field_val>=int(seuils[0]) :
-                note_horaire = 3
-            elif param_field_val>int(seuils[1]):
-                note_horaire = 2
-            elif param_field_val<=int(seuils[1]):
-                note_horaire = 1
-            else:
-                note_horaire = 0
-            
-            #Assignation dictionnaire
-            hor_dict[link] = {param_field_name : param_field_val, field_name : note_horaire}
-
-    #Ajout des champs si pas existants
-    if param_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, param_field_name, "DOUBLE")
-    if field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_name, "LONG")
-
-    #Mise à jour des champs de la couche
-    with arcpy.da.UpdateCursor(Streets_network, ["LINK_ID",param_field_name,field_name]) as cursor:
-        for row in cursor :
-            link = str(row[0])
-            if link in hor_dict.keys() :
-                row[1] = hor_dict[link][param_field_name]
-                row[2] = hor_dict[link][field_name]
-            else :
-                row[1] = 24
-                row[2] = 3
-            cursor.updateRow(row)
+    seuil_bon = float(seuils[0].replace(",","."))
+    seuil_mauv = float(seuils[1].replace(",","."))
+    jours_etude = joursSemaine([jours_etude])[0]
+    arcpy.AddMessage("Calcul champ : {} et {} avec seuils {} sur {} jour(s)".format(param_field_name, field_name, seuils, int(jours_etude.sum())))
+
+    # Les link qui ne sont pas accessible aux livraisons ne sont pas pris en compte.
+    # Seules les restrictions de type Daymask (DTTME_TYPE = 1) décrivent des plages horaires hebdomadaires
+    horaires = horaires[horaires["AR_DELIVER"].notna() & (horaires["AR_DELIVER"] != 'N') & (horaires["DTTME_TYPE"].astype(str) == '1')]
+    positions = positionsLiens(horaires["LINK_ID"].to_numpy())
+    horaires = horaires[positions >= 0]
+    positions = positions[positions >= 0]
+
+    # AR_AUTO n'est pas utilsé. La modélisation de l'accessibilité d'une route par HERE est décrite de manière floue dans le manuel.
+    # Il serait possible afinner l'analyse par tronçon en considérant ce champ
+    liens, acces_pjour = calcAccesSemaine(
+        positions=positions,
+        interdit=(horaires["AR_TRUCKS"].astype(str) == 'N').to_numpy(),
+        debut=minutesHoraire(horaires["STARTTIME"]),
+        fin=minutesHoraire(horaires["ENDTIME"]),
+        jours=joursSemaine(horaires["REF_DATE"]),
+        jours_etude=jours_etude)
+
+    # Les liens sans restriction horaire sont accessibles 24h/24
+    acces = numpy.full(len(index_liens), 24.0)
+    acces[liens] = acces_pjour
+    notes = calcNoteHoraire(acces, seuil_bon, seuil_mauv)
+
+    ajouterColonne(param_field_name, "DOUBLE", acces, 24)
+    ajouterColonne(field_name, "LONG", notes, 3)
     
 
 
 #-------------- Critere Stationnement -----------------
+def calcNoteStationnement(nb_place, borne_bon, borne_mauv):
+    # nb_place : tableau du nombre de places à proximité de chaque lien
+    return noteBandesCroissantes(nb_place, borne_bon, borne_mauv)
+
 def calcCritereStationnement(Streets_network, couche_stationnement, filtre_stat, champ_nb_place, distance, nb_defaut, seuils):
 
     
     param_field_name = "NB_PLACE"
     field_name = "Note_Stationnement"
-    liste_note_accessibilite.append(field_name)
 
     seuils = seuilStringToList(seuils)
+    seuil_bon = float(seuils[0].replace(",","."))
+    seuil_mauv = float(seuils[1].replace(",","."))
     arcpy.AddMessage("Calcul champ : {} et {} avec\n filtre : {}\n champ nb place : {}\n distance : {}\n nb defaut : {}\n seuils {}".format(param_field_name, field_name, filtre_stat,champ_nb_place, distance, nb_defaut, seuils))
 
-    
-    Code_Block = """
-def calcCritereStationnement(nb_place, borne_bon, borne_mauv):
-    if (nb_place >= borne_bon):
-        return 3
-    elif (nb_place > borne_mauv):
-        return 2
-    elif (nb_place <= borne_mauv):
-        return 1
-    else:
-        return 0
-    """
-
     # Le script renvoie la valeur '#' dans python si le paramètres est laissé vide par l'utilisateur
     if filtre_stat == "#":
         filtre_stat = ""
-    
-    couche_stationnement, count = arcpy.management.SelectLayerByAttribute(in_layer_or_view=couche_stationnement, where_clause=filtre_stat)
-    
-    Streets_SummarizeNearby = fr"{arcpy.env.scratchGDB}\TEMP_Streets_SummarizeNearby"
-    arcpy.analysis.SummarizeNearby(in_features=Streets_network, in_sum_features=couche_stationnement, out_feature_class=Streets_SummarizeNearby, distance_type="STRAIGHT_LINE", distances=distance, distance_units="METERS", sum_fields=[[champ_nb_place, "Sum"]])
-    
-    sum_field = arcpy.AddFieldDelimiters(Streets_network,"sum_"+champ_nb_place) #"sum_NomDuChamp" est un champ créé automatiquement par SummarizeNearby
-    if sum_field not in [f.name for f in arcpy.ListFields(Streets_network)]: #Ajouté à la couche réseau si n'exsite pas déjà
-        arcpy.management.JoinField(in_data=Streets_network, in_field="LINK_ID", join_table=Streets_SummarizeNearby, join_field="LINK_ID", fields=[sum_field])
 
-    arcpy.management.CalculateField(in_table=Streets_network, field=sum_field, expression=f"math.ceil(!{sum_field}!)+{nb_defaut}") #Arrondi du champ de somme à l'entier supérieur
-    arcpy.management.CalculateField(in_table=Streets_network, field=field_name, expression=f"calcCritereStationnement(!{sum_field}!, {seuils[0]}, {seuils[1]})", code_block=Code_Block, field_type="SHORT")
+    sum_field = "sum_"+champ_nb_place # même nom que le champ créé auparavant par SummarizeNearby
+    nb_defaut = float(str(nb_defaut).replace(",","."))
+
+    # Plusieurs distances peuvent être entrées (ex : "25;50;100"), la première donne la note de l'indicateur.
+    # Les suivantes ajoutent les champs sum_NomDuChamp_{distance} et Note_Stationnement_{distance} pour comparaison
+    distances = [float(e.replace(",",".")) for e in str(distance).replace(";"," ").split()]
 
-    arcpy.management.Delete(fr"{arcpy.env.scratchGDB}\TEMP_Streets_SummarizeNearby")
+    # Les points de stationnement sont lus et indexés une seule fois pour toutes les distances
+    index_troncons = creerIndexTroncons(Streets_network, max(distances))
+    x, y, points = lirePoints(index_troncons, couche_stationnement, [champ_nb_place], filtre_stat)
+    point, lien, distance_point = distancesPointsTroncons(index_troncons, x, y, max(distances))
+    capacite = points[champ_nb_place].astype(float)[point]
+
+    for i, distance_bande in enumerate(distances):
+        dans_bande = distance_point <= distance_bande
+        somme = numpy.bincount(lien[dans_bande], weights=capacite[dans_bande], minlength=len(index_liens))
+        nb_places = numpy.ceil(somme)+nb_defaut #Arrondi de la somme à l'entier supérieur
+        notes = calcNoteStationnement(nb_places, seuil_bon, seuil_mauv)
+
+        suffixe = "" if i == 0 else "_{:g}".format(distance_bande).replace(".","_")
+        ajouterColonne(sum_field+suffixe, "DOUBLE", nb_places, nb_defaut)
+        ajouterColonne(field_name+suffixe, "SHORT", notes, 0)
+        arcpy.AddMessage("Distance {} m : {} places en moyenne par tronçon".format(distance_bande, round(float(nb_places.mean()), 1) if len(nb_places) else 0))
 
 #-------------- Critere Congestion -----------------
 def calcNoteCongestion(R_i_T, R_i_F, seuil_bon, seuil_mauv):
     # R_i_T Indice Ri (Road segment congestion index) pour la direction T (=To)
     # R_i_F Indice Ri (Road segment congestion index) pour la direction F (=From)
-    if R_i_T ==  0 and R_i_F == 0 :
-        return 3
-    if R_i_T == 0:
-        ratio = R_i_F
-    elif R_i_F == 0:
-        ratio = R_i_T
-    else :
-        ratio = min(R_i_T,R_i_F)
-
-    if ratio >= seuil_bon:
-        return 3
-    elif ratio > seuil_mauv:
-        return 2
-    elif ratio <= seuil_mauv:
-        return 1
-    else :
-        0
-
-def calcNbNonCongested(row):
-    count_non_cong = 0
-    for i in range(2,len(row)-1):
-        if row[i]< 50:
+    # Tableaux d'une valeur par lien. Les liens sans mesure dans les deux directions ont la note maximale
+    ratio = valeurMinDirections(R_i_T, R_i_F)
+    return numpy.where((numpy.asarray(R_i_T) == 0) & (numpy.asarray(R_i_F) == 0), 3, noteBandesCroissantes(ratio, seuil_bon, seuil_mauv))
+
+# Lecture par blocs de l'export SpeedData : seules les colonnes utiles sont lues, LINK-DIR et DATE-TIME en catégories
+# (chaque valeur distincte n'est stockée et analysée qu'une fois par bloc). Les filtres d'heure et de liens sont appliqués à chaque bloc,
+# qui n'est gardé que sous forme d'agrégats partiels par lien, direction et heure : la mémoire utilisée ne dépend pas de la taille du fichier.
+colonnes_speed_data = {"LINK-DIR" : "category", "DATE-TIME" : "category", "EPOCH-60MIN" : "int8", "MEAN" : "float64", "FREEFLOW" : "float64"}
+directions_speed_data = ["T", "F"]
+nb_heures_speed_data = 24
+
+def analyserLinkDir(link_dir):
+    # Séparation link id et link dir (ex : "847725463T" -> 847725463, 0)
+    # Retourne les LINK_ID (-1 si non numérique) et le code de direction dans directions_speed_data (-1 pour une autre direction)
+    link_dir = pandas.Series(link_dir).astype(str)
+    link_id = pandas.to_numeric(link_dir.str[:-1], errors="coerce").fillna(-1).to_numpy(numpy.int64)
+    direction = numpy.asarray([directions_speed_data.index(e) if e in directions_speed_data else -1 for e in link_dir.str[-1:]], dtype=numpy.int64)
+    return link_id, direction
+
+def agregerBlocSpeedData(bloc, agregats):
+    # Ajoute aux agrégats les mesures du bloc lu dans le .csv, LINK-DIR n'est analysé qu'une fois par valeur distincte
+    link_id, direction_categorie = analyserLinkDir(bloc["LINK-DIR"].cat.categories)
+    position_categorie = positionsLiens(link_id)
+    codes = bloc["LINK-DIR"].cat.codes.to_numpy()
+    position = numpy.where(codes >= 0, position_categorie[codes], -1)
+    direction = numpy.where(codes >= 0, direction_categorie[codes], -1)
+    accumulerSpeedData(agregats, position, direction, bloc["EPOCH-60MIN"].to_numpy(), bloc["DATE-TIME"], bloc["MEAN"].to_numpy(), bloc["FREEFLOW"].to_numpy())
+
+def accumulerSpeedData(agregats, position, direction, heure, date_time, mean, freeflow):
+    # position : position du lien dans index_liens (-1 hors réseau), direction : code de direction, heure : EPOCH-60MIN, date_time : Series catégorielle
+    # SPI (Speed Performance Index) par mesure : 100*vitesse moyenne/vitesse libre, tronqué à l'entier et plafonné à 100
+
+    # Comme la requête SpeedData est faite sur une étendue plus grande que la couche réseau, seuls les liens de la couche sont gardés
+    # Les mesures sans vitesse libre ne permettent pas de calculer de SPI
+    heure = numpy.asarray(heure, dtype=numpy.int64)
+    garde = (position >= 0) & (direction >= 0) & (heure >= 0) & (heure < nb_heures_speed_data) & (freeflow > 0)
+    if not garde.any():
+        return
+    spi = numpy.minimum(numpy.trunc(100*mean[garde]/freeflow[garde]), 100)
+    # Une seule réduction groupée pour les 24 heures
+    cle = (position[garde]*len(directions_speed_data) + direction[garde])*nb_heures_speed_data + heure[garde]
+    taille = agregats["somme_SPI"].size
+    agregats["somme_SPI"] += numpy.bincount(cle, weights=spi, minlength=taille).reshape(agregats["somme_SPI"].shape)
+    agregats["nb_mesures"] += numpy.bincount(cle, minlength=taille).reshape(agregats["nb_mesures"].shape).astype(numpy.int32)
+    agregats["nb_non_cong"] += numpy.bincount(cle, weights=spi >= 50, minlength=taille).reshape(agregats["nb_non_cong"].shape).astype(numpy.int32)
+
+    # Périodes mesurées : dates distinctes des mesures gardées, pour chaque heure
+    date_time = date_time.cat
+    paires, inverse = numpy.unique(numpy.stack([heure[garde], date_time.codes.to_numpy()[garde]], axis=1), axis=0, return_inverse=True)
+    for h, code in paires:
+        agregats["periodes"][h].add(str(date_time.categories[code]))
+    if "presence" in agregats:
+        periodes_paires = [str(date_time.categories[code]) for h, code in paires]
+        marquerPresenceSpeedData(agregats, position[garde], heure[garde], paires[:, 0], periodes_paires, inverse.ravel())
+
+def marquerPresenceSpeedData(agregats, position, heure, heures_paires, periodes_paires, inverse):
+    # Présence des mesures par lien : pour chaque heure, la n-ième DATE-TIME vue à cette heure est le bit n%64 du mot n//64 de presence[lien, heure]
+    # Permet de retrouver exactement les périodes mesurées d'un sous-ensemble des liens (extraireAgregatsSpeedData)
+    bits = numpy.asarray([agregats["index_periodes"][h].setdefault(periode, len(agregats["index_periodes"][h])) for h, periode in zip(heures_paires.tolist(), periodes_paires)],
+                         dtype=numpy.int64)
+    nb_mots = int(bits.max())//64+1
+    if nb_mots > agregats["presence"].shape[2]:
+        presence = numpy.zeros(agregats["presence"].shape[:2]+(nb_mots,), dtype=numpy.uint64)
+        presence[:, :, :agregats["presence"].shape[2]] = agregats["presence"]
+        agregats["presence"] = presence
+    # Une seule mise à jour par (lien, heure, bit)
+    taille_bits = 64*agregats["presence"].shape[2]
+    cles = numpy.unique((position*nb_heures_speed_data + heure)*taille_bits + bits[inverse])
+    bit = cles % taille_bits
+    lien_heure = cles // taille_bits
+    numpy.bitwise_or.at(agregats["presence"], (lien_heure // nb_heures_speed_data, lien_heure % nb_heures_speed_data, bit // 64),
+                        numpy.left_shift(numpy.uint64(1), (bit % 64).astype(numpy.uint64)))
+
+def creerAgregatsSpeedData(presence=False):
+    # Agrégats par (lien, direction, heure EPOCH-60MIN) : somme des SPI, nombre de mesures,
+    # nombre de mesures non congestionnées (SPI >= 50), et pour chaque heure l'ensemble des DATE-TIME mesurées
+    # presence : garde aussi les DATE-TIME mesurées par lien (marquerPresenceSpeedData), pour des agrégats partagés par plusieurs études
+    forme = (len(index_liens), len(directions_speed_data), nb_heures_speed_data)
+    agregats = {"somme_SPI" : numpy.zeros(forme), "nb_mesures" : numpy.zeros(forme, dtype=numpy.int32), "nb_non_cong" : numpy.zeros(forme, dtype=numpy.int32),
+                "periodes" : [set() for h in range(nb_heures_speed_data)]}
+    if presence:
+        agregats["presence"] = numpy.zeros((len(index_liens), nb_heures_speed_data, 1), dtype=numpy.uint64)
+        agregats["index_periodes"] = [dict() for h in range(nb_heures_speed_data)]
+    return agregats
+
+def extraireAgregatsSpeedData(agregats, liens_source):
+    # Agrégats des liens de l'étude (index_liens) à partir d'agrégats avec présence lus pour d'autres liens (ex : le réseau de la ville, liens_source)
+    # Les périodes sont celles mesurées sur les liens de l'étude, comme si l'export avait été lu pour l'étude seule
+    positions = numpy.minimum(numpy.searchsorted(liens_source, index_liens), len(liens_source)-1)
+    trouve = liens_source[positions] == index_liens
+    positions = positions[trouve]
+    extrait = creerAgregatsSpeedData()
+    for cle in ("somme_SPI", "nb_mesures", "nb_non_cong"):
+        extrait[cle] = numpy.zeros(extrait[cle].shape, dtype=agregats[cle].dtype)
+        extrait[cle][trouve] = agregats[cle][positions]
+    presence = numpy.bitwise_or.reduce(agregats["presence"][positions], axis=0) if len(positions) else numpy.zeros(agregats["presence"].shape[1:], dtype=numpy.uint64)
+    for h in range(nb_heures_speed_data):
+        for periode, bit in agregats["index_periodes"][h].items():
+            if (int(presence[h, bit // 64]) >> (bit % 64)) & 1:
+                extrait["periodes"][h].add(periode)
+    return extrait
+
+def nbPeriodesSpeedData(agregats, heures=None):
+    # Nombre de DATE-TIME distinctes mesurées sur les heures choisies, toutes si None
+    heures = range(nb_heures_speed_data) if heures is None else [h for h in heures if 0 <= h < nb_heures_speed_data]
+    return len(set().union(*[agregats["periodes"][h] for h in heures]))
+
+def lireSpeedData(table_speed_data, heures=None, taille_bloc=1000000, presence=False):
+    # heures : liste des EPOCH-60MIN gardées, toutes si None
+    # Lit un export .csv, ou un fichier .parquet créé par convertirSpeedDataParquet. Retourne les agrégats (creerAgregatsSpeedData)
+    if str(table_speed_data).lower().endswith(".parquet"):
+        return lireSpeedDataParquet(table_speed_data, heures, presence)
+    agregats = creerAgregatsSpeedData(presence)
+    nb_lignes = 0
+    with pandas.read_csv(table_speed_data, sep=",", usecols=list(colonnes_speed_data), dtype=colonnes_speed_data, chunksize=taille_bloc) as lecteur:
+        for bloc in lecteur:
+            nb_lignes += len(bloc)
+            if heures is not None:
+                bloc = bloc[bloc["EPOCH-60MIN"].isin(heures)]
+            agregerBlocSpeedData(bloc, agregats)
+    arcpy.AddMessage("{} lignes lues, {} mesures gardées sur {} périodes".format(nb_lignes, int(agregats["nb_mesures"].sum()), nbPeriodesSpeedData(agregats)))
+    return agregats
+
+#-------------- Stockage Parquet des données SpeedData -----------------
+# L'export .csv est converti une fois en un fichier Parquet trié par LINK_ID puis EPOCH-60MIN, en groupes de lignes de taille fixe.
+# Les statistiques min/max de chaque groupe permettent de ne lire que les groupes qui recouvrent les liens et les heures de l'étude :
+# pour une rue, quelques groupes sont lus au lieu de tout l'export.
+# Le tri se fait en deux lectures du .csv : comptage des mesures par lien pour découper les LINK_ID en partitions de taille bornée,
+# puis répartition des blocs dans des fichiers temporaires par partition, chacune étant ensuite triée en mémoire et écrite à la suite.
+
+def verifierPyarrow():
+    if pyarrow is None:
+        raise ImportError("Le module pyarrow est nécessaire pour le stockage Parquet des données SpeedData (installé avec ArcGIS Pro, sinon : pip install pyarrow)")
+
+def convertirSpeedDataParquet(table_speed_data, chemin_parquet, taille_groupe=16384, lignes_par_partition=5000000, taille_bloc=1000000):
+    verifierPyarrow()
+    colonnes = {"LINK_ID" : pyarrow.int64(), "DIR" : pyarrow.int8(), "DATE-TIME" : pyarrow.string(), "EPOCH-60MIN" : pyarrow.int8(), "MEAN" : pyarrow.float64(), "FREEFLOW" : pyarrow.float64()}
+    schema = pyarrow.schema(list(colonnes.items()))
+
+    # Première lecture : nombre de mesures par LINK_ID, puis bornes des partitions
+    comptes = pandas.Series(dtype=numpy.int64)
+    with pandas.read_csv(table_speed_data, sep=",", usecols=["LINK-DIR"], dtype={"LINK-DIR" : "category"}, chunksize=taille_bloc) as lecteur:
+        for bloc in lecteur:
+            link_id = analyserLinkDir(bloc["LINK-DIR"].cat.categories)[0]
+            codes = bloc["LINK-DIR"].cat.codes.to_numpy()
+            nb = numpy.bincount(codes[codes >= 0], minlength=len(link_id))
+            comptes = comptes.add(pandas.Series(nb, index=link_id).groupby(level=0).sum(), fill_value=0)
+    comptes = comptes[comptes.index >= 0].sort_index()
+    cumul = comptes.cumsum().to_numpy()
+    bornes = comptes.index.to_numpy(numpy.int64)[numpy.searchsorted(cumul, numpy.arange(lignes_par_partition, cumul[-1] if len(cumul) else 0, lignes_par_partition))]
+    arcpy.AddMessage("Conversion Parquet : {} mesures, {} liens, {} partitions".format(int(cumul[-1]) if len(cumul) else 0, len(comptes), len(bornes)+1))
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(chemin_parquet))) as dossier_temp:
+        # Deuxième lecture : répartition des mesures dans les partitions
+        chemins_partitions = [os.path.join(dossier_temp, "partition_{}.parquet".format(i)) for i in range(len(bornes)+1)]
+        ecrivains = dict()
+        try:
+            with pandas.read_csv(table_speed_data, sep=",", usecols=list(colonnes_speed_data), dtype=colonnes_speed_data, chunksize=taille_bloc) as lecteur:
+                for bloc in lecteur:
+                    link_id, direction = analyserLinkDir(bloc["LINK-DIR"].cat.categories)
+                    codes = bloc["LINK-DIR"].cat.codes.to_numpy()
+                    table = pandas.DataFrame({
+                        "LINK_ID" : numpy.where(codes >= 0, link_id[codes], -1),
+                        "DIR" : numpy.where(codes >= 0, direction[codes], -1).astype(numpy.int8),
+                        "DATE-TIME" : bloc["DATE-TIME"].astype(str).to_numpy(),
+                        "EPOCH-60MIN" : bloc["EPOCH-60MIN"].to_numpy(),
+                        "MEAN" : bloc["MEAN"].to_numpy(),
+                        "FREEFLOW" : bloc["FREEFLOW"].to_numpy()})
+                    # Seules les directions T et F sont utilisées par le calcul de congestion
+                    table = table[(table["LINK_ID"] >= 0) & (table["DIR"] >= 0)]
+                    partition = numpy.searchsorted(bornes, table["LINK_ID"].to_numpy(), side="right")
+                    for i in numpy.unique(partition).tolist():
+                        if i not in ecrivains:
+                            ecrivains[i] = pyarrow.parquet.ParquetWriter(chemins_partitions[i], schema)
+                        ecrivains[i].write_table(pyarrow.Table.from_pandas(table[partition == i], schema=schema, preserve_index=False))
+        finally:
+            for ecrivain in ecrivains.values():
+                ecrivain.close()
+
+        # Tri de chaque partition et écriture à la suite, en groupes de taille_groupe lignes
+        with pyarrow.parquet.ParquetWriter(chemin_parquet, schema, write_statistics=True) as ecrivain:
+            for i in sorted(ecrivains):
+                table = pyarrow.parquet.read_table(chemins_partitions[i]).sort_by([("LINK_ID", "ascending"), ("EPOCH-60MIN", "ascending")])
+                ecrivain.write_table(table, row_group_size=taille_groupe)
+    arcpy.AddMessage("Données SpeedData enregistrées dans {}".format(chemin_parquet))
+
+def lireSpeedDataParquet(chemin_parquet, heures=None, presence=False):
+    # Ne lit que les groupes de lignes dont les min/max de LINK_ID et EPOCH-60MIN recouvrent les liens et les heures de l'étude
+    verifierPyarrow()
+    fichier = pyarrow.parquet.ParquetFile(chemin_parquet, read_dictionary=["DATE-TIME"])
+    noms = fichier.schema_arrow.names
+    i_lien, i_heure = noms.index("LINK_ID"), noms.index("EPOCH-60MIN")
+    groupes = []
+    for g in range(fichier.metadata.num_row_groups):
+        stats_lien = fichier.metadata.row_group(g).column(i_lien).statistics
+        stats_heure = fichier.metadata.row_group(g).column(i_heure).statistics
+        # Au moins un lien de l'étude entre le min et le max du groupe
+        if stats_lien is not None and stats_lien.has_min_max and numpy.searchsorted(index_liens, stats_lien.min) == numpy.searchsorted(index_liens, stats_lien.max, side="right"):
             continue
-        count_non_cong +=1
-    return count_non_cong
-
-def calcRoadSegmentCongestionIndex(row):
-    return (row["SPI_AVG"]/100)*(row["Nb_CongStat"]/(len(row)-4))
-
-def calcCritereCongestion(Streets_network, table_speed_data, heure_analyse, seuils):
+        if heures is not None and stats_heure is not None and stats_heure.has_min_max and not any(stats_heure.min <= h <= stats_heure.max for h in heures):
+            continue
+        groupes.append(g)
+
+    agregats = creerAgregatsSpeedData(presence)
+    if groupes:
+        bloc = fichier.read_row_groups(groupes).to_pandas()
+        if heures is not None:
+            bloc = bloc[bloc["EPOCH-60MIN"].isin(heures)]
+        accumulerSpeedData(agregats, positionsLiens(bloc["LINK_ID"].to_numpy()), bloc["DIR"].to_numpy().astype(numpy.int64), bloc["EPOCH-60MIN"].to_numpy(),
+                           bloc["DATE-TIME"], bloc["MEAN"].to_numpy(), bloc["FREEFLOW"].to_numpy())
+    arcpy.AddMessage("{} groupes de lignes lus sur {}, {} mesures gardées sur {} périodes".format(len(groupes), fichier.metadata.num_row_groups, int(agregats["nb_mesures"].sum()), nbPeriodesSpeedData(agregats)))
+    return agregats
+
+#-------------- Profil de congestion sur 24 heures -----------------
+# Les agrégats des 24 heures sont lus en une fois, puis gardés en mémoire pendant l'exécution de l'outil et dans un fichier .npz (float32/int32) : la note d'un ensemble
+# d'heures quelconque (heure d'analyse, périodes de congestion) est calculée à partir de ce profil sans relire l'export SpeedData.
+# Le fichier est recalculé si l'export (chemin, taille, date de modification) ou les liens de l'étude changent.
+# Dans un lot d'études, les agrégats sont extraits de ceux lus une fois pour tout le réseau (donnees_lot).
+profils_congestion = dict()
+verrou_profils_congestion = threading.Lock()
+
+def calcIndicesCongestion(agregats, heures=None):
+    # R_i (Road segment congestion index) = SPI_AVG/100 * Nb_CongStat/nombre de périodes mesurées, sur les heures choisies (toutes si None)
+    # Retourne un tableau (liens x directions T, F) des R_i, 0 pour les directions sans mesure
+    selection = slice(None) if heures is None else verifierHeuresCongestion(heures, "de la période")
+    somme_SPI = agregats["somme_SPI"][:, :, selection].sum(axis=2, dtype=numpy.float64)
+    nb_mesures = agregats["nb_mesures"][:, :, selection].sum(axis=2, dtype=numpy.int64)
+    nb_non_cong = agregats["nb_non_cong"][:, :, selection].sum(axis=2, dtype=numpy.int64)
+    R_i = numpy.zeros(nb_mesures.shape)
+    mesure = nb_mesures > 0
+    R_i[mesure] = (somme_SPI[mesure]/nb_mesures[mesure]/100)*(nb_non_cong[mesure]/nbPeriodesSpeedData(agregats, heures))
+    return R_i
+
+def calcProfilCongestion(agregats):
+    # Profil de congestion : R_i de chaque heure, tableau float32 (liens x directions T, F x 24 heures)
+    return numpy.stack([calcIndicesCongestion(agregats, [h]) for h in range(nb_heures_speed_data)], axis=2).astype(numpy.float32)
+
+def enregistrerProfilCongestion(chemin_profil, empreinte, agregats):
+    # Les DATE-TIME de chaque heure sont enregistrées à plat avec leur heure
+    heures_periodes = [h for h in range(nb_heures_speed_data) for e in sorted(agregats["periodes"][h])]
+    periodes = [e for h in range(nb_heures_speed_data) for e in sorted(agregats["periodes"][h])]
+    with open(chemin_profil, "wb") as fichier:
+        numpy.savez_compressed(fichier, empreinte=numpy.asarray(empreinte), somme_SPI=agregats["somme_SPI"].astype(numpy.float32),
+                               nb_mesures=agregats["nb_mesures"], nb_non_cong=agregats["nb_non_cong"], profil=calcProfilCongestion(agregats),
+                               periodes=numpy.asarray(periodes, dtype=str), heures_periodes=numpy.asarray(heures_periodes, dtype=numpy.int8))
+
+def sourceSpeedData(table_speed_data):
+    # Identifie un export SpeedData sans le relire : chemin, taille et date de modification
+    return (os.path.abspath(str(table_speed_data)), os.path.getsize(table_speed_data), os.path.getmtime(table_speed_data))
+
+def chargerProfilCongestion(table_speed_data, chemin_profil=None):
+    # Retourne les agrégats des 24 heures pour les liens de l'étude : en mémoire, extraits des agrégats du lot,
+    # dans le fichier chemin_profil, ou lus dans l'export SpeedData
+    source = sourceSpeedData(table_speed_data)
+    empreinte = calcEmpreinte("Profil congestion", *source, hashlib.sha256(numpy.ascontiguousarray(index_liens, dtype=numpy.int64).tobytes()).hexdigest())
+    with verrou_profils_congestion:
+        if empreinte in profils_congestion:
+            return profils_congestion[empreinte]
+        agregats = None
+        if donnees_lot is not None and source in donnees_lot["agregats_speed_data"]:
+            agregats = extraireAgregatsSpeedData(donnees_lot["agregats_speed_data"][source], donnees_lot["liens"])
+            agregats["somme_SPI"] = agregats["somme_SPI"].astype(numpy.float32)
+            arcpy.AddMessage("Profil de congestion extrait des données SpeedData du lot")
+        if agregats is None and chemin_profil and os.path.exists(chemin_profil):
+            with numpy.load(chemin_profil) as donnees:
+                if str(donnees["empreinte"]) == empreinte:
+                    agregats = {"somme_SPI" : donnees["somme_SPI"], "nb_mesures" : donnees["nb_mesures"], "nb_non_cong" : donnees["nb_non_cong"],
+                                "periodes" : [set() for h in range(nb_heures_speed_data)]}
+                    for h, e in zip(donnees["heures_periodes"].tolist(), donnees["periodes"].tolist()):
+                        agregats["periodes"][h].add(e)
+                    arcpy.AddMessage("Profil de congestion relu dans {}".format(chemin_profil))
+        if agregats is None:
+            agregats = lireSpeedData(table_speed_data)
+            # Sommes de SPI gardées en float32 comme dans le fichier, pour que le résultat ne dépende pas de la source des agrégats
+            agregats["somme_SPI"] = agregats["somme_SPI"].astype(numpy.float32)
+            if chemin_profil:
+                enregistrerProfilCongestion(chemin_profil, empreinte, agregats)
+                arcpy.AddMessage("Profil de congestion enregistré dans {}".format(chemin_profil))
+        profils_congestion[empreinte] = agregats
+        return agregats
+
+def verifierHeuresCongestion(heures, description):
+    # Une heure hors de 0 à 23 n'a pas de mesure : elle donnerait des R_i nuls et des notes sans signification
+    hors_plage = [h for h in heures if not 0 <= h < nb_heures_speed_data]
+    if hors_plage:
+        raise ValueError("Heures {} hors de 0 à {} : {}".format(description, nb_heures_speed_data-1, hors_plage))
+    return list(heures)
+
+def lireHeuresCongestion(heures, description):
+    # "7;8;9" -> [7, 8, 9]
+    try:
+        liste = [int(e) for e in str(heures).split(";")]
+    except ValueError:
+        raise ValueError("Heures {} invalides : '{}' (format attendu : 7;8;9)".format(description, heures)) from None
+    return verifierHeuresCongestion(liste, description)
+
+def lirePeriodesCongestion(periodes_congestion):
+    # "matin:7;8;9 livraison:10;11 soir:17;18" -> {"matin" : [7, 8, 9], "livraison" : [10, 11], "soir" : [17, 18]}
+    # Le nom de la période est le suffixe de ses champs (ex : Note_Congestion_matin) : il doit être un nom de champ valide et unique
+    if periodes_congestion in ("#", "", None):
+        return dict()
+    periodes = dict()
+    for periode in periodes_congestion.split():
+        if periode.count(":") != 1 or not periode.split(":")[0]:
+            raise ValueError("Période de congestion invalide : '{}' (format attendu : nom:7;8;9)".format(periode))
+        nom, heures = periode.split(":")
+        if arcpy.ValidateFieldName(nom) != nom:
+            raise ValueError("Nom de période de congestion invalide pour un nom de champ : '{}' (proposition : '{}')".format(nom, arcpy.ValidateFieldName(nom)))
+        if nom.lower() in [e.lower() for e in periodes]:
+            raise ValueError("Période de congestion en double : '{}'".format(nom))
+        periodes[nom] = lireHeuresCongestion(heures, "de la période " + nom)
+    return periodes
+
+def calcCritereCongestion(Streets_network, table_speed_data, heure_analyse, seuils, periodes_congestion="#", chemin_profil=None):
     
 
     param_field_name_T = "CONG_RSI_T"
     param_field_name_F = "CONG_RSI_F"
     field_name = "Note_Congestion"
-    liste_note_circulation.append(field_name)
 
     seuils = seuilStringToList(seuils)
-
-    arcpy.AddMessage("Lecture .csv et traitement données")
-    df = pandas.read_csv(table_speed_data, sep=",")
-
-    # Tri en fonction des heures choisies pour l'analyse
-    if heure_analyse :
-        heure_liste = [int(e) for e in heure_analyse.split(";")]
-        df = df[df['EPOCH-60MIN'].isin(heure_liste)]
-    
-
-    # Permet de garder le lien en mémoire et de faire l'itération sur les mesures par lien
-    cur_link_id = ""
-    cur_link_dict = {}
-    
-    df_ratio = pandas.DataFrame()
-
-    for index, row in df.iterrows():
-        
-        link_dir= row["LINK-DIR"]
-        # Séparation link id et link dir
-        link_id = link_dir[:-1]
-        link_dir = link_dir[-1:]
-        
-        # Comme la requête SpeedData est faite sur une étendue plus grande que la couche réseau, on verifie d'abord si le lien fait partie de la couche ou non
-        if link_id not in liste_link_id:
-            continue
-        
-        date_time = row["DATE-TIME"]
-
-        # Calcul Speed Performance Index (SPI)
-        ratio = int(100*(float(row["MEAN"])/float(row["FREEFLOW"]))) 
-        ratio = ratio if ratio<= 100 else 100
-        
-        if link_id != cur_link_id : # SI vrai : on a finit d'itérer sur le lien en cours
-            
-            # Si le dictionnaire n'est pas vide, cela signifie que des valeurs ont été calculées et qu'il faut les ajouter au df des ratios
-            # Un DataFrame est créé et appondu au df des ratios.
-            if cur_link_dict:
-                df_cur = pandas.DataFrame(cur_link_dict, index=[0])
-                df_ratio = pandas.concat([df_ratio,df_cur],ignore_index=True)
-            cur_link_dict = {}
-            cur_link_id = link_id
-            cur_link_dict["link_id"] = link_id
-            cur_link_dict["link_dir"] = link_dir
-        
-        cur_link_dict[date_time] = ratio
-    
-    df_ratio["SPI_AVG"] = df_ratio.iloc[:, df_ratio.columns != "link_id"].mean(axis=1, numeric_only=True)
-    df_ratio["Nb_CongStat"] = df_ratio.apply(calcNbNonCongested, axis=1)
-    df_ratio["R_i"] = df_ratio.apply(calcRoadSegmentCongestionIndex, axis=1)
-
-
-    arcpy.AddMessage("Calcul champ : {}, {} et {} avec seuils {}".format(param_field_name_T,param_field_name_F,field_name,seuils))
-    #Ajout des champs si pas existants
-    if param_field_name_T not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, param_field_name_T, "DOUBLE")
-    if param_field_name_F not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, param_field_name_F, "DOUBLE")
-    if field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_name, "LONG")
-
-    #Mise à jour des champs de la couche
-    with arcpy.da.UpdateCursor(Streets_network, ["LINK_ID",param_field_name_T,param_field_name_F,field_name]) as cursor:
-        for row in cursor :
-            link = str(row[0])
-            df_extract_T = df_ratio.loc[(df_ratio['link_id']==link)&(df_ratio["link_dir"]=="T") ,"R_i"]
-            df_extract_F = df_ratio.loc[(df_ratio['link_id']==link)&(df_ratio["link_dir"]=="F") ,"R_i"]
-            R_i_T = 0 if df_extract_T.empty else df_extract_T.values[0]
-            R_i_F = 0 if df_extract_F.empty else df_extract_F.values[0]
-            row[1] = R_i_T
-            row[2] = R_i_F
-            
-            row[3] = calcNoteCongestion(R_i_T=R_i_T, R_i_F=R_i_F,seuil_bon=float(seuils[0].replace(",",".")),seuil_mauv=float(seuils[1].replace(",",".")))           
-            
-            cursor.updateRow(row)
+    seuil_bon = float(seuils[0].replace(",","."))
+    seuil_mauv = float(seuils[1].replace(",","."))
+
+    arcpy.AddMessage("Profil de congestion sur 24 heures")
+    agregats = chargerProfilCongestion(table_speed_data, chemin_profil)
+
+    # Heures choisies pour l'analyse, puis périodes comparées (ex : "matin:7;8;9 soir:17;18") avec leurs propres champs (ex : Note_Congestion_matin)
+    heure_liste = lireHeuresCongestion(heure_analyse, "d'analyse") if heure_analyse and heure_analyse != "#" else None
+    periodes = {"" : heure_liste}
+    periodes.update({"_"+nom : heures for nom, heures in lirePeriodesCongestion(periodes_congestion).items()})
+    for suffixe, heures in periodes.items():
+        R_i = calcIndicesCongestion(agregats, heures)
+        arcpy.AddMessage("Calcul champ : {}, {} et {} avec seuils {}".format(param_field_name_T+suffixe,param_field_name_F+suffixe,field_name+suffixe,seuils))
+        R_i_T = R_i[:, directions_speed_data.index("T")]
+        R_i_F = R_i[:, directions_speed_data.index("F")]
+        notes = calcNoteCongestion(R_i_T=R_i_T, R_i_F=R_i_F,seuil_bon=seuil_bon,seuil_mauv=seuil_mauv)
+
+        ajouterColonne(param_field_name_T+suffixe, "DOUBLE", R_i_T, 0)
+        ajouterColonne(param_field_name_F+suffixe, "DOUBLE", R_i_F, 0)
+        ajouterColonne(field_name+suffixe, "LONG", notes, 0)
     
 #-------------- Critere Chantier -----------------
 def convertCritChantier(crit):
@@ -808,6 +1408,14 @@ def calcNoteChantier(crit_int, duree, seuil_bon, seuil_mauv):
     else :
         return 0
 
+def ajouterColonnesChantier(chantier_dict):
+    # Les tronçons sans chantier ont la note maximale
+    ajouterColonne("IMPACT_CHANTIER", "TEXT", {link : e["IMPACT_CHANTIER"] for link, e in chantier_dict.items()}, "Aucun")
+    ajouterColonne("DEBUT_CHANTIER", "DATE", {link : e["DEBUT_CHANTIER"] for link, e in chantier_dict.items()}, None)
+    ajouterColonne("FIN_CHANTIER", "DATE", {link : e["FIN_CHANTIER"] for link, e in chantier_dict.items()}, None)
+    ajouterColonne("DUREE_CHANTIER", "LONG", {link : e["DUREE_CHANTIER"] for link, e in chantier_dict.items()}, 0)
+    ajouterColonne("Note_Chantier", "LONG", {link : e["Note_Chantier"] for link, e in chantier_dict.items()}, 3)
+
 def calcCritereChantierHere(Streets_network, filtre_type, filtre_impact, seuils):
     # doc : 
     # https://developer.here.com/documentation/traffic-api/dev_guide/topics/use-cases/incidents.html
@@ -819,7 +1427,6 @@ def calcCritereChantierHere(Streets_network, filtre_type, filtre_impact, seuils)
 
     param_field_name = "DUREE_CHANTIER"
     field_name = "Note_Chantier"
-    liste_note_circulation.append(field_name)
 
     seuils = seuilStringToList(seuils)
 
@@ -891,26 +1498,29 @@ def calcCritereChantierHere(Streets_network, filtre_type, filtre_impact, seuils)
             impact_chantier_field_name : incidentDetails.get("criticality")
         })
 
-    #Ajout des champs si pas existants
-    if impact_chantier_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, impact_chantier_field_name, "String")
-    if debut_chantier_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, debut_chantier_field_name, "DATE")
-    if fin_chantier_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, fin_chantier_field_name, "DATE")
-    if param_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, param_field_name, "LONG")
-    if field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_name, "LONG")
-
-    #Mise à jour des champs de la couche
-    with arcpy.da.UpdateCursor(Streets_network, ["SHAPE@",impact_chantier_field_name, debut_chantier_field_name, fin_chantier_field_name, param_field_name,field_name]) as cursor :
+    # Index spatial des emprises des incidents, élargies de la tolérance de distance
+    # Seuls les incidents dont l'emprise recouvre celle du tronçon sont ensuite testés avec .distanceTo()
+    tolerance = 0.00001 # valeur en degré (unité du système de référence spatial) = ~1 millimètre
+    index_incid = creerIndexEmprises(
+        [incid.get("geometry").extent.XMin - tolerance for incid in incid_list],
+        [incid.get("geometry").extent.YMin - tolerance for incid in incid_list],
+        [incid.get("geometry").extent.XMax + tolerance for incid in incid_list],
+        [incid.get("geometry").extent.YMax + tolerance for incid in incid_list])
+
+    # Seuls les tronçons touchés par un incident sont enregistrés, les autres prennent les valeurs par défaut
+    chantier_dict = dict()
+    with arcpy.da.SearchCursor(Streets_network, ["LINK_ID","SHAPE@"]) as cursor :
         for row in cursor :
-            shape = row[0]
+            shape = row[1]
             note_max = 0
-            for incid in incid_list :
+            
+            # Les candidats sont retournés dans l'ordre de incid_list, le résultat est donc le même qu'en testant tous les incidents
+            extent = shape.extent
+            candidats = candidatsIndexEmprises(index_incid, extent.XMin, extent.YMin, extent.XMax, extent.YMax)[1]
+            for i in candidats :
+                incid = incid_list[i]
                 
-                if shape.distanceTo(incid.get("geometry"))>0.00001: # valeur en degré (unité du système de référence spatial) = ~1 millimètre
+                if shape.distanceTo(incid.get("geometry"))>tolerance:
                     continue
                 # .distanceTo() permet de couvrir le plus grand nombre de cas possible
                 # .intersect() ne prend pas en compte les geometries superposees
@@ -922,23 +1532,15 @@ def calcCritereChantierHere(Streets_network, filtre_type, filtre_impact, seuils)
                     continue
                 
                 note_max = note
-                row[1] = incid.get(impact_chantier_field_name)
-                row[2] = incid.get(debut_chantier_field_name)
-                row[3] = incid.get(fin_chantier_field_name)
-                row[4] = incid.get(param_field_name)
-                row[5] = note
-                
-        
-            
-            if note_max == 0 :
-                row[1] = "Aucun"
-                row[2] = None
-                row[3] = None
-                row[4] = 0
-                row[5] = 3
-            
-            
-            cursor.updateRow(row)
+                chantier_dict[row[0]] = {
+                    impact_chantier_field_name : incid.get(impact_chantier_field_name),
+                    debut_chantier_field_name : incid.get(debut_chantier_field_name),
+                    fin_chantier_field_name : incid.get(fin_chantier_field_name),
+                    param_field_name : incid.get(param_field_name),
+                    field_name : note
+                    }
+
+    ajouterColonnesChantier(chantier_dict)
 
 def calcCritereChantierExt(Streets_network, couche_ext_chantier, champ_debut_chantier, champ_fin_chantier, filtre_date_chantier, filtre_valeur_chantier, seuils):
     
@@ -948,7 +1550,6 @@ def calcCritereChantierExt(Streets_network, couche_ext_chantier, champ_debut_cha
 
     param_field_name = "DUREE_CHANTIER"
     field_name = "Note_Chantier"
-    liste_note_circulation.append(field_name)
 
     seuils = seuilStringToList(seuils)
 
@@ -999,7 +1600,7 @@ def calcCritereChantierExt(Streets_network, couche_ext_chantier, champ_debut_cha
 
     with arcpy.da.SearchCursor(Streets_join_chantier,["LINK_ID", debut_chantier_field_name, fin_chantier_field_name]) as cursor:
         for row in cursor:
-            link_id = str(row[0])
+            link_id = row[0]
             date_debut = row[1]
             date_fin = row[2]
             impact = "Pas d'information"
@@ -1042,109 +1643,78 @@ def calcCritereChantierExt(Streets_network, couche_ext_chantier, champ_debut_cha
                 }
 
     arcpy.AddMessage("Calcul champ : {}, {}, {}, {}, {} avec seuils {}".format(impact_chantier_field_name, debut_chantier_field_name, fin_chantier_field_name, param_field_name, field_name, seuils))   
-    #Ajout des champs si pas existants
-    if impact_chantier_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, impact_chantier_field_name, "String")
-    if debut_chantier_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, debut_chantier_field_name, "DATE")
-    if fin_chantier_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, fin_chantier_field_name, "DATE")
-    if param_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, param_field_name, "LONG")
-    if field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_name, "LONG")
-
-    #Mise à jour des champs de la couche
-    with arcpy.da.UpdateCursor(Streets_network,["LINK_ID",impact_chantier_field_name,debut_chantier_field_name, fin_chantier_field_name, param_field_name,field_name]) as cursor:
-        for row in cursor:
-            link_id = str(row[0])
-            row[1] = chantier_dict[link_id][impact_chantier_field_name]
-            row[2] = chantier_dict[link_id][debut_chantier_field_name]
-            row[3] = chantier_dict[link_id][fin_chantier_field_name]
-            row[4] = chantier_dict[link_id][param_field_name]
-            row[5] = chantier_dict[link_id][field_name]            
-
-            cursor.updateRow(row)
+    ajouterColonnesChantier(chantier_dict)
 
     arcpy.management.Delete(fr"{arcpy.env.scratchGDB}\TEMP_Streets_join_chantier")
 
 #-------------- Critere transport public -----------------
 def calcNoteTP(nb_run, seuil_bon, seuil_mauv):   
-    if nb_run <= seuil_bon :
-        return 3
-    elif nb_run < seuil_mauv :
-        return 2
-    elif nb_run >= seuil_mauv :
-        return 1
-    else : 
-        return 3
+    # nb_run : tableau du nombre de passages par heure de chaque lien
+    return noteBandesDecroissantes(nb_run, seuil_bon, seuil_mauv, defaut=3)
 
-def calCritereTP(Streets_network, stop_frequency_layer, champ_numRunsPHour, seuils):
+def calCritereTP(Streets_network, stop_frequency_layer, champ_numRunsPHour, seuils, func_class=None, rayon=100):
+    # func_class : liste des FUNC_CLASS des tronçons auxquels un arrêt peut être rattaché, tous si None
     
     param_field_name = "NB_PASSAGE_TP"
     field_name = "Note_ArretTP"
-    liste_note_circulation.append(field_name)
 
     seuils = seuilStringToList(seuils)
 
-    arcpy.AddMessage("Jointure couche : {}".format(stop_frequency_layer)) 
-    fldmappings = arcpy.FieldMappings()
-    fldmap_link = arcpy.FieldMap()
-    fldmap_link.addInputField(Streets_network, "LINK_ID")
-    fld_link = fldmap_link.outputField
-    fld_link.name = "LINK_ID"
-    fldmap_link.outputField = fld_link
-    fldmappings.addFieldMap(fldmap_link)
-    
-    fldmap_nbRun = arcpy.FieldMap()
-    fldmap_nbRun.addInputField(stop_frequency_layer, champ_numRunsPHour)
-    fld_nbRun = fldmap_nbRun.outputField
-    fld_nbRun.name = champ_numRunsPHour
-    fldmap_nbRun.outputField = fld_nbRun
-    fldmappings.addFieldMap(fldmap_nbRun)
-
-    StopFrequencyLayer_Join = fr"{arcpy.env.scratchGDB}\TEMP_StopFrequencyLayer_Join"
+    arcpy.AddMessage("Rattachement des arrêts de la couche {} au tronçon le plus proche (rayon {} m, FUNC_CLASS {})".format(stop_frequency_layer, rayon, func_class if func_class else "toutes"))
     
-    # C'est l'arrêt le plus proche du tronçons qui est considérés (avec une certaine distance de recherche).
+    # C'est le tronçon le plus proche de l'arrêt qui est considéré (avec une certaine distance de recherche).
     # ATTENTION, cela peut dire qu'un arrêt ne se "connecte" pas avec le bon tronçon selon la configuration des routes.
-    arcpy.analysis.SpatialJoin(target_features=stop_frequency_layer,join_features=Streets_network, out_feature_class=StopFrequencyLayer_Join, join_operation="JOIN_ONE_TO_ONE", join_type="KEEP_COMMON",field_mapping=fldmappings,match_option="CLOSEST",search_radius=100)
-    
-    TP_dict = dict()
-    with arcpy.da.SearchCursor(StopFrequencyLayer_Join,["LINK_ID",champ_numRunsPHour]) as cursor :
-        for row in cursor:
-            link = str(row[0])
-            nbRun = row[1]
+    index_troncons = creerIndexTroncons(Streets_network, rayon)
+    x, y, arrets = lirePoints(index_troncons, stop_frequency_layer, [champ_numRunsPHour])
+    point, lien, distance = distancesPointsTroncons(index_troncons, x, y, rayon)
 
-            #Un linnk peur avoir plusieurs arrêts, c'est la somme de tous qui est considéré pour la notation
-            if link in TP_dict.keys():
-                TP_dict[link] += nbRun
-                continue
-            TP_dict[link] = nbRun
+    if func_class:
+        eligible = table_attributs["FUNC_CLASS"].astype(int).isin([int(e) for e in func_class]).to_numpy()
+        garde = eligible[lien]
+        point, lien, distance = point[garde], lien[garde], distance[garde]
+    point, lien, distance = plusProcheTroncon(point, lien, distance)
+    arcpy.AddMessage("{} arrêts sur {} rattachés au réseau".format(len(point), len(x)))
+
+    #Un link peut avoir plusieurs arrêts, c'est la somme de tous qui est considéré pour la notation
+    nb_run = numpy.bincount(lien, weights=arrets[champ_numRunsPHour].astype(float)[point], minlength=len(index_liens))
+    a_arret = numpy.bincount(lien, minlength=len(index_liens)) > 0
     
     arcpy.AddMessage("Calcul champ : {} et {} avec seuils {}".format(param_field_name, field_name, seuils))
-    #Ajout des champs si pas existants
-    if param_field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, param_field_name, "LONG")
-    if field_name not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_name, "LONG")
-    
-    #Mise à jour des champs de la couche
-    with arcpy.da.UpdateCursor(Streets_network, ["LINK_ID",param_field_name, field_name]) as cursor :
-        for row in cursor:
-            link = str(row[0])
-            if link in TP_dict.keys():
-                row[1] = TP_dict[link]
-                row[2] = calcNoteTP(TP_dict[link], int(seuils[0]), int(seuils[1]))
-            else :
-                row[1] = 0
-                row[2] = 3
-            cursor.updateRow(row)
-
-    arcpy.management.Delete(fr"{arcpy.env.scratchGDB}\TEMP_StopFrequencyLayer_Join")
+    # Les tronçons sans arrêt ont la note maximale
+    notes = numpy.where(a_arret, calcNoteTP(nb_run, int(seuils[0]), int(seuils[1])), 3)
+    ajouterColonne(param_field_name, "LONG", nb_run, 0)
+    ajouterColonne(field_name, "LONG", notes, 3)
 
 #----------------------------------------------------------
 #-------------- Calcul de la note globale -----------------
 #----------------------------------------------------------
+def calcMoyennesNotes(notes, ponderation):
+    # notes : matrice (liens x indicateurs), ponderation : un poids par indicateur
+    # Retourne la moyenne et la moyenne pondérée des notes de chaque lien
+    poids = numpy.asarray(ponderation, dtype=float)
+    return notes.mean(axis=1), notes @ (poids/poids.sum())
+
+def normaliserNote(note):
+    # Ramène une note entre note_min et note_max sur l'intervalle [0, 1]
+    return (note-note_min)/(note_max-note_min)
+
+nb_func_class = 5 # classes de route FUNC_CLASS de HERE, de 1 à 5
+
+def lireRatiosHierarchie(ratio_hiera):
+    # "1 1.5 2 2.5 3" -> un ratio par FUNC_CLASS, de 1 à 5
+    liste_ratio_hiera = [float(e) for e in ratio_hiera.split()]
+    if len(liste_ratio_hiera) != nb_func_class:
+        raise ValueError("{} ratios de hiérarchie pour {} classes de route FUNC_CLASS : {}".format(len(liste_ratio_hiera), nb_func_class, ratio_hiera))
+    return liste_ratio_hiera
+
+def lireFuncClass():
+    # FUNC_CLASS des liens de la table attributaire, de 1 à 5 : une autre valeur n'a pas de ratio de hiérarchie
+    func_class = table_attributs["FUNC_CLASS"].astype(int).to_numpy()
+    invalides = sorted(set(func_class[(func_class < 1) | (func_class > nb_func_class)].tolist()))
+    if invalides:
+        raise ValueError("FUNC_CLASS hors de 1 à {} pour {} liens : {}".format(nb_func_class, int(numpy.isin(func_class, invalides).sum()), invalides))
+    return func_class
+
 def calcNoteGlobale(Streets_network, liste_field_circ, liste_field_access, ratio_hiera, couches_POI, pond_circ, pond_acces):
     
     global note_max, note_min
@@ -1152,8 +1722,7 @@ def calcNoteGlobale(Streets_network, liste_field_circ, liste_field_access, ratio
     note_min = 1
 
 
-    liste_ratio_hiera = ratio_hiera.split(" ")
-    liste_ratio_hiera = [float(e) for e in liste_ratio_hiera]
+    liste_ratio_hiera = lireRatiosHierarchie(ratio_hiera)
     
     # Transformation du parametre ASrcGIS en dictionary python pour être exploité. Input : "path1 ratio1;path2 ratio2;path3 ratio3;..." 
     couches_list = couches_POI.split(";")
@@ -1164,250 +1733,622 @@ def calcNoteGlobale(Streets_network, liste_field_circ, liste_field_access, ratio
         couches_POI_dict[i] = {"path" : liste[0], "ratio": float(liste[1])}
         i+=1
     
-    POI_count = {}
+    # Compte du nombre de POI à moins de 5 mètres de chaque tronçon, multiplié par les ratios entrés par l'utilisateur.
+    # Les segments du réseau sont indexés une fois, les points de toutes les couches sont ensuite traités ensemble
+    distance_POI = 5
+    index_troncons = creerIndexTroncons(Streets_network, distance_POI)
+    x_POI, y_POI, ratio_POI = [], [], []
     for key in couches_POI_dict.keys():
-        temp_POI_count_layer = fr"{arcpy.env.scratchGDB}\TEMP_temp_POI_count_layer"
-        
-        arcpy.analysis.SummarizeNearby(in_features=Streets_network, in_sum_features=couches_POI_dict[key]["path"], out_feature_class=temp_POI_count_layer, distance_type="STRAIGHT_LINE", distances=5, distance_units="METERS")
-        with arcpy.da.SearchCursor(temp_POI_count_layer, ["LINK_ID","Point_Count"]) as cursor:
-            for row in cursor:
-                link_id = str(row[0])
-                
-                #Compte du nombre de POI par tronçons, multiplié par les ratios entrés par l'utilisateur.
-                if link_id in POI_count.keys():
-                    POI_count[link_id].append(row[1]*couches_POI_dict[key]["ratio"])
-                else :
-                    POI_count[link_id] = [row[1]*couches_POI_dict[key]["ratio"]]
-        
-        arcpy.management.Delete(fr"{arcpy.env.scratchGDB}\TEMP_temp_POI_count_layer")
+        x, y, points = lirePoints(index_troncons, couches_POI_dict[key]["path"])
+        x_POI.append(x)
+        y_POI.append(y)
+        ratio_POI.append(numpy.full(len(x), couches_POI_dict[key]["ratio"]))
+        arcpy.AddMessage("Couche POI {} : {} points, ratio {}".format(couches_POI_dict[key]["path"], len(x), couches_POI_dict[key]["ratio"]))
+
+    ratio_POI = numpy.concatenate(ratio_POI)
+    point, lien, distance = distancesPointsTroncons(index_troncons, numpy.concatenate(x_POI), numpy.concatenate(y_POI), distance_POI)
+    POI_count = numpy.bincount(lien, weights=ratio_POI[point], minlength=len(index_liens))
     
-    arcpy.AddMessage("Ajout des champs des moyennes et pondération par troncons")
-    #Ajout des champs si pas existants
+    arcpy.AddMessage("Calcul des moyennes et pondération par troncons")
     field_CIRC_MOY = "CIR_MOY"
-    if field_CIRC_MOY not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_CIRC_MOY, "DOUBLE")
     field_CIRC_MOY_pond = "CIR_MOY_pond"
-    if field_CIRC_MOY_pond not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_CIRC_MOY_pond, "DOUBLE")
     field_CIRC_MOY_norm = "CIR_MOY_norm"
-    if field_CIRC_MOY_norm not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_CIRC_MOY_norm, "DOUBLE")
     global field_ratio_hiera
     field_ratio_hiera = "RATIO_HIE"
-    if field_ratio_hiera not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_ratio_hiera, "DOUBLE")
-
 
     field_ACC_MOY = "ACC_MOY"
-    if field_ACC_MOY not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_ACC_MOY, "DOUBLE") 
     field_ACC_MOY_pond = "ACC_MOY_pond"
-    if field_ACC_MOY_pond not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_ACC_MOY_pond, "DOUBLE")
     field_ACC_MOY_norm = "ACC_MOY_norm"
-    if field_ACC_MOY_norm not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_ACC_MOY_norm, "DOUBLE")   
     global field_POI_COUNT
     field_POI_COUNT = "POI_COUNT"
-    if field_POI_COUNT not in [f.name for f in arcpy.ListFields(Streets_network)]:
-        arcpy.management.AddField(Streets_network, field_POI_COUNT, "DOUBLE")
-
-    
-    #Mise à jour des champs de la couche
-    with arcpy.da.UpdateCursor(Streets_network, liste_field_circ + ["FUNC_CLASS", field_CIRC_MOY, field_CIRC_MOY_pond, field_CIRC_MOY_norm, field_ratio_hiera]) as cursor:
-        j = len(liste_field_circ)
-            
-        for row in cursor:
-            moy = sum([row[e] for e in range(j)])/j
-            moy_pond = 0
-            for i in range(j):
-                moy_pond += (row[i]*(pond_circ[i]/sum(pond_circ)))
-
-            moy_norm = (moy_pond-note_min)/(note_max-note_min)
-            
-            func_class = int(row[j])
-            
-            if func_class == 1 :
-                ratio = liste_ratio_hiera[0]
-            elif func_class == 2 :
-                ratio = liste_ratio_hiera[1] 
-            elif func_class == 3 :
-                ratio = liste_ratio_hiera[2]            
-            elif func_class == 4 :
-                ratio = liste_ratio_hiera[3]
-            elif func_class == 5 :
-                ratio = liste_ratio_hiera[4]
-            
-            
-            row[j+1] = moy
-            row[j+2] = moy_pond
-            row[j+3] = moy_norm
-            row[j+4] = ratio
 
-            cursor.updateRow(row)
+    # Colonnes entières calculées sur la matrice des notes (liens x indicateurs), dans l'ordre de la table attributaire
+    notes_circ = table_attributs[liste_field_circ].to_numpy(dtype=float)
+    moy, moy_pond = calcMoyennesNotes(notes_circ, pond_circ)
+    colonnes = {
+        field_CIRC_MOY : moy,
+        field_CIRC_MOY_pond : moy_pond,
+        field_CIRC_MOY_norm : normaliserNote(moy_pond),
+        # Ratio de hiérarchie lu dans une table indexée par FUNC_CLASS (1 à 5)
+        field_ratio_hiera : numpy.asarray([numpy.nan]+liste_ratio_hiera)[lireFuncClass()]
+    }
 
+    notes_acces = table_attributs[liste_field_access].to_numpy(dtype=float)
+    moy, moy_pond = calcMoyennesNotes(notes_acces, pond_acces)
+    colonnes[field_ACC_MOY] = moy
+    colonnes[field_ACC_MOY_pond] = moy_pond
+    colonnes[field_ACC_MOY_norm] = normaliserNote(moy) # la normalisation de l'accessibilité se fait sur la moyenne non pondérée
+    colonnes[field_POI_COUNT] = 1+POI_count # Une valeur de 1 est mise par défaut dans le conte des POIs, pour éviter que les tronçons sans POI ne valent rien
 
-    with arcpy.da.UpdateCursor(Streets_network, liste_field_access + ["LINK_ID", field_ACC_MOY, field_ACC_MOY_pond, field_ACC_MOY_norm, field_POI_COUNT]) as cursor:
-        j = len(liste_field_access)
-        
-        for row in cursor:
-            link_id = str(row[j])
-            moy = sum([row[e] for e in range(j)])/j
-            moy_pond = 0
-            for i in range(j):
-                moy_pond += (row[i]*(pond_acces[i]/sum(pond_acces)))
-            
-            moy_norm = (moy-note_min)/(note_max-note_min)
-            
-            row[j+1] = moy
-            row[j+2] = moy_pond
-            row[j+3] = moy_norm
-            row[j+4] = 1+sum(POI_count[link_id]) if sum(POI_count[link_id]) != 0 else 1 # Une valeur de 1 est mise par défaut dans le conte des POIs, pour éviter que les tronçons sans POI ne valent rien
-
-            cursor.updateRow(row)
+    for nom_champ, valeurs in colonnes.items():
+        ajouterColonne(nom_champ, "DOUBLE", valeurs, None)
     
     
 #----------------------------------------------------------
 #-------------- Création de la table des indices ----------
 #----------------------------------------------------------
-def outputTable(Streets_network, nom_table, pond_circ, pond_acc):
-    
-    df = arcgis_table_to_df(Streets_network, liste_note_circulation+liste_note_accessibilite+[champ_long_Geod,field_ratio_hiera,field_POI_COUNT])
+# Champs de la table des indices et leur type (LONG : int32, DOUBLE : float64)
+summary_table_dtype = [("Indicateur", "<U64"), ("Note_1", numpy.int32), ("Note_2", numpy.int32), ("Note_3", numpy.int32), ("Somme_Note", numpy.int32), ("Somme_Note_norm", numpy.float64),
+                       ("Poids_Note_1", numpy.float64), ("Poids_Note_2", numpy.float64), ("Poids_Note_3", numpy.float64), ("Ratio", numpy.float64), ("Indice", numpy.float64), ("Indice100", numpy.int32)]
+
+def synthetiserNotes(notes, poids):
+    # notes : matrice (liens x indicateurs) des notes entières 0 à 3, poids : "demande" * longueur de chaque lien
+    # Un seul bincount donne, pour chaque indicateur et chaque note, le nombre de liens et la somme des poids
+    # Retourne un dictionnaire de colonnes (une valeur par indicateur)
+    nb_indicateurs = notes.shape[1]
+    codes = (notes.astype(numpy.int64) + 4*numpy.arange(nb_indicateurs)).ravel()
+    nombre = numpy.bincount(codes, minlength=4*nb_indicateurs).reshape(nb_indicateurs, 4)
+    somme_poids = numpy.bincount(codes, weights=numpy.repeat(numpy.asarray(poids, dtype=float), nb_indicateurs), minlength=4*nb_indicateurs).reshape(nb_indicateurs, 4)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        total_row = nombre[:, 1:].sum(axis=1)
+        somme_note = (nombre*numpy.arange(4)).sum(axis=1)
+        somme_norm = (somme_note-total_row*note_min)/(total_row*note_max-total_row*note_min)
+        total_poids = somme_poids[:, 1:].sum(axis=1)
+        ratio = (somme_poids[:, 1]*(1/3)+somme_poids[:, 2]*(2/3)+somme_poids[:, 3]*(3/3))/total_poids
+        indice = somme_norm*ratio
+
+    return {
+        "Note_1" : nombre[:, 1], "Note_2" : nombre[:, 2], "Note_3" : nombre[:, 3],
+        "Somme_Note" : somme_note, "Somme_Note_norm" : somme_norm,
+        "Poids_Note_1" : somme_poids[:, 1], "Poids_Note_2" : somme_poids[:, 2], "Poids_Note_3" : somme_poids[:, 3],
+        "Ratio" : ratio, "Indice" : indice, "Indice100" : numpy.ceil(numpy.nan_to_num(indice*100))
+    }
+
+def outputTable(Streets_network, nom_table, pond_circ, pond_acc, liste_note_circ=None, liste_note_acc=None):
+    # liste_note_circ, liste_note_acc : champs de notes de la table, ceux du profil de l'étude par défaut
+    if liste_note_circ is None:
+        liste_note_circ = liste_note_circulation
+    if liste_note_acc is None:
+        liste_note_acc = liste_note_accessibilite
+    
+    # Les notes, la longueur et les paramètres de "demande" sont lus dans la table attributaire en mémoire
+    df = table_attributs
     
     # "Demande" * Longueur : Paramètres de poids pour le calcul des indices
-    df["LEN_HIE"] = df[champ_long_Geod]*df[field_ratio_hiera]
-    df["LEN_POI"] = df[champ_long_Geod]*df[field_POI_COUNT]
+    len_hie = df[champ_long_Geod].to_numpy(float)*df[field_ratio_hiera].to_numpy(float)
+    len_POI = df[champ_long_Geod].to_numpy(float)*df[field_POI_COUNT].to_numpy(float)
     
-    # Champs de la table des indices
-    summary_table_field = ["Indicateur","Note_1", "Note_2", "Note_3","Somme_Note", "Somme_Note_norm","Poids_Note_1","Poids_Note_2","Poids_Note_3","Ratio","Indice", "Indice100"]
-    
-    summary_list = []
-    df_sum = df.sum()
-
-    # Calcul pour les indicateurs du groupe circulation
-    CIR_Note_1 = 0
-    CIR_Note_2 = 0
-    CIR_Note_3 = 0
-    CIR_indice = 0
-    i = 0
-    for field in liste_note_circulation:
-        
-        count_note1 = df[df[field]==1].count()[field]
-        count_note2 = df[df[field]==2].count()[field]
-        count_note3 = df[df[field]==3].count()[field]
-        CIR_Note_1 += count_note1
-        CIR_Note_2 += count_note2
-        CIR_Note_3 += count_note3
-        
-        sum_len_hie1 = df[df[field]==1]["LEN_HIE"].sum()
-        sum_len_hie2 = df[df[field]==2]["LEN_HIE"].sum()
-        sum_len_hie3 = df[df[field]==3]["LEN_HIE"].sum()
+    # Une ligne par indicateur, suivie des notes globales des deux groupes
+    groupes = [(liste_note_circ, len_hie, pond_circ, "CIRCULATION"), (liste_note_acc, len_POI, pond_acc, "ACCESSIBILITE")]
+    summary_table = numpy.zeros(len(liste_note_circ)+len(liste_note_acc)+len(groupes), dtype=summary_table_dtype)
 
-        total_row = count_note1+count_note2+count_note3
-        total_len_hie = sum_len_hie1+sum_len_hie2+sum_len_hie3 #Normalement égale à df_sum.at["LEN_HIE"]
-        somme_note = df_sum.at[field]
-        somme_norm = (somme_note-total_row*note_min)/(total_row*note_max-total_row*note_min)
-        
-        ratio_len_hie = (sum_len_hie1*(1/3)+sum_len_hie2*(2/3)+sum_len_hie3*(3/3))/total_len_hie
-        Indice = somme_norm*ratio_len_hie
-        CIR_indice += Indice*pond_circ[i]
-        
-        i+=1
-        
-        field = field[5:] #Pour enlever le "Note_" dans le noms des champs
-        
-        row = []
-        row.append(field)
-        row.append(count_note1)
-        row.append(count_note2)
-        row.append(count_note3)
-        row.append(somme_note)
-        row.append(somme_norm)
-        row.append(sum_len_hie1)
-        row.append(sum_len_hie2)
-        row.append(sum_len_hie3)
-        row.append(ratio_len_hie)
-        row.append(Indice)
-        row.append(math.ceil(Indice*100))
-        
-        summary_list.append(row)
-    
-    # Calcul pour les indicateurs du groupe accessibilité
-    ACC_Note_1 = 0
-    ACC_Note_2 = 0
-    ACC_Note_3 = 0
-    ACC_indice = 0
     i = 0
-    for field in liste_note_accessibilite:
-        
-        count_note1 = df[df[field]==1].count()[field]
-        count_note2 = df[df[field]==2].count()[field]
-        count_note3 = df[df[field]==3].count()[field]
-        ACC_Note_1 += count_note1
-        ACC_Note_2 += count_note2
-        ACC_Note_3 += count_note3
-
-        sum_len_POI1 = df[df[field]==1]["LEN_POI"].sum()
-        sum_len_POI2 = df[df[field]==2]["LEN_POI"].sum()
-        sum_len_POI3 = df[df[field]==3]["LEN_POI"].sum()
-
-        total_row = count_note1+count_note2+count_note3
-        total_len_POI = sum_len_POI1+sum_len_POI2+sum_len_POI3 #Normalement égale à df_sum.at["LEN_POI"]
-        somme_note = df_sum.at[field]
-        somme_norm = (somme_note-total_row*note_min)/(total_row*note_max-total_row*note_min)
-        
-        ratio_len_POI = (sum_len_POI1*(1/3)+sum_len_POI2*(2/3)+sum_len_POI3*(3/3))/total_len_POI
-        Indice = somme_norm*ratio_len_POI
-        ACC_indice += Indice*pond_acc[i]
-        
-        i+=1
-
-        field = field[5:] #Pour enlever le "Note_" dans le noms des champs
-
-        row = []
-        row.append(field)
-        row.append(count_note1)
-        row.append(count_note2)
-        row.append(count_note3)
-        row.append(somme_note)
-        row.append(somme_norm)
-        row.append(sum_len_POI1)
-        row.append(sum_len_POI2)
-        row.append(sum_len_POI3)
-        row.append(ratio_len_POI)
-        row.append(Indice)
-        row.append(math.ceil(Indice*100))
-        
-        summary_list.append(row)
-    
-    # Notes globales des deux groupes
-    summary_list.append(["CIRCULATION", CIR_Note_1, CIR_Note_2, CIR_Note_3, 0,0,0,0,0,0, CIR_indice/sum(pond_circ), math.ceil((CIR_indice/sum(pond_circ))*100)])
-    summary_list.append(["ACCESSIBILITE", ACC_Note_1, ACC_Note_2, ACC_Note_3, 0,0,0,0,0,0, ACC_indice/sum(pond_acc), math.ceil((ACC_indice/sum(pond_acc))*100)])
+    for j, (liste_note, poids, ponderation, nom_groupe) in enumerate(groupes):
+        colonnes = synthetiserNotes(df[liste_note].to_numpy(dtype=numpy.int8), poids)
+
+        lignes = slice(i, i+len(liste_note))
+        summary_table["Indicateur"][lignes] = [field[5:] for field in liste_note] #Pour enlever le "Note_" dans le noms des champs
+        for nom_champ, colonne in colonnes.items():
+            summary_table[nom_champ][lignes] = colonne
+        i += len(liste_note)
+
+        # Note globale du groupe : moyenne des indices pondérée par l'utilisateur
+        ligne_groupe = len(summary_table)-len(groupes)+j
+        summary_table["Indicateur"][ligne_groupe] = nom_groupe
+        for nom_champ in ("Note_1", "Note_2", "Note_3"):
+            summary_table[nom_champ][ligne_groupe] = colonnes[nom_champ].sum()
+        indice = float((colonnes["Indice"]*numpy.asarray(ponderation)).sum()/sum(ponderation))
+        summary_table["Indice"][ligne_groupe] = indice
+        summary_table["Indice100"][ligne_groupe] = math.ceil(indice*100) if not math.isnan(indice) else 0
     
     #https://pro.arcgis.com/en/pro-app/latest/arcpy/functions/validatetablename.htm
     nom_table = arcpy.ValidateTableName(nom_table) # a priori pas necessaire, mais au cas ou
 
-    #Création de la table et ajout des données
-    note_summary_table = arcpy.management.CreateTable(out_path=f"{workspace}",out_name=nom_table)[0]
-    arcpy.management.AddField(note_summary_table, summary_table_field[0], "STRING")
-    arcpy.management.AddField(note_summary_table, summary_table_field[1], "LONG")
-    arcpy.management.AddField(note_summary_table, summary_table_field[2], "LONG")
-    arcpy.management.AddField(note_summary_table, summary_table_field[3], "LONG")
-    arcpy.management.AddField(note_summary_table, summary_table_field[4], "LONG")
-    arcpy.management.AddField(note_summary_table, summary_table_field[5], "DOUBLE")
-    arcpy.management.AddField(note_summary_table, summary_table_field[6], "DOUBLE")
-    arcpy.management.AddField(note_summary_table, summary_table_field[7], "DOUBLE")
-    arcpy.management.AddField(note_summary_table, summary_table_field[8], "DOUBLE")
-    arcpy.management.AddField(note_summary_table, summary_table_field[9], "DOUBLE")
-    arcpy.management.AddField(note_summary_table, summary_table_field[10], "DOUBLE")
-    arcpy.management.AddField(note_summary_table, summary_table_field[11], "LONG")
-    
-    with arcpy.da.InsertCursor(note_summary_table, summary_table_field) as cursor:
-        for row in summary_list:
-            cursor.insertRow(row)
+    #Création de la table et ajout des données en une seule écriture
+    note_summary_table = fr"{workspace}\{nom_table}"
+    if arcpy.Exists(note_summary_table):
+        arcpy.management.Delete(note_summary_table)
+    arcpy.da.NumPyArrayToTable(summary_table, note_summary_table)
     return note_summary_table
 
 
+#----------------------------------------------------------
+#-------------- Analyse de sensibilité des pondérations ---
+#----------------------------------------------------------
+# Les pondérations des indicateurs (pond_circ, pond_acces) et les ratios de hiérarchie sont tirés aléatoirement autour des valeurs
+# de l'utilisateur (facteur uniforme entre 1-variation et 1+variation). Les notes déjà calculées sont réutilisées :
+#   - par lien, les moyennes pondérées sont un produit matriciel notes x tirages, calculé par lots de liens pour borner la mémoire
+#   - par indicateur, les sommes de longueur par note et par FUNC_CLASS sont calculées une fois, chaque tirage des ratios de hiérarchie
+#     n'est ensuite qu'un produit avec ce tableau
+
+def tirerPonderations(ponderation, nb_tirages, variation, generateur):
+    # Retourne une matrice (nombre de poids, nb_tirages) de poids perturbés
+    ponderation = numpy.asarray(ponderation, dtype=float)
+    facteurs = generateur.uniform(1-variation, 1+variation, size=(len(ponderation), nb_tirages))
+    return ponderation[:, None]*facteurs
+
+def percentilesParLien(notes, tirages, percentiles, taille_lot):
+    # Percentiles, pour chaque lien, de la moyenne pondérée des notes sur l'ensemble des tirages de poids
+    tirages = tirages/tirages.sum(axis=0)
+    resultat = numpy.empty((len(notes), len(percentiles)))
+    nb_liens_lot = max(1, taille_lot//tirages.shape[1])
+    for debut in range(0, len(notes), nb_liens_lot):
+        moy_pond = notes[debut:debut+nb_liens_lot] @ tirages
+        resultat[debut:debut+nb_liens_lot] = numpy.percentile(moy_pond, percentiles, axis=1).T
+    return resultat
+
+def calcSensibilite(nom_table, pond_circ, pond_acces, ratio_hiera, nb_tirages=1000, variation=0.2, percentiles=(5, 50, 95), taille_lot=5000000, graine=None):
+    
+    arcpy.AddMessage("Analyse de sensibilité : {} tirages, variation de +/- {}%".format(nb_tirages, round(variation*100)))
+    generateur = numpy.random.default_rng(graine)
+    liste_ratio_hiera = lireRatiosHierarchie(ratio_hiera)
+
+    W_circ = tirerPonderations(pond_circ, nb_tirages, variation, generateur)
+    W_acces = tirerPonderations(pond_acces, nb_tirages, variation, generateur)
+    W_ratio = tirerPonderations(liste_ratio_hiera, nb_tirages, variation, generateur)
+
+    # Bandes d'incertitude par lien
+    notes_circ = table_attributs[liste_note_circulation].to_numpy(dtype=float)
+    notes_acces = table_attributs[liste_note_accessibilite].to_numpy(dtype=float)
+    for nom_champ, notes, tirages in (("CIR_MOY_pond", notes_circ, W_circ), ("ACC_MOY_pond", notes_acces, W_acces)):
+        bandes = percentilesParLien(notes, tirages, percentiles, taille_lot)
+        for i, percentile in enumerate(percentiles):
+            ajouterColonne("{}_P{:02d}".format(nom_champ, int(percentile)), "DOUBLE", bandes[:, i], None)
+
+    # Indices de circulation : la somme des longueurs par (indicateur, note, FUNC_CLASS) ne dépend pas des tirages
+    # FUNC_CLASS va de 1 au nombre de ratios, la case 0 reste vide
+    longueur = table_attributs[champ_long_Geod].to_numpy(float)
+    func_class = lireFuncClass()
+    nb_circ = len(liste_note_circulation)
+    nb_cases = len(liste_ratio_hiera)+1
+    codes = ((notes_circ.astype(numpy.int64) + 4*numpy.arange(nb_circ))*nb_cases + func_class[:, None]).ravel()
+    L = numpy.bincount(codes, weights=numpy.repeat(longueur, nb_circ), minlength=nb_circ*4*nb_cases).reshape(nb_circ, 4, nb_cases)
+    sommes = L[:, :, 1:] @ W_ratio # (indicateur, note, tirage)
+
+    colonnes_circ = synthetiserNotes(notes_circ.astype(numpy.int8), longueur*table_attributs[field_ratio_hiera].to_numpy(float))
+    colonnes_acces = synthetiserNotes(notes_acces.astype(numpy.int8), longueur*table_attributs[field_POI_COUNT].to_numpy(float))
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        ratio = (sommes[:, 1]*(1/3)+sommes[:, 2]*(2/3)+sommes[:, 3]*(3/3))/sommes[:, 1:].sum(axis=1)
+        indices_circ = colonnes_circ["Somme_Note_norm"][:, None]*ratio # (indicateur, tirage)
+        # Les indices d'accessibilité sont pondérés par les POI, seule la pondération des indicateurs varie
+        indices_acces = numpy.repeat(colonnes_acces["Indice"][:, None], nb_tirages, axis=1)
+        circulation = (indices_circ*W_circ).sum(axis=0)/W_circ.sum(axis=0)
+        accessibilite = (indices_acces*W_acces).sum(axis=0)/W_acces.sum(axis=0)
+
+    # Table des bandes d'incertitude par indicateur et pour les deux groupes
+    indicateurs = [field[5:] for field in liste_note_circulation+liste_note_accessibilite] + ["CIRCULATION", "ACCESSIBILITE"]
+    nominal = numpy.concatenate([colonnes_circ["Indice"], colonnes_acces["Indice"],
+                                 [(colonnes_circ["Indice"]*numpy.asarray(pond_circ)).sum()/sum(pond_circ), (colonnes_acces["Indice"]*numpy.asarray(pond_acces)).sum()/sum(pond_acces)]])
+    echantillons = numpy.vstack([indices_circ, indices_acces, circulation, accessibilite])
+
+    dtype = [("Indicateur", "<U64"), ("Indice", numpy.float64)] + [("Indice_P{:02d}".format(int(percentile)), numpy.float64) for percentile in percentiles]
+    sensibilite_table = numpy.zeros(len(indicateurs), dtype=dtype)
+    sensibilite_table["Indicateur"] = indicateurs
+    sensibilite_table["Indice"] = nominal
+    bandes = numpy.nanpercentile(echantillons, percentiles, axis=1)
+    for i, percentile in enumerate(percentiles):
+        sensibilite_table["Indice_P{:02d}".format(int(percentile))] = bandes[i]
+
+    nom_table = arcpy.ValidateTableName(nom_table)
+    table_sortie = fr"{workspace}\{nom_table}"
+    if arcpy.Exists(table_sortie):
+        arcpy.management.Delete(table_sortie)
+    arcpy.da.NumPyArrayToTable(sensibilite_table, table_sortie)
+    return table_sortie
+
+#----------------------------------------------------------
+#-------------- Registre des critères ---------------------
+#----------------------------------------------------------
+# Chaque critère déclare ses entrées :
+#   "champ" : champ de la note, "groupe" : "circulation" ou "accessibilite" (liste de notes et pondérations du groupe),
+#   "champs_reseau" : champs de la couche réseau lus dans la table attributaire,
+#   "tables" : données auxiliaires lues (tables HERE, Lane, SpeedData, couches de points, services HERE),
+#   "profils" : déclarations propres à un profil de véhicule, qui remplacent celles par défaut
+# L'ordre du registre est celui des champs de la couche, des listes de notes et des pondérations pond_circ et pond_acces.
+# Le lancement est planifié à partir des critères actifs (planifierCriteres) : seuls leurs champs et leurs tables sont lus.
+registre_criteres = {
+    "Voie" : {"champ" : "Note_NbVoie", "groupe" : "circulation", "champs_reseau" : ["FROM_LANES","TO_LANES","LANE_CAT","DIR_TRAVEL","PHYS_LANES"], "tables" : [],
+              "profils" : {"VC" : {"champs_reseau" : ["LANE_CAT"], "tables" : ["Lane"]}}},
+    "TP" : {"champ" : "Note_ArretTP", "groupe" : "circulation", "champs_reseau" : ["FUNC_CLASS"], "tables" : ["Arrêts TP"]},
+    "Carrefour" : {"champ" : "Note_Carrefour", "groupe" : "circulation", "champs_reseau" : ["ROUNDABOUT"], "tables" : ["Cdms", "CndMod"]},
+    "Obstacle" : {"champ" : "Note_Obstacle", "groupe" : "circulation", "champs_reseau" : [], "tables" : ["Cdms", "CndMod"]},
+    "Vitesse" : {"champ" : "Note_Vitesse", "groupe" : "circulation", "champs_reseau" : ["TO_SPD_LIM","FR_SPD_LIM"], "tables" : []},
+    "Congestion" : {"champ" : "Note_Congestion", "groupe" : "circulation", "champs_reseau" : [], "tables" : ["SpeedData"]},
+    "Chantier" : {"champ" : "Note_Chantier", "groupe" : "circulation", "champs_reseau" : [], "tables" : ["Chantiers"]},
+    "Gabarit" : {"champ" : "Note_Gabarit", "groupe" : "accessibilite", "champs_reseau" : [], "tables" : ["Cdms", "CndMod"]},
+    "Horaire" : {"champ" : "Note_Horaire", "groupe" : "accessibilite", "champs_reseau" : [], "tables" : ["Cdms", "CdmsDtmod"]},
+    "Stationnement" : {"champ" : "Note_Stationnement", "groupe" : "accessibilite", "champs_reseau" : [], "tables" : ["Stationnement"]},
+    "Pente" : {"champ" : "Note_Pente", "groupe" : "accessibilite", "champs_reseau" : [], "tables" : ["Tuiles HERE"]}
+}
+
+# Champs lus quel que soit le critère : classe de route (ratio de hiérarchie de la note globale), en plus de la longueur géodésique
+champs_reseau_communs = ["FUNC_CLASS"]
+
+def declarationCritere(nom, profil):
+    # Déclaration du critère pour un profil de véhicule
+    declaration = dict(registre_criteres[nom])
+    declaration.update(registre_criteres[nom].get("profils", dict()).get(profil, dict()))
+    return declaration
+
+def planifierCriteres(criteres_actifs=None, profils=()):
+    # criteres_actifs : noms du registre (ex : ["Voie", "Congestion", "Pente"]), tous si None
+    # profils : profils de véhicules notés (celui de l'étude et les autres), dont les déclarations sont réunies
+    # Retourne les critères actifs dans l'ordre du registre, les champs de la couche réseau à charger et les tables auxiliaires à lire
+    if criteres_actifs is None:
+        criteres_actifs = list(registre_criteres)
+    inconnus = [nom for nom in criteres_actifs if nom not in registre_criteres]
+    if inconnus:
+        raise ValueError("Critères inconnus : {} (critères disponibles : {})".format(inconnus, ", ".join(registre_criteres)))
+
+    criteres = [nom for nom in registre_criteres if nom in criteres_actifs]
+    champs_reseau = list(champs_reseau_communs)
+    tables = []
+    for nom in criteres:
+        for profil in profils:
+            declaration = declarationCritere(nom, profil)
+            champs_reseau += [champ for champ in declaration["champs_reseau"] if champ not in champs_reseau]
+            tables += [table for table in declaration["tables"] if table not in tables]
+
+    arcpy.AddMessage("Critères actifs : {}".format(", ".join(criteres)))
+    arcpy.AddMessage("Champs du réseau lus : {}".format(", ".join(champs_reseau)))
+    arcpy.AddMessage("Données auxiliaires lues : {}".format(", ".join(tables) if tables else "aucune"))
+    return {"criteres" : criteres, "champs_reseau" : champs_reseau, "tables" : tables}
+
+def ponderationsActives(ponderation, groupe, criteres):
+    # Les pondérations sont données pour tous les critères du groupe, dans l'ordre du registre : seules celles des critères actifs sont gardées
+    # Une liste qui a déjà une pondération par critère actif est gardée telle quelle
+    noms_groupe = [nom for nom, declaration in registre_criteres.items() if declaration["groupe"] == groupe]
+    actifs_groupe = [nom for nom in noms_groupe if nom in criteres]
+    if len(ponderation) == len(actifs_groupe):
+        return ponderation
+    if len(ponderation) != len(noms_groupe):
+        raise ValueError("{} pondérations {} pour {} critères ({})".format(len(ponderation), groupe, len(noms_groupe), ", ".join(noms_groupe)))
+    return [poids for nom, poids in zip(noms_groupe, ponderation) if nom in criteres]
+
+#----------------------------------------------------------
+#-------------- Notation de plusieurs profils de véhicules -
+#----------------------------------------------------------
+# Les paramètres bruts par tronçon (NB_OBSTACLE, CONG_RSI_*, LIM_*, ACCES_PJOUR, sum_NbPlace, PENTE_MAX...) sont calculés une seule fois
+# pour le profil de l'étude, puis notés pour chaque autre profil avec ses seuils de la table des valeurs par défaut
+
+# Indicateurs de la table des seuils par critère. Les bornes du gabarit sont concaténées dans l'ordre des MOD_TYPE 41 à 45
+indicateurs_criteres = {
+    "Voie" : ["Nombre de voie"],
+    "TP" : ["Arrêts TC"],
+    "Obstacle" : ["Obstacle"],
+    "Vitesse" : ["Vitesse limite"],
+    "Congestion" : ["Congestion"],
+    "Chantier" : ["Chantier"],
+    "Gabarit" : ["Hauteur", "Poids", "Poids essieu", "Longueur", "Largeur"],
+    "Horaire" : ["Horaire"],
+    "Stationnement" : ["Place de stationnement"],
+    "Pente" : ["Pente"]
+}
+
+def lireSeuilsProfils(table_seuil, profils, criteres=None):
+    # table_seuil : table des valeurs par défaut (GROUPE;CRITERE;INDICATEUR;VEHICULE;IND_ID;BORNE_B;BORNE_M;UNITE)
+    # criteres : critères actifs, tous si None
+    # Retourne {profil : {critère : liste des bornes}}
+    df = pandas.read_csv(table_seuil, sep=";", dtype=str, encoding="utf-8-sig").fillna("")
+    bornes = {(indicateur.strip(), vehicule.strip()) : [float(borne_b.replace(",",".")), float(borne_m.replace(",","."))]
+              for indicateur, vehicule, borne_b, borne_m in df[["INDICATEUR","VEHICULE","BORNE_B","BORNE_M"]].itertuples(index=False, name=None)
+              if borne_b != "" and borne_m != ""}
+
+    indicateurs_actifs = {critere : indicateurs for critere, indicateurs in indicateurs_criteres.items() if criteres is None or critere in criteres}
+    seuils = dict()
+    for profil in profils:
+        manquants = [indicateur for indicateurs in indicateurs_actifs.values() for indicateur in indicateurs if (indicateur, profil) not in bornes]
+        if manquants:
+            raise ValueError("Seuils manquants pour le profil {} dans la table {} : {}".format(profil, table_seuil, manquants))
+        seuils[profil] = {critere : [borne for indicateur in indicateurs for borne in bornes[(indicateur, profil)]] for critere, indicateurs in indicateurs_actifs.items()}
+    return seuils
+
+# Critère de la table des seuils de chaque champ de note, None pour un critère sans seuil (Carrefour)
+criteres_champs = {declaration["champ"] : nom if nom in indicateurs_criteres else None for nom, declaration in registre_criteres.items()}
+
+def calcNotesIndicateur(field_name, profil, seuils, champ_nb_place=None, table_lane=None, suffixe_distance="", df=None):
+    # Note un indicateur à partir de ses paramètres bruts, lus dans df (par défaut la table attributaire)
+    # seuils : liste des bornes du critère (flottants), suffixe_distance : distance de stationnement autre que la première (ex : "_50")
+    # ou période de congestion (ex : "_matin")
+    # Retourne une note par lien, dans l'ordre de index_liens
+    if df is None:
+        df = table_attributs
+
+    if field_name == "Note_NbVoie" and profil == "VC":
+        # Les bandes cyclables ne sont lues que si elles ne l'ont pas déjà été
+        if "BANDE_CYC" not in df:
+            ajouterColonne("BANDE_CYC", "TEXT", numpy.where(lireBandesCyclables(table_lane), "Oui", "Non"), "Non")
+        return calcNoteVoieVelo(df["LANE_CAT"].astype(int).to_numpy(), (df["BANDE_CYC"] == "Oui").to_numpy())
+
+    if field_name == "Note_Carrefour":
+        # Le type de carrefour ne dépend pas du véhicule
+        return df["Note_Carrefour"].to_numpy()
+
+    if field_name == "Note_Gabarit":
+        # La note de gabarit est la plus mauvaise des notes de restriction, les tronçons sans restriction ont la note maximale
+        champs_gabarit = ["LIM_HAUT", "LIM_POIDS", "LIM_ChESSIEU","LIM_LONG","LIM_LARG"]
+        notes_gabarit = [[3 if valeur == "Aucun" else calcNoteGabarit(valeur, seuils[2*i], seuils[2*i+1]) for valeur in df[champ].tolist()]
+                         for i, champ in enumerate(champs_gabarit)]
+        return numpy.min(numpy.asarray(notes_gabarit), axis=0)
+
+    seuil_bon, seuil_mauv = seuils[0], seuils[1]
+    if field_name == "Note_NbVoie":
+        return calcNoteVoie(df["TO_LANES"].to_numpy(), df["FROM_LANES"].to_numpy(), df["LANE_CAT"].to_numpy(), df["DIR_TRAVEL"].to_numpy(), df["PHYS_LANES"].to_numpy(), seuil_bon, seuil_mauv)
+    elif field_name == "Note_ArretTP":
+        # Les tronçons sans arrêt ont 0 passage et donc la note maximale
+        return calcNoteTP(df["NB_PASSAGE_TP"].to_numpy(dtype=float), seuil_bon, seuil_mauv)
+    elif field_name == "Note_Obstacle":
+        return calcNoteObstacle(df["NB_OBSTACLE"].to_numpy(dtype=float), seuil_bon, seuil_mauv)
+    elif field_name == "Note_Vitesse":
+        return calcNoteVitesse(df["TO_SPD_LIM"].to_numpy(), df["FR_SPD_LIM"].to_numpy(), seuil_bon, seuil_mauv)
+    elif field_name == "Note_Congestion":
+        # Les périodes de congestion ont leurs propres R_i (ex : CONG_RSI_T_matin pour Note_Congestion_matin)
+        return calcNoteCongestion(df["CONG_RSI_T"+suffixe_distance].to_numpy(dtype=float), df["CONG_RSI_F"+suffixe_distance].to_numpy(dtype=float), seuil_bon, seuil_mauv)
+    elif field_name == "Note_Chantier":
+        # Le chantier retenu pour chaque tronçon est celui choisi lors du calcul du critère
+        return [calcNoteChantier(convertCritChantier(impact), duree, seuil_bon, seuil_mauv) for impact, duree in df[["IMPACT_CHANTIER","DUREE_CHANTIER"]].itertuples(index=False, name=None)]
+    elif field_name == "Note_Horaire":
+        return calcNoteHoraire(df["ACCES_PJOUR"].to_numpy(dtype=float), seuil_bon, seuil_mauv)
+    elif field_name == "Note_Stationnement":
+        return calcNoteStationnement(df["sum_"+champ_nb_place+suffixe_distance].to_numpy(dtype=float), seuil_bon, seuil_mauv)
+    elif field_name == "Note_Pente":
+        return calcNotePente(df["PENTE_MAX"].to_numpy(dtype=float), seuil_bon, seuil_mauv)
+    raise ValueError("Pas de notation à partir des paramètres bruts pour le champ {}".format(field_name))
+
+def calcNotesProfil(profil, seuils, champ_nb_place, table_lane, pond_circ, pond_acces):
+    # Note chaque indicateur du profil à partir des paramètres bruts de la table attributaire
+    # Les champs de notes sont ceux de l'étude suffixés du profil (ex : Note_Pente_VUL)
+    # Retourne les listes des champs de notes de circulation et d'accessibilité du profil
+    suffixe = "_"+profil
+    champs = liste_note_circulation+liste_note_accessibilite
+    arcpy.AddMessage("Profil {} : calcul des champs {}".format(profil, ", ".join(champ+suffixe for champ in champs)))
+    for champ in champs:
+        critere = criteres_champs[champ]
+        notes = calcNotesIndicateur(champ, profil, seuils[critere] if critere else None, champ_nb_place, table_lane)
+        ajouterColonne(champ+suffixe, "SHORT", numpy.asarray(notes), 3)
+
+    # Les champs sont dans le même ordre que ceux de l'étude, pour appliquer les mêmes pondérations
+    liste_note_circ = [champ+suffixe for champ in liste_note_circulation]
+    liste_note_acc = [champ+suffixe for champ in liste_note_accessibilite]
+    ajouterColonne("CIR_MOY_pond"+suffixe, "DOUBLE", calcMoyennesNotes(table_attributs[liste_note_circ].to_numpy(dtype=float), pond_circ)[1], None)
+    ajouterColonne("ACC_MOY_pond"+suffixe, "DOUBLE", calcMoyennesNotes(table_attributs[liste_note_acc].to_numpy(dtype=float), pond_acces)[1], None)
+    return liste_note_circ, liste_note_acc
+
+
+#----------------------------------------------------------
+#-------------- Points de reprise des critères ------------
+#----------------------------------------------------------
+# Les colonnes calculées par chaque critère sont enregistrées dans une base SQLite, avec l'empreinte de ses entrées :
+# contenu des tables lues, paramètres autres que les seuils et réseau étudié (LINK_ID, FUNC_CLASS et sommets).
+# L'export SpeedData (plusieurs Go) est identifié par son chemin, sa taille et sa date de modification (sourceSpeedData), sans être relu.
+# Les tables HERE sont identifiées par leur chemin, leur nombre de lignes et leur date de modification (empreinteSource) : elles ne sont lues qu'une fois, par la jointure.
+# Une table HERE sans date de modification (geodatabase d'entreprise, service) n'a pas d'empreinte : les critères qui la lisent ne sont pas repris.
+# Le critère Pente n'est repris que pendant la durée de validité des tuiles du cache (duree_cache_tuiles_jours), et tant que le cache n'a pas changé.
+# Si l'empreinte n'a pas changé au lancement suivant, les colonnes sont restaurées sans lire les données ni télécharger les tuiles HERE.
+# Si seuls les seuils ont changé, la note est recalculée à partir des paramètres bruts restaurés (calcNotesIndicateur).
+
+version_points_reprise = 2 # à incrémenter lorsque le calcul d'un critère change, pour invalider les points de reprise existants
+nb_points_reprise_max = 20 # nombre de points de reprise conservés par critère, les plus anciens sont supprimés
+
+verrou_points_reprise = threading.Lock() # la connexion est partagée par les threads des critères
+
+# Le contenu d'un point de reprise ne doit pas pouvoir exécuter de code à la lecture (la base est souvent sur un dossier partagé) :
+# archive .npz lue sans pickle, colonnes numériques en tableaux, autres colonnes (textes, valeurs nulles) et liste des champs en JSON
+def serialiserColonnes(colonnes):
+    # colonnes : {nom_champ : (type_champ, valeurs)}
+    tableaux = {}
+    entete = []
+    for i, (nom_champ, (type_champ, valeurs)) in enumerate(colonnes.items()):
+        tableau = numpy.asarray(valeurs)
+        if tableau.dtype.kind in "biuf":
+            tableaux["c{}".format(i)] = tableau
+            entete.append([nom_champ, type_champ, "npy"])
+        else:
+            tableaux["c{}".format(i)] = numpy.asarray(json.dumps([e.item() if isinstance(e, numpy.generic) else e for e in valeurs], ensure_ascii=False))
+            entete.append([nom_champ, type_champ, "json"])
+    tableaux["entete"] = numpy.asarray(json.dumps(entete, ensure_ascii=False))
+    contenu = io.BytesIO()
+    numpy.savez(contenu, **tableaux)
+    return zlib.compress(contenu.getvalue())
+
+def deserialiserColonnes(contenu):
+    with numpy.load(io.BytesIO(zlib.decompress(contenu)), allow_pickle=False) as tableaux:
+        return {nom_champ : (type_champ, tableaux["c{}".format(i)].tolist() if format_colonne == "npy" else json.loads(str(tableaux["c{}".format(i)])))
+                for i, (nom_champ, type_champ, format_colonne) in enumerate(json.loads(str(tableaux["entete"])))}
+
+def ouvrirPointsReprise(chemin_points_reprise):
+    connexion = sqlite3.connect(chemin_points_reprise, check_same_thread=False)
+    connexion.execute("CREATE TABLE IF NOT EXISTS criteres (critere TEXT, empreinte TEXT, seuils TEXT, contenu BLOB, date_maj REAL, PRIMARY KEY (critere, empreinte))")
+    return connexion
+
+def calcEmpreinte(*elements):
+    # Empreinte SHA-256 d'une liste de paramètres (textes, nombres, empreintes de tables)
+    return hashlib.sha256(json.dumps([version_points_reprise]+list(elements), default=str, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def empreinteTable(table, champs, filtre=""):
+    # Empreinte du contenu d'une table : octets du fichier pour un .csv ou un .parquet, sinon valeurs des champs lus par le critère
+    # Dans un lot d'études, l'empreinte d'une table n'est calculée qu'une fois
+    cle = (str(table), repr(champs), filtre)
+    if donnees_lot is not None and cle in donnees_lot["empreintes"]:
+        return donnees_lot["empreintes"][cle]
+    hachage = hashlib.sha256()
+    if str(table).lower().endswith((".csv", ".txt", ".parquet")):
+        with open(table, "rb") as fichier:
+            for bloc in iter(lambda: fichier.read(1024*1024), b""):
+                hachage.update(bloc)
+    else:
+        with verrou_arcpy, arcpy.da.SearchCursor(table, champs, where_clause=filtre) as cursor:
+            for row in cursor:
+                hachage.update(repr(row).encode("utf-8"))
+    if donnees_lot is not None:
+        donnees_lot["empreintes"][cle] = hachage.hexdigest()
+    return hachage.hexdigest()
+
+def dateModification(chemin):
+    # Date de modification d'une source : le fichier lui-même (.dbf, .csv...), sinon le fichier le plus récent de la geodatabase qui la contient
+    # None si la source n'est pas sur le disque (geodatabase d'entreprise, service)
+    if os.path.isfile(chemin):
+        return os.path.getmtime(chemin)
+    while chemin and not chemin.lower().endswith(".gdb"):
+        parent = os.path.dirname(chemin)
+        chemin = parent if parent != chemin else ""
+    if not os.path.isdir(chemin):
+        return None
+    return max([os.path.getmtime(chemin)]+[os.path.getmtime(os.path.join(chemin, e)) for e in os.listdir(chemin)])
+
+def empreinteSource(table):
+    # Empreinte d'une table sans lire ses lignes : chemin, nombre de lignes et date de modification
+    # None si la date de modification n'est pas connue : une modification qui garde le nombre de lignes ne serait pas détectée
+    with verrou_arcpy:
+        chemin = arcpy.Describe(table).catalogPath
+        nb_lignes = int(arcpy.management.GetCount(table)[0])
+    date_modification = dateModification(chemin)
+    if date_modification is None:
+        arcpy.AddWarning("Date de modification de {} inconnue : pas de point de reprise pour les critères qui la lisent".format(chemin))
+        return None
+    return calcEmpreinte(chemin, nb_lignes, date_modification)
+
+def empreinteReseau(Streets_network):
+    # Empreinte des liens étudiés, de leur classe et de leur géométrie
+    sommets = arcpy.da.FeatureClassToNumPyArray(Streets_network, ["LINK_ID", "FUNC_CLASS", "SHAPE@X", "SHAPE@Y"], explode_to_points=True)
+    hachage = hashlib.sha256(index_liens.tobytes())
+    for champ in ["LINK_ID", "FUNC_CLASS", "SHAPE@X", "SHAPE@Y"]:
+        hachage.update(numpy.ascontiguousarray(sommets[champ]).tobytes())
+    return hachage.hexdigest()
+
+def reprendreCritere(connexion, field_name, empreinte, seuils, profil, champ_nb_place=None, table_lane=None):
+    # Restaure les colonnes du critère si un point de reprise a la même empreinte, et recalcule la note si les seuils ont changé
+    # Retourne False si le critère doit être calculé
+    if connexion is None:
+        return False
+    with verrou_points_reprise:
+        row = connexion.execute("SELECT seuils, contenu FROM criteres WHERE critere = ? AND empreinte = ?", (field_name, empreinte)).fetchone()
+    if row is None:
+        return False
+
+    colonnes = deserialiserColonnes(row[1])
+    for nom_champ, (type_champ, valeurs) in colonnes.items():
+        ajouterColonne(nom_champ, type_champ, valeurs, None)
+
+    if row[0] != seuils:
+        # La note de la première distance de stationnement est suivie de celles des autres distances (ex : Note_Stationnement_50)
+        # Les paramètres bruts sont lus dans les colonnes restaurées, qui ne sont pas encore dans la table si le critère est exécuté en parallèle
+        bornes = [float(e.replace(",",".")) for e in seuilStringToList(seuils)]
+        df = pandas.DataFrame({nom_champ : valeurs for nom_champ, (type_champ, valeurs) in colonnes.items()})
+        for nom_champ in [nom_champ for nom_champ in colonnes if nom_champ == field_name or nom_champ.startswith(field_name+"_")]:
+            notes = calcNotesIndicateur(field_name, profil, bornes, champ_nb_place, table_lane, nom_champ[len(field_name):], df=df)
+            ajouterColonne(nom_champ, colonnes[nom_champ][0], numpy.asarray(notes), 3)
+        arcpy.AddMessage("Point de reprise {} : paramètres restaurés, note recalculée avec les seuils {}".format(field_name, seuils))
+    else:
+        arcpy.AddMessage("Point de reprise {} : colonnes restaurées ({})".format(field_name, ", ".join(colonnes)))
+
+    with verrou_points_reprise, connexion:
+        connexion.execute("UPDATE criteres SET date_maj = ? WHERE critere = ? AND empreinte = ?", (time.time(), field_name, empreinte))
+    return True
+
+def enregistrerCritere(connexion, field_name, empreinte, seuils, colonnes_critere):
+    # colonnes_critere : liste des colonnes (nom, type, valeurs) ajoutées par le critère
+    if connexion is None:
+        return
+    colonnes = {nom_champ : (type_champ, list(valeurs)) for nom_champ, type_champ, valeurs in colonnes_critere}
+    with verrou_points_reprise, connexion:
+        connexion.execute("INSERT OR REPLACE INTO criteres VALUES (?, ?, ?, ?, ?)", (field_name, empreinte, seuils, serialiserColonnes(colonnes), time.time()))
+        connexion.execute("DELETE FROM criteres WHERE critere = ? AND empreinte NOT IN (SELECT empreinte FROM criteres WHERE critere = ? ORDER BY date_maj DESC LIMIT ?)", (field_name, field_name, nb_points_reprise_max))
+
+def tablesHereEtude(Cdms, CndMod, CdmsDtmod):
+    # Jointure des tables HERE et classement des conditions, faits au premier critère qui en a besoin
+    # Les critères exécutés en parallèle attendent la fin de la jointure commencée par le premier d'entre eux
+    global tables_here_etude
+    with verrou_tables_here:
+        if tables_here_etude is None and donnees_lot is not None and donnees_lot["tables_here"] is not None:
+            arcpy.AddMessage("Tables HERE du lot restreintes aux liens de l'étude")
+            tables_here_etude = extraireTablesHere(donnees_lot["tables_here"])
+        if tables_here_etude is None:
+            arcpy.AddMessage("Jointure en mémoire Cdms, CndMod et CdmsDtmod")
+            # Seules les colonnes utiles des tables HERE sont lues, pour les liens de l'étude, sans copie du réseau dans la scratchGDB
+            tables_here = joindreTablesHere(Cdms=Cdms, CndMod=CndMod, CdmsDtmod=CdmsDtmod, liens_etude=set(index_liens.tolist()))
+            # Une seule lecture des conditions pour les indicateurs "Type de Carrefour", "Obstacle", "Gabarit"
+            tables_here_etude = {"horaires" : tables_here["horaires"], "conditions" : classerConditionsCdmsMod(tables_here["conditions"])}
+    return tables_here_etude
+
+tables_here_etude = None
+verrou_tables_here = threading.Lock()
+
+def extraireTablesHere(tables_here):
+    # Restreint aux liens de l'étude des tables HERE jointes et classées pour un réseau plus grand (lot d'études)
+    # Les conditions d'un lien sont lues dans le même ordre : le résultat est celui d'une jointure faite pour l'étude seule
+    horaires = tables_here["horaires"]
+    return {"horaires" : horaires[positionsLiens(horaires["LINK_ID"].to_numpy()) >= 0],
+            "conditions" : {critere : {link_id : valeur for link_id, valeur in liens.items() if link_id in position_liens}
+                            for critere, liens in tables_here["conditions"].items()}}
+
+
+#----------------------------------------------------------
+#-------------- Exécution parallèle des critères ----------
+#----------------------------------------------------------
+# Une fois le réseau chargé, les critères sont indépendants : chacun lit la table en mémoire et ses données d'entrée, et produit ses colonnes.
+# Ils sont exécutés dans des threads : les téléchargements HERE, la lecture des .csv et les calculs numpy se recouvrent,
+# les lectures arcpy restent successives (verrou_arcpy).
+# Une tâche est un dictionnaire :
+#   "nom" : nom du critère dans le registre, "champ" : champ de la note, "liste" : liste des notes du groupe (circulation ou accessibilité),
+#   "calcul" : fonction sans argument qui calcule le critère,
+#   "empreinte" : fonction sans argument qui retourne l'empreinte des entrées (points de reprise), None si le critère n'est pas repris,
+#   "seuils", "champ_nb_place" : paramètres de reprendreCritere,
+#   "exclusif" : True si le critère utilise des outils de géotraitement ou des géométries arcpy, il garde alors verrou_arcpy pendant tout son calcul
+
+def executerTacheCritere(tache, connexion, profil):
+    # Retourne les colonnes (nom, type, valeurs) ajoutées par le critère et sa durée
+    tache_courante.colonnes = []
+    debut = time.time()
+    try:
+        with verrou_arcpy if tache.get("exclusif") else nullcontext():
+            empreinte = tache["empreinte"]() if connexion is not None and tache.get("empreinte") is not None else None
+            if empreinte is None or not reprendreCritere(connexion, tache["champ"], empreinte, tache.get("seuils"), profil, champ_nb_place=tache.get("champ_nb_place")):
+                tache["calcul"]()
+                if empreinte is not None:
+                    enregistrerCritere(connexion, tache["champ"], empreinte, tache.get("seuils"), tache_courante.colonnes)
+        return tache_courante.colonnes, time.time()-debut
+    finally:
+        tache_courante.colonnes = None
+
+def executerCriteres(taches, connexion=None, profil=None, nb_workers=4):
+    # Les colonnes sont fusionnées dans la table dans l'ordre des tâches, quel que soit l'ordre de fin des threads :
+    # les champs de la couche et les listes de notes sont les mêmes qu'en exécution successive
+    if nb_workers <= 1:
+        resultats = [executerTacheCritere(tache, connexion, profil) for tache in taches]
+    else:
+        with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+            futures = {executor.submit(executerTacheCritere, tache, connexion, profil) : i for i, tache in enumerate(taches)}
+            for nb_termine, future in enumerate(as_completed(futures), start=1):
+                if future.exception() is None:
+                    arcpy.AddMessage("Indicateur '{}' calculé ({}/{})".format(taches[futures[future]]["nom"], nb_termine, len(taches)))
+            resultats = [None]*len(taches)
+            for future, i in futures.items():
+                resultats[i] = future.result() # relance l'erreur d'un critère
+
+    for tache, (colonnes, duree) in zip(taches, resultats):
+        for nom_champ, type_champ, colonne in colonnes:
+            table_attributs[nom_champ] = colonne
+            types_champs[nom_champ] = type_champ
+        arcpy.AddMessage("Indicateur '{}' : {} colonnes en {} s".format(tache["nom"], len(colonnes), round(duree, 1)))
+
+    liste_circulation = [tache["champ"] for tache in taches if tache["liste"] is liste_note_circulation]
+    liste_accessibilite = [tache["champ"] for tache in taches if tache["liste"] is liste_note_accessibilite]
+    liste_note_circulation[:] = liste_circulation
+    liste_note_accessibilite[:] = liste_accessibilite
+
+
 def arcgis_table_to_df(in_fc, input_fields=None, query=""): 
     #Source : https://gist.github.com/d-wasserman/e9c98be1d0caebc2935afecf0ba239a0
     """Function will convert an arcgis table into a pandas dataframe with an object ID index, and the selected
@@ -1495,9 +2436,148 @@ def createChart(project, map, layer_name, table_name):
     index100_bar_chart.yAxis.maximum = 100
     index100_bar_chart.addToLayer(table)
 
-    
 
-def OutilIndiceLivrabilite(nom_etude, type_vehicule, Streets_ZoneEtude, output_path_GDB, nom_GDB, nom_couche_output, nom_table_output, Cdms, CndMod, CdmsDtmod, Lane,table_seuil, modifier_seuil, modifier_ponderation,  pond_circ, pond_acces, ratio_hierarchie, couches_POI, couche_stationnement, filtre_stat, champ_nb_place, distance_stat, nb_place_defaut, table_speed_data, heure_analyse, source_chantier, filtre_type_here, filtre_impact_here, couche_ext_chantier, champ_debut_chantier, champ_fin_chantier, filtre_date_chantier, filtre_valeur_chantier, stop_frequency_layer, champ_numRunPHour, Gabarit_seuil, Voie_Seuil, TP_Seuil, Obstacle_Seuil, Vitesse_Seuil, Congestion_Seuil, Chantier_Seuil, Horaire_Seuil, Stationnement_Seuil, Pente_Seuil):  # Demo Outil
+#----------------------------------------------------------
+#-------------- Lot d'études ------------------------------
+#----------------------------------------------------------
+# Plusieurs études (zone ou liste de LINK_ID, type de véhicule, seuils...) sur le même réseau de la ville, décrites dans une table .csv (séparateur ";") :
+#   nom_etude : obligatoire et unique
+#   zone_etude : couche de polygones, les liens qui l'intersectent sont étudiés
+#   liens_etude : LINK_ID étudiés, séparés par des espaces ou des ";"
+#   autres colonnes : paramètres de l'outil propres à l'étude (ex : type_vehicule, Voie_Seuil, pond_circ, criteres_actifs), une cellule vide garde la valeur du lot
+# Les données communes (réseau, tables HERE, SpeedData) sont lues une fois pour tout le réseau, puis restreintes aux liens de chaque étude.
+donnees_lot = None
+
+# Paramètres partagés par les études du lot, non modifiables par la table des études
+parametres_lot = ["Streets_ZoneEtude", "output_path_GDB", "nom_GDB", "Cdms", "CndMod", "CdmsDtmod", "Lane", "table_speed_data", "speed_data_parquet"]
+colonnes_zone_etude = ["zone_etude", "liens_etude"]
+
+def lireTableEtudes(table_etudes, parametres):
+    # Retourne la liste des études : {colonne : valeur} sans les cellules vides
+    df = pandas.read_csv(table_etudes, sep=";", dtype=str, encoding="utf-8-sig", keep_default_na=False)
+    df.columns = [e.strip() for e in df.columns]
+    if "nom_etude" not in df.columns:
+        raise ValueError("Colonne nom_etude absente de la table des études {}".format(table_etudes))
+    inconnues = [e for e in df.columns if e not in parametres and e not in colonnes_zone_etude]
+    if inconnues:
+        raise ValueError("Colonnes inconnues dans la table des études : {}".format(inconnues))
+    partagees = [e for e in df.columns if e in parametres_lot]
+    if partagees:
+        raise ValueError("Paramètres communs au lot, non modifiables par étude : {}".format(partagees))
+    etudes = [{colonne : valeur.strip() for colonne, valeur in ligne.items() if valeur.strip() != ""} for ligne in df.to_dict("records")]
+    noms = [etude.get("nom_etude", "") for etude in etudes]
+    if "" in noms or len(set(noms)) != len(noms):
+        raise ValueError("nom_etude doit être renseigné et unique : {}".format(noms))
+    return etudes
+
+def planifierEtude(type_vehicule, profils_vehicules, criteres_actifs):
+    # Profils de véhicules supplémentaires et plan des critères (planifierCriteres) d'une étude
+    profils_vehicules = [] if profils_vehicules in ("#", "", None) else [e for e in profils_vehicules.replace(";"," ").split() if e != type_vehicule]
+    return profils_vehicules, planifierCriteres(None if criteres_actifs in ("#", "", None) else criteres_actifs.replace(";"," ").split(), [type_vehicule]+profils_vehicules)
+
+def coucheEtude(Streets_ville, etude, numero):
+    # Couche des liens de l'étude : LINK_ID listés et/ou liens qui intersectent la zone, tout le réseau sinon
+    filtre = ""
+    if "liens_etude" in etude:
+        filtre = "LINK_ID IN ({})".format(", ".join(str(int(e)) for e in etude["liens_etude"].replace(";"," ").split()))
+    # doc https://pro.arcgis.com/en/pro-app/latest/tool-reference/data-management/make-feature-layer.htm
+    couche = arcpy.management.MakeFeatureLayer(in_features=Streets_ville, out_layer="Lot_etude_{}".format(numero), where_clause=filtre)[0]
+    if "zone_etude" in etude:
+        # doc https://pro.arcgis.com/en/pro-app/latest/tool-reference/data-management/select-layer-by-location.htm
+        arcpy.management.SelectLayerByLocation(in_layer=couche, overlap_type="INTERSECT", select_features=etude["zone_etude"])
+    return couche
+
+def chargerDonneesLot(parametres, etudes):
+    # Lecture unique des données communes aux études, pour tout le réseau de la ville
+    global donnees_lot, workspace
+    tables = set()
+    for etude in etudes:
+        p = dict(parametres, **etude)
+        tables.update(planifierEtude(p["type_vehicule"], p["profils_vehicules"], p["criteres_actifs"])[1]["tables"])
+
+    arcpy.SetProgressorLabel("Creation de la geodatabase {}".format(parametres["nom_GDB"]))
+    workspace = arcpy.management.CreateFileGDB(str(parametres["output_path_GDB"]), parametres["nom_GDB"])[0]
+    arcpy.AddMessage("Geodatabase créée à l'adresse : {}".format(workspace))
+
+    arcpy.AddMessage("\n-------- Lecture des données communes du lot --------")
+    chargerTableAttributs(parametres["Streets_ZoneEtude"], [])
+    donnees_lot = {"workspace" : workspace, "liens" : index_liens, "tables_here" : None, "agregats_speed_data" : dict(), "empreintes" : dict(), "bandes_cyclables" : dict()}
+    arcpy.AddMessage("{} liens dans le réseau de la ville".format(len(index_liens)))
+
+    if "Cdms" in tables:
+        arcpy.SetProgressorLabel("Jointure des tables HERE du lot")
+        tables_here = joindreTablesHere(Cdms=parametres["Cdms"], CndMod=parametres["CndMod"] if "CndMod" in tables else None,
+                                        CdmsDtmod=parametres["CdmsDtmod"] if "CdmsDtmod" in tables else None, liens_etude=set(index_liens.tolist()))
+        donnees_lot["tables_here"] = {"horaires" : tables_here["horaires"], "conditions" : classerConditionsCdmsMod(tables_here["conditions"])}
+
+    if "SpeedData" in tables:
+        table_speed_data = parametres["table_speed_data"]
+        speed_data_parquet = parametres["speed_data_parquet"]
+        if speed_data_parquet not in ("#", "", None):
+            if not os.path.exists(speed_data_parquet) or os.path.getmtime(speed_data_parquet) < os.path.getmtime(table_speed_data):
+                arcpy.SetProgressorLabel("Conversion des données SpeedData en Parquet")
+                convertirSpeedDataParquet(table_speed_data, speed_data_parquet)
+            table_speed_data = speed_data_parquet
+        arcpy.SetProgressorLabel("Lecture des données SpeedData du lot")
+        donnees_lot["agregats_speed_data"][sourceSpeedData(table_speed_data)] = lireSpeedData(table_speed_data, presence=True)
+
+def ecrireResumeLot(resumes, nom_table):
+    # Table des indices de toutes les études, une ligne par (étude, indicateur)
+    tables = [(nom_etude, type_vehicule, arcpy.da.TableToNumPyArray(table, [nom for nom, type_champ in summary_table_dtype])) for nom_etude, type_vehicule, table in resumes]
+    resume_lot = numpy.zeros(sum(len(table) for _, _, table in tables), dtype=[("NOM_ETUDE", "<U64"), ("TYPE_VEH", "<U16")]+summary_table_dtype)
+    i = 0
+    for nom_etude, type_vehicule, table in tables:
+        lignes = slice(i, i+len(table))
+        resume_lot["NOM_ETUDE"][lignes] = nom_etude
+        resume_lot["TYPE_VEH"][lignes] = type_vehicule
+        for nom, type_champ in summary_table_dtype:
+            resume_lot[nom][lignes] = table[nom]
+        i += len(table)
+
+    table_lot = fr"{workspace}\{arcpy.ValidateTableName(nom_table)}"
+    if arcpy.Exists(table_lot):
+        arcpy.management.Delete(table_lot)
+    arcpy.da.NumPyArrayToTable(resume_lot, table_lot)
+    return table_lot
+
+def calcLotEtudes(table_etudes, parametres):
+    # parametres : paramètres de OutilIndiceLivrabilite, valeurs par défaut des études
+    # Streets_ZoneEtude est le réseau de la ville, chaque étude en sélectionne les liens (coucheEtude)
+    global donnees_lot
+    arcpy.env.overwriteOutput = True
+    etudes = lireTableEtudes(table_etudes, parametres)
+    arcpy.AddMessage("\n-------- Lot de {} études : {} --------".format(len(etudes), ", ".join(etude["nom_etude"] for etude in etudes)))
+    Streets_ville = parametres["Streets_ZoneEtude"]
+    resumes = []
+    try:
+        chargerDonneesLot(parametres, etudes)
+        for numero, etude in enumerate(etudes):
+            arcpy.AddMessage("\n======== Etude {} ({}/{}) ========".format(etude["nom_etude"], numero+1, len(etudes)))
+            p = dict(parametres)
+            # Couche et table de sortie propres à chaque étude, sauf si la table des études les nomme
+            p["nom_couche_output"] = arcpy.ValidateTableName(parametres["nom_couche_output"]+"_"+etude["nom_etude"])
+            p["nom_table_output"] = arcpy.ValidateTableName(parametres["nom_table_output"]+"_"+etude["nom_etude"])
+            p.update({colonne : valeur for colonne, valeur in etude.items() if colonne not in colonnes_zone_etude})
+            p["Streets_ZoneEtude"] = coucheEtude(Streets_ville, etude, numero)
+            resumes.append((p["nom_etude"], p["type_vehicule"], OutilIndiceLivrabilite(**p)))
+
+        arcpy.SetProgressorLabel("Table des indices du lot")
+        arcpy.AddMessage("\n-------- Table des indices du lot --------")
+        table_lot = ecrireResumeLot(resumes, parametres["nom_table_output"]+"_lot")
+        m = arcpy.mp.ArcGISProject("current").activeMap
+        if m is not None:
+            m.addTable(arcpy.mp.Table(table_lot))
+    finally:
+        donnees_lot = None
+    return table_lot
+
+
+def OutilIndiceLivrabilite(nom_etude, type_vehicule, Streets_ZoneEtude, output_path_GDB, nom_GDB, nom_couche_output, nom_table_output, Cdms, CndMod, CdmsDtmod, Lane,table_seuil, modifier_seuil, modifier_ponderation,  pond_circ, pond_acces, ratio_hierarchie, couches_POI, couche_stationnement, filtre_stat, champ_nb_place, distance_stat, nb_place_defaut, table_speed_data, heure_analyse, source_chantier, filtre_type_here, filtre_impact_here, couche_ext_chantier, champ_debut_chantier, champ_fin_chantier, filtre_date_chantier, filtre_valeur_chantier, stop_frequency_layer, champ_numRunPHour, Gabarit_seuil, Voie_Seuil, TP_Seuil, Obstacle_Seuil, Vitesse_Seuil, Congestion_Seuil, Chantier_Seuil, Horaire_Seuil, Stationnement_Seuil, Pente_Seuil, cache_tuiles_here="#", hors_ligne_here="false", jours_horaire="#", func_class_tp="#", nb_tirages_sensibilite="#", variation_sensibilite="#", profils_vehicules="#", points_reprise="#", nb_taches_paralleles="#", speed_data_parquet="#", periodes_congestion="#", profil_congestion="#", criteres_actifs="#", table_etudes="#"):  # Demo Outil
+    
+    # Lot d'études décrites dans table_etudes, Streets_ZoneEtude est alors le réseau de la ville (voir calcLotEtudes)
+    if table_etudes not in ("#", "", None) and donnees_lot is None:
+        parametres = dict(locals())
+        return calcLotEtudes(parametres.pop("table_etudes"), parametres)
     
     #clé API HERE
     global apiKey
@@ -1507,16 +2587,29 @@ def OutilIndiceLivrabilite(nom_etude, type_vehicule, Streets_ZoneEtude, output_p
     arcpy.env.overwriteOutput = True
     
     #Variables utilisées ensuite dans les autres fonctions
-    global liste_link_id, describe, champ_long_Geod, workspace
+    global champ_long_Geod, workspace, tables_here_etude
     
     pond_circ = pond_circ.split(" ")
     pond_circ = [float(e) for e in pond_circ]
     pond_acces = pond_acces.split(" ")
     pond_acces = [float(e) for e in pond_acces]
+    # Ratios de hiérarchie vérifiés avant le calcul des critères (un par FUNC_CLASS)
+    lireRatiosHierarchie(ratio_hierarchie)
+
+    # Critères calculés (ex : "Voie;Vitesse;Congestion"), tous par défaut. Seuls leurs champs et leurs données auxiliaires sont lus
+    # Les autres profils de véhicules (ex : "PL;VUL;VC") sont notés à partir des mêmes paramètres bruts, seuils lus dans table_seuil
+    arcpy.AddMessage("\n-------- Planification des critères --------")
+    profils_vehicules, plan = planifierEtude(type_vehicule, profils_vehicules, criteres_actifs)
+    pond_circ = ponderationsActives(pond_circ, "circulation", plan["criteres"])
+    pond_acces = ponderationsActives(pond_acces, "accessibilite", plan["criteres"])
     
     arcpy.SetProgressorLabel("Creation de la geodatabase {}".format(nom_GDB))
     # doc https://pro.arcgis.com/en/pro-app/latest/tool-reference/data-management/create-file-gdb.htm
-    workspace = arcpy.management.CreateFileGDB(str(output_path_GDB),nom_GDB)[0]
+    # Dans un lot d'études, la geodatabase est créée une fois pour toutes les études
+    if donnees_lot is None:
+        workspace = arcpy.management.CreateFileGDB(str(output_path_GDB),nom_GDB)[0]
+    else:
+        workspace = donnees_lot["workspace"]
     arcpy.AddMessage("Geodatabase créée à l'adresse : {}".format(workspace))
     
     arcpy.SetProgressorLabel("Creation de la couche {}".format(nom_couche_output))
@@ -1524,9 +2617,6 @@ def OutilIndiceLivrabilite(nom_etude, type_vehicule, Streets_ZoneEtude, output_p
     arcpy.management.CopyFeatures(in_features=Streets_ZoneEtude, out_feature_class=fr"{workspace}\{nom_couche_output}")
     Streets_ZoneEtude = fr"{workspace}\{nom_couche_output}"
 
-    #variable utilisée ensuite dans le calcul des indicateurs
-    liste_link_id = unique_values(Streets_ZoneEtude,["LINK_ID"])
-    describe = arcpy.Describe(Streets_ZoneEtude)
     
     arcpy.SetProgressorLabel("Ajout des champs NOM_ETUDE, DATE_ETUDE, TYPE_VEH et LEN_KM_GEO")
     arcpy.AddMessage("Ajout des champs NOM_ETUDE, DATE_ETUDE, TYPE_VEH et LEN_KM_GEO")
@@ -1537,97 +2627,147 @@ def OutilIndiceLivrabilite(nom_etude, type_vehicule, Streets_ZoneEtude, output_p
     champ_long_Geod = "LEN_KM_GEO"
     # Important de choisir "GEODESIC" au lieu de "PLANAR" car les données sont exprimées en coordonnées sphériques
     arcpy.management.CalculateGeometryAttributes(in_features=Streets_ZoneEtude, geometry_property=[[champ_long_Geod,"LENGTH_GEODESIC"]], length_unit="KILOMETERS")
-    
-    arcpy.SetProgressorLabel("Creation de la couche jointe temporaire Streets_join_CdmsMod")
-    arcpy.AddMessage("\n-------- Creation couche jointe CdmsMod --------")
-    # Création d'une couche temporaire par jointure de Cdms sur la couche réseau, puis ajout des champs MOD_TYPE et MOD_VAL de la table Cnd
-    # La couche résultante contient les tronçon du réseau en étude qui ont une valeur dans la table Cdms
-    # Est utilisé pour les indicateurs "Type de Carrefour", "Obstacle", "Gabarit"
-    Streets_join_CdmsMod = fr"{arcpy.env.scratchGDB}\TEMP_Streets_join_CdmsMod"
-    arcpy.management.CopyFeatures(in_features=Streets_ZoneEtude, out_feature_class=Streets_join_CdmsMod)
-    arcpy.management.JoinField(in_data=Streets_join_CdmsMod, in_field="LINK_ID", join_table=Cdms, join_field="LINK_ID")
-    # arcpy.gapro.JoinFeatures(target_layer=Streets_ZoneEtude, join_layer=Cdms, output= Streets_join_CdmsMod,join_operation="JOIN_ONE_TO_MANY", attribute_relationship=[["LINK_ID", "LINK_ID"]])
-    # JoinFeatures fait du toolbox GeoAnalytics Server qui requiert une license
-    
-    arcpy.management.JoinField(in_data=Streets_join_CdmsMod, in_field="COND_ID", join_table=CndMod, join_field="COND_ID", fields=["MOD_TYPE", "MOD_VAL"])
-    
-    arcpy.SetProgressorLabel("Creation de la couche jointe temporaire Streets_join_CdmsDTMod")
-    arcpy.AddMessage("\n-------- Creation couche jointe CdmsDTMod --------")
-    # Création d'une couche temporaire par jointure de CdmsDtmod sur la couche réseau, puis ajout des champs AR_AUTO, AR_TRUCK, AR_DELIVER de la table Cdms
-    # La couche résultante contient les tronçon du réseau en étude qui ont une valeur dans la table CdmsDtMod
-    # Est utilisé pour l'indicateur Horaire
-    Streets_join_CdmsDTMod = fr"{arcpy.env.scratchGDB}\TEMP_Streets_join_CdmsDTMod"
-    arcpy.management.CopyFeatures(in_features=Streets_ZoneEtude, out_feature_class=Streets_join_CdmsDTMod)
-    arcpy.management.JoinField(in_data=Streets_join_CdmsDTMod, in_field="LINK_ID", join_table=CdmsDtmod, join_field="LINK_ID")
-    # arcpy.gapro.JoinFeatures(target_layer=Streets_ZoneEtude, join_layer=CdmsDtmod, output= Streets_join_CdmsDTMod,join_operation="JOIN_ONE_TO_MANY", attribute_relationship=[["LINK_ID", "LINK_ID"]])
-    # JoinFeatures fait du toolbox GeoAnalytics Server qui requiert une license
-
-    arcpy.management.JoinField(in_data=Streets_join_CdmsDTMod, in_field="COND_ID", join_table=Cdms, join_field="COND_ID", fields=["AR_AUTO","AR_TRUCKS","AR_DELIVER"])
-
-
-    arcpy.SetProgressorLabel("Calcul indicateur 'Voie de circulation' (1/11)")
-    arcpy.AddMessage("\n-------- Calcul indicateur 'Voie de circulation' (1/11) --------")
-    if type_vehicule == "VC" :
-        calcCritereVoieVelo(Streets_network=Streets_ZoneEtude, table_lane=Lane)   
-    else :
-        calcCritereVoie(Streets_network=Streets_ZoneEtude, seuils=Voie_Seuil)
-    
-    arcpy.SetProgressorLabel("Calcul indicateur 'Arret TP' (2/11)")
-    arcpy.AddMessage("\n-------- Calcul indicateur 'Arret TP' (2/11) --------")
-    calCritereTP(Streets_network=Streets_ZoneEtude, stop_frequency_layer=stop_frequency_layer, champ_numRunsPHour=champ_numRunPHour, seuils=TP_Seuil)
-    
-    arcpy.SetProgressorLabel("Calcul indicateur 'Carrefour' (3/11)")
-    arcpy.AddMessage("\n-------- Calcul indicateur 'Carrefour' (3/11) --------")
-    calcCritereCarrefour(Streets_network=Streets_ZoneEtude, Streets_join_CdmsMod=Streets_join_CdmsMod)
-
-    arcpy.SetProgressorLabel("Calcul indicateur 'Obstacle' (4/11)")
-    arcpy.AddMessage("\n-------- Calcul indicateur 'Obstacle' (4/11) --------")
-    calcCritereObstacle(Streets_network=Streets_ZoneEtude, Streets_join_CdmsMod=Streets_join_CdmsMod, seuils=Obstacle_Seuil)
 
-    arcpy.SetProgressorLabel("Calcul indicateur 'Vitesse' (5/11)")
-    arcpy.AddMessage("\n-------- Calcul indicateur 'Vitesse' (5/11) --------")
-    calcCritereVitesse(Streets_network=Streets_ZoneEtude,seuils=Vitesse_Seuil)
+    # Les critères travaillent sur une table en mémoire, enregistrée dans la couche après le calcul de la note globale
+    chargerTableAttributs(Streets_ZoneEtude, plan["champs_reseau"]+[champ_long_Geod])
     
-    arcpy.SetProgressorLabel("Calcul indicateur 'Congestion' (6/11)")
-    arcpy.AddMessage("\n-------- Calcul indicateur 'Congestion' (6/11) --------")
-    arcpy.AddMessage("Heure d'analyse : {}".format(heure_analyse))
-    calcCritereCongestion(Streets_network=Streets_ZoneEtude,table_speed_data=table_speed_data, heure_analyse=heure_analyse, seuils=Congestion_Seuil)
-
-    arcpy.SetProgressorLabel("Calcul indicateur 'Chantier' (7/11)")
-    arcpy.AddMessage("\n-------- Calcul indicateur 'Chantier' (7/11) --------")
+    # Points de reprise des critères : seulement si une base est indiquée, tout est recalculé par défaut
+    if points_reprise in ("#", "", None) or str(points_reprise).lower() == "false":
+        connexion_reprise = None
+    else:
+        arcpy.SetProgressorLabel("Empreintes des données d'entrée")
+        arcpy.AddMessage("\n-------- Empreintes des données d'entrée --------")
+        connexion_reprise = ouvrirPointsReprise(points_reprise)
+    empreinte_reseau = empreinteReseau(Streets_ZoneEtude) if connexion_reprise is not None else None
+    # Tables HERE lues seulement si un critère qui les utilise doit être calculé, et seulement celles des critères actifs
+    tables_here_etude = None
+    CndMod = CndMod if "CndMod" in plan["tables"] else None
+    CdmsDtmod = CdmsDtmod if "CdmsDtmod" in plan["tables"] else None
+    # Pas d'empreinte des tables HERE si l'une d'elles n'en a pas (date de modification inconnue)
+    empreinte_here = None
+    if connexion_reprise is not None and "Cdms" in plan["tables"]:
+        empreintes_here = [empreinteSource(table) if table is not None else "" for table in (Cdms, CndMod, CdmsDtmod)]
+        empreinte_here = calcEmpreinte(*empreintes_here, empreinte_reseau) if None not in empreintes_here else None
+
+    # Export SpeedData converti une fois en Parquet trié par LINK_ID, puis lu à la place du .csv par cette étude et les suivantes
+    if speed_data_parquet not in ("#", "", None) and "SpeedData" in plan["tables"]:
+        if not os.path.exists(speed_data_parquet) or os.path.getmtime(speed_data_parquet) < os.path.getmtime(table_speed_data):
+            arcpy.SetProgressorLabel("Conversion des données SpeedData en Parquet")
+            convertirSpeedDataParquet(table_speed_data, speed_data_parquet)
+        table_speed_data = speed_data_parquet
+    # Profil de congestion sur 24 heures : par défaut à côté de la geodatabase de sortie, "false" pour ne pas l'enregistrer
+    # Les profils gardés en mémoire par une exécution précédente de l'outil dans la même session ArcGIS Pro ne sont pas réutilisés
+    with verrou_profils_congestion:
+        profils_congestion.clear()
+    if profil_congestion in ("#", "", None):
+        profil_congestion = os.path.join(str(output_path_GDB), "profil_congestion.npz")
+    elif str(profil_congestion).lower() == "false":
+        profil_congestion = None
+
+    # FUNC_CLASS des tronçons auxquels les arrêts peuvent être rattachés (ex : "3;4;5"), toutes par défaut
+    func_class_tp = None if func_class_tp in ("#", "", None) else func_class_tp.replace(";"," ").split()
+    # Jours pris en compte dans le calcul des heures d'accès (format REF_DATE, commence par dimanche), tous par défaut
+    if jours_horaire in ("#", "", None):
+        jours_horaire = "YYYYYYY"
+    # Cache des tuiles HERE : par défaut à côté de la geodatabase de sortie, pour être réutilisé par les études suivantes
+    if cache_tuiles_here in ("#", "", None):
+        cache_tuiles_here = os.path.join(str(output_path_GDB), "cache_tuiles_HERE.sqlite")
+    hors_ligne_here = str(hors_ligne_here).lower() == "true"
+    arcpy.AddMessage("Heure d'analyse congestion : {}".format(heure_analyse))
+    if periodes_congestion not in ("#", "", None) and "Congestion" in plan["criteres"]:
+        # Vérifiées avant le calcul des critères, pour ne pas échouer après les plus longs
+        lirePeriodesCongestion(periodes_congestion)
+        arcpy.AddMessage("Périodes de congestion comparées : {}".format(periodes_congestion))
     arcpy.AddMessage("Source données chantier : {}".format(source_chantier))
-    if source_chantier == "HERE" :
-        calcCritereChantierHere(Streets_network=Streets_ZoneEtude, filtre_type=filtre_type_here, filtre_impact=filtre_impact_here,seuils=Chantier_Seuil)
 
+    # Les chantiers en cours dépendent de la date du jour. Avec HERE, l'incident retenu par tronçon dépend aussi des seuils
+    if source_chantier == "HERE" :
+        calcul_chantier = lambda: calcCritereChantierHere(Streets_network=Streets_ZoneEtude, filtre_type=filtre_type_here, filtre_impact=filtre_impact_here,seuils=Chantier_Seuil)
+        empreinte_chantier = lambda: calcEmpreinte("Chantier", empreinte_reseau, source_chantier, filtre_type_here, filtre_impact_here, Chantier_Seuil, datetime.date.today())
     else:
-        calcCritereChantierExt(Streets_network=Streets_ZoneEtude,couche_ext_chantier=couche_ext_chantier,champ_debut_chantier=champ_debut_chantier, champ_fin_chantier=champ_fin_chantier,filtre_date_chantier=filtre_date_chantier,filtre_valeur_chantier=filtre_valeur_chantier,seuils=Chantier_Seuil)
-    
-
-    arcpy.SetProgressorLabel("Calcul indicateur 'Gabarit' (8/11)")
-    arcpy.AddMessage("\n-------- Calcul indicateur 'Gabarit' (8/11) --------")
-    calcCritereGabarit(Streets_network=Streets_ZoneEtude, Streets_join_CdmsMod=Streets_join_CdmsMod, seuils=Gabarit_seuil )
-     
-    arcpy.SetProgressorLabel("Calcul indicateur 'Horaire' (9/11)")
-    arcpy.AddMessage("\n-------- Calcul indicateur 'Horaire' (9/11) --------")
-    calcCritereHoraire(Streets_network=Streets_ZoneEtude, Streets_join_CdmsDTMod=Streets_join_CdmsDTMod, seuils=Horaire_Seuil)
-
-    arcpy.SetProgressorLabel("Calcul indicateur 'Stationnement' (10/11)")
-    arcpy.AddMessage("\n-------- Calcul indicateur 'Stationnement' (10/11) --------")
-    calcCritereStationnement(Streets_network=Streets_ZoneEtude, couche_stationnement=couche_stationnement, filtre_stat=filtre_stat, champ_nb_place=champ_nb_place, distance=distance_stat,nb_defaut=nb_place_defaut, seuils=Stationnement_Seuil)
-    
-    arcpy.SetProgressorLabel("Calcul indicateur 'Pente' (11/11)")
-    arcpy.AddMessage("\n-------- Calcul indicateur 'Pente' (11/11) --------")
-    calcCriterePente(Streets_network=Streets_ZoneEtude, seuils=Pente_Seuil) 
+        calcul_chantier = lambda: calcCritereChantierExt(Streets_network=Streets_ZoneEtude,couche_ext_chantier=couche_ext_chantier,champ_debut_chantier=champ_debut_chantier, champ_fin_chantier=champ_fin_chantier,filtre_date_chantier=filtre_date_chantier,filtre_valeur_chantier=filtre_valeur_chantier,seuils=Chantier_Seuil)
+        empreinte_chantier = lambda: calcEmpreinte("Chantier", empreinte_reseau, source_chantier, empreinteTable(couche_ext_chantier, ["SHAPE@WKB", champ_debut_chantier, champ_fin_chantier]),
+                                                   champ_debut_chantier, champ_fin_chantier, filtre_date_chantier, filtre_valeur_chantier, datetime.date.today())
+
+    # Calcul de chaque critère du registre. Le champ de la note et sa liste sont ceux déclarés dans registre_criteres
+    calculs_criteres = {
+        "Voie" : {"empreinte" : None,
+         "calcul" : (lambda: calcCritereVoieVelo(Streets_network=Streets_ZoneEtude, table_lane=Lane)) if type_vehicule == "VC" else (lambda: calcCritereVoie(Streets_network=Streets_ZoneEtude, seuils=Voie_Seuil))},
+        "TP" : {"seuils" : TP_Seuil,
+         "calcul" : lambda: calCritereTP(Streets_network=Streets_ZoneEtude, stop_frequency_layer=stop_frequency_layer, champ_numRunsPHour=champ_numRunPHour, seuils=TP_Seuil, func_class=func_class_tp),
+         "empreinte" : lambda: calcEmpreinte("TP", empreinte_reseau, empreinteTable(stop_frequency_layer, ["SHAPE@XY", champ_numRunPHour]), champ_numRunPHour, func_class_tp)},
+        "Carrefour" : {"seuils" : None,
+         "calcul" : lambda: calcCritereCarrefour(Streets_network=Streets_ZoneEtude, conditions=tablesHereEtude(Cdms, CndMod, CdmsDtmod)["conditions"]),
+         "empreinte" : lambda: calcEmpreinte("Carrefour", empreinte_here) if empreinte_here is not None else None},
+        "Obstacle" : {"seuils" : Obstacle_Seuil,
+         "calcul" : lambda: calcCritereObstacle(Streets_network=Streets_ZoneEtude, conditions=tablesHereEtude(Cdms, CndMod, CdmsDtmod)["conditions"], seuils=Obstacle_Seuil),
+         "empreinte" : lambda: calcEmpreinte("Obstacle", empreinte_here) if empreinte_here is not None else None},
+        "Vitesse" : {"empreinte" : None,
+         "calcul" : lambda: calcCritereVitesse(Streets_network=Streets_ZoneEtude,seuils=Vitesse_Seuil)},
+        "Congestion" : {"seuils" : Congestion_Seuil,
+         "calcul" : lambda: calcCritereCongestion(Streets_network=Streets_ZoneEtude,table_speed_data=table_speed_data, heure_analyse=heure_analyse, seuils=Congestion_Seuil,
+                                                  periodes_congestion=periodes_congestion, chemin_profil=profil_congestion),
+         "empreinte" : lambda: calcEmpreinte("Congestion", empreinte_reseau, sourceSpeedData(table_speed_data), heure_analyse, periodes_congestion)},
+        "Chantier" : {"seuils" : Chantier_Seuil, "exclusif" : True,
+         "calcul" : calcul_chantier, "empreinte" : empreinte_chantier},
+        "Gabarit" : {"seuils" : Gabarit_seuil,
+         "calcul" : lambda: calcCritereGabarit(Streets_network=Streets_ZoneEtude, conditions=tablesHereEtude(Cdms, CndMod, CdmsDtmod)["conditions"], seuils=Gabarit_seuil ),
+         "empreinte" : lambda: calcEmpreinte("Gabarit", empreinte_here) if empreinte_here is not None else None},
+        "Horaire" : {"seuils" : Horaire_Seuil,
+         "calcul" : lambda: calcCritereHoraire(Streets_network=Streets_ZoneEtude, horaires=tablesHereEtude(Cdms, CndMod, CdmsDtmod)["horaires"], seuils=Horaire_Seuil, jours_etude=jours_horaire),
+         "empreinte" : lambda: calcEmpreinte("Horaire", empreinte_here, jours_horaire) if empreinte_here is not None else None},
+        "Stationnement" : {"seuils" : Stationnement_Seuil, "champ_nb_place" : champ_nb_place,
+         "calcul" : lambda: calcCritereStationnement(Streets_network=Streets_ZoneEtude, couche_stationnement=couche_stationnement, filtre_stat=filtre_stat, champ_nb_place=champ_nb_place, distance=distance_stat,nb_defaut=nb_place_defaut, seuils=Stationnement_Seuil),
+         "empreinte" : lambda: calcEmpreinte("Stationnement", empreinte_reseau, empreinteTable(couche_stationnement, ["SHAPE@XY", champ_nb_place], "" if filtre_stat == "#" else filtre_stat),
+                                             champ_nb_place, distance_stat, nb_place_defaut)},
+        # En mode hors ligne, les tuiles absentes du cache manquent au résultat : il n'est pas repris lors d'un lancement en ligne
+        # Le résultat est repris dans la même période de validité des tuiles (duree_cache_tuiles_jours), tant que le cache n'a pas changé
+        "Pente" : {"seuils" : Pente_Seuil,
+         "calcul" : lambda: calcCriterePente(Streets_network=Streets_ZoneEtude, seuils=Pente_Seuil, chemin_cache=cache_tuiles_here, hors_ligne=hors_ligne_here),
+         "empreinte" : lambda: calcEmpreinte("Pente", empreinte_reseau, hors_ligne_here, etatCacheTuiles(cache_tuiles_here), int(time.time()//(duree_cache_tuiles_jours*86400)))}
+    }
+    taches_criteres = [dict(calculs_criteres[nom], nom=nom, champ=registre_criteres[nom]["champ"], liste=listes_notes_groupes[registre_criteres[nom]["groupe"]])
+                       for nom in plan["criteres"]]
+
+    # Nombre de critères calculés en même temps, 1 pour un calcul successif
+    nb_taches_paralleles = 4 if nb_taches_paralleles in ("#", "", None) else int(nb_taches_paralleles)
+    arcpy.SetProgressorLabel("Calcul des {} indicateurs ({} en parallèle)".format(len(taches_criteres), nb_taches_paralleles))
+    arcpy.AddMessage("\n-------- Calcul des {} indicateurs ({} en parallèle) --------".format(len(taches_criteres), nb_taches_paralleles))
+    executerCriteres(taches_criteres, connexion=connexion_reprise, profil=type_vehicule, nb_workers=nb_taches_paralleles)
+    if connexion_reprise is not None:
+        connexion_reprise.close()
 
 
     
     arcpy.SetProgressorLabel("Calcul moyennes par troncons")
     arcpy.AddMessage("\n-------- Calcul moyennes par troncons --------")
     calcNoteGlobale(Streets_network=Streets_ZoneEtude, liste_field_circ=liste_note_circulation, liste_field_access=liste_note_accessibilite, ratio_hiera=ratio_hierarchie, couches_POI=couches_POI, pond_circ=pond_circ, pond_acces=pond_acces)
+
+    # Notation des autres profils de véhicules à partir des mêmes paramètres bruts
+    listes_notes_profils = dict()
+    if profils_vehicules:
+        arcpy.SetProgressorLabel("Notation des profils de véhicules {}".format(", ".join(profils_vehicules)))
+        arcpy.AddMessage("\n-------- Notation des profils de véhicules {} --------".format(", ".join(profils_vehicules)))
+        seuils_profils = lireSeuilsProfils(table_seuil, profils_vehicules, plan["criteres"])
+        for profil in profils_vehicules:
+            listes_notes_profils[profil] = calcNotesProfil(profil, seuils_profils[profil], champ_nb_place, Lane, pond_circ, pond_acces)
+
+    # Mode analyse de sensibilité des pondérations, à partir des notes déjà calculées
+    if nb_tirages_sensibilite not in ("#", "", None) and int(nb_tirages_sensibilite) > 0:
+        arcpy.SetProgressorLabel("Analyse de sensibilité des pondérations")
+        arcpy.AddMessage("\n-------- Analyse de sensibilité des pondérations --------")
+        variation_sensibilite = 0.2 if variation_sensibilite in ("#", "", None) else float(str(variation_sensibilite).replace(",","."))
+        calcSensibilite(nom_table=nom_table_output+"_sensibilite", pond_circ=pond_circ, pond_acces=pond_acces, ratio_hiera=ratio_hierarchie, nb_tirages=int(nb_tirages_sensibilite), variation=variation_sensibilite)
+
+    arcpy.SetProgressorLabel("Enregistrement des champs dans la couche {}".format(nom_couche_output))
+    arcpy.AddMessage("\n-------- Enregistrement des champs dans la couche --------")
+    ecrireTableAttributs(Streets_ZoneEtude)
     
     arcpy.SetProgressorLabel("Calcul Table statistiques, notes et indicateurs globaux")
     arcpy.AddMessage("\n-------- Calcul Table statistiques, notes et indicateurs globaux --------")
     summary_table = outputTable(Streets_network=Streets_ZoneEtude, nom_table=nom_table_output, pond_circ=pond_circ,pond_acc=pond_acces)
+    tables_profils = [outputTable(Streets_network=Streets_ZoneEtude, nom_table=nom_table_output+"_"+profil, pond_circ=pond_circ, pond_acc=pond_acces, liste_note_circ=listes[0], liste_note_acc=listes[1])
+                      for profil, listes in listes_notes_profils.items()]
 
     #Ajout de la couche réseau et de la table à la carte
     p = arcpy.mp.ArcGISProject("current")
@@ -1638,6 +2778,8 @@ def OutilIndiceLivrabilite(nom_etude, type_vehicule, Streets_ZoneEtude, output_p
     layer = arcpy.management.MakeFeatureLayer(in_features=Streets_ZoneEtude, out_layer=nom_couche_output, workspace=workspace)[0]
     m.addLayer(layer)
     m.addTable(arcpy.mp.Table(summary_table))
+    for table_profil in tables_profils:
+        m.addTable(arcpy.mp.Table(table_profil))
 
     arcpy.SetProgressorLabel("Application symbologie et Création des graphiques")
     arcpy.AddMessage("\n-------- Application de la symbologie et Création des graphiques --------")
@@ -1646,13 +2788,12 @@ def OutilIndiceLivrabilite(nom_etude, type_vehicule, Streets_ZoneEtude, output_p
 
     # Suppression des couches temporaires de la scratchGDB
     arcpy.AddMessage("\n-------- Suppression des couches temporaires de scratchGDB --------") 
-    arcpy.management.Delete(fr"{arcpy.env.scratchGDB}\TEMP_Streets_join_CdmsMod")
-    arcpy.management.Delete(fr"{arcpy.env.scratchGDB}\TEMP_Streets_join_CdmsDTMod")
-    
     arcpy.env.workspace = arcpy.env.scratchGDB
     for scratch_fc in arcpy.ListFeatureClasses() :
         arcpy.management.Delete(fr"{arcpy.env.scratchGDB}\{scratch_fc}")
 
+    return summary_table
+
 
 
 
@@ -0,0 +1,252 @@
+# Tests de parité des noyaux de notation vectorisés avec les fonctions d'origine, évaluées ligne par ligne
+# (code blocks CalculateField et boucles des critères de la version 1.0 de l'outil)
+# Lancement : python -m pytest "Indice livabilité/tests"
+
+import datetime, importlib.util, itertools, math, os, re, sys, types
+import numpy
+import pandas
+import pytest
+
+# arcpy n'est disponible que dans ArcGIS Pro : les noyaux de notation n'en ont pas besoin
+try:
+    import arcpy
+except ImportError:
+    arcpy = types.ModuleType("arcpy")
+    arcpy.env = types.SimpleNamespace(scratchGDB="", overwriteOutput=True)
+    arcpy.AddMessage = arcpy.AddWarning = arcpy.SetProgressorLabel = lambda *args: None
+    arcpy.ValidateFieldName = lambda nom, workspace=None: re.sub(r"\W", "_", nom)
+    sys.modules["arcpy"] = arcpy
+
+chemin_outil = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "outilIndiceLivraison_execution.py")
+spec = importlib.util.spec_from_file_location("outilIndiceLivraison_execution", chemin_outil)
+outil = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(outil)
+
+
+#-------------- Fonctions d'origine -----------------
+def calcCritereLane(field_to_lane,field_from_lane,field_lane_cat,field_dir_travel, field_phys_lane, seuil_bon, seuil_mauv):
+    field_lane_cat = int(field_lane_cat)
+    if field_phys_lane>=seuil_bon or field_from_lane+field_to_lane>=seuil_bon or field_lane_cat > seuil_bon or (field_lane_cat >= seuil_bon and field_dir_travel == 'B'):
+        return 3
+    elif field_phys_lane > seuil_mauv or field_from_lane+field_to_lane > seuil_mauv or (field_lane_cat > seuil_mauv and field_dir_travel in ['T','F']) or (field_lane_cat >= seuil_mauv and field_dir_travel == 'B'):
+        return 2
+    elif field_from_lane+field_to_lane<=seuil_mauv or field_lane_cat < seuil_mauv or (field_lane_cat <= seuil_mauv and field_dir_travel in ['T','F']):
+        return 1
+    else :
+        return 0
+
+def calcCritereVitesse(field_to_speed, field_from_speed, seuil_bon, seuil_mauv):
+    if (field_to_speed != 0 and field_to_speed <= seuil_mauv) or (field_from_speed != 0 and field_from_speed <= seuil_mauv) or (field_from_speed<=seuil_mauv and field_to_speed<=seuil_mauv):
+        return 1
+    elif (field_to_speed != 0 and field_to_speed < seuil_bon) or (field_from_speed != 0 and field_from_speed < seuil_bon) or (field_from_speed < seuil_bon and field_to_speed < seuil_bon):
+        return 2
+    elif (field_to_speed >= seuil_bon) or (field_from_speed >= seuil_bon) or (field_from_speed >= seuil_bon and field_to_speed >= seuil_bon):
+        return 3
+    else :
+        return 0
+
+def calcCritereStationnement(nb_place, borne_bon, borne_mauv):
+    if (nb_place >= borne_bon):
+        return 3
+    elif (nb_place > borne_mauv):
+        return 2
+    elif (nb_place <= borne_mauv):
+        return 1
+    else:
+        return 0
+
+def noteObstacle(compte, seuil_bon, seuil_mauv):
+    # Boucle de calcCritereObstacle
+    if (compte <= seuil_bon):
+        return 3
+    elif (compte < seuil_mauv):
+        return 2
+    elif (compte >= seuil_mauv):
+        return 1
+    else:
+        return 0
+
+def noteHoraire(param_field_val, seuil_bon, seuil_mauv):
+    # Boucle de calcCritereHoraire
+    if param_field_val>=seuil_bon :
+        return 3
+    elif param_field_val>seuil_mauv:
+        return 2
+    elif param_field_val<=seuil_mauv:
+        return 1
+    else:
+        return 0
+
+def dureeAccesSemaine(DTTME_TYPE, REF_DATE, STARTTIME, ENDTIME, AR_AUTO, AR_TRUCKS, AR_DELIVER):
+    # Durée par restriction de calcCritereHoraire, sommée par link puis ramenée à un nombre d'heures par jour (accesParJour)
+    if DTTME_TYPE != '1' : # Daymask, voir manuel Here Navstreet
+        return 0
+    if ENDTIME == "2400" :
+        ENDTIME = "0000"
+        add_reverse = 24
+    else:
+        add_reverse = 0
+    STARTTIME = STARTTIME[:-2]+":"+STARTTIME[-2:]
+    ENDTIME = ENDTIME[:-2]+":"+ENDTIME[-2:]
+    STARTTIME = datetime.datetime.strptime(STARTTIME,"%H:%M")
+    ENDTIME = datetime.datetime.strptime(ENDTIME,"%H:%M")
+    delta = (ENDTIME-STARTTIME)
+    day_count = REF_DATE.count("Y")
+    hrs = day_count*(add_reverse+(delta.total_seconds()/3600))
+    if AR_TRUCKS == 'N': 
+        return(-1*hrs)
+    else:
+        return hrs
+
+def accesParJour(restrictions):
+    total = sum(dureeAccesSemaine('1', ref_date, debut, fin, 'Y', ar_trucks, 'Y') for debut, fin, ref_date, ar_trucks in restrictions)
+    if total < 0 : 
+        return (total/7)+24
+    else :
+        return total/7
+
+
+#-------------- Valeurs testées -----------------
+# Les bornes elles-mêmes, les valeurs de part et d'autre, et NaN (champ vide lu comme valeur non définie)
+valeurs = [0, 0.5, 1, 1.5, 2, 2.5, 3, 4, 5, 10, 29.99, 30, 30.01, 50, 100, math.nan]
+seuils = [(1, 3), (3, 1), (2, 2), (0.3, 0.6), (0.6, 0.3), (30, 50), (50, 30), (4, 10)]
+seuils_entiers = [(1, 3), (3, 1), (2, 2), (30, 50), (50, 30), (4, 10), (10, 8)]
+
+def comparer(noyau, origine, grilles, seuil_bon, seuil_mauv):
+    lignes = list(itertools.product(*grilles))
+    colonnes = [numpy.array(colonne, dtype=object if isinstance(colonne[0], str) else float) for colonne in zip(*lignes)]
+    notes = numpy.asarray(noyau(*colonnes, seuil_bon, seuil_mauv))
+    attendues = numpy.array([origine(*ligne, seuil_bon, seuil_mauv) for ligne in lignes])
+    differences = [(ligne, a, n) for ligne, a, n in zip(lignes, attendues, notes) if a != n]
+    assert not differences, differences[:5]
+
+
+@pytest.mark.parametrize("seuil_bon, seuil_mauv", seuils)
+def test_noteBandesCroissantes(seuil_bon, seuil_mauv):
+    comparer(outil.noteBandesCroissantes, calcCritereStationnement, [valeurs], seuil_bon, seuil_mauv)
+
+@pytest.mark.parametrize("seuil_bon, seuil_mauv", seuils)
+def test_noteBandesDecroissantes(seuil_bon, seuil_mauv):
+    comparer(outil.noteBandesDecroissantes, noteObstacle, [valeurs], seuil_bon, seuil_mauv)
+
+def test_noteBandesDefaut():
+    # Note des valeurs hors de toutes les bandes (NaN, None)
+    assert outil.noteBandesCroissantes([math.nan, None], 3, 1).tolist() == [0, 0]
+    assert outil.noteBandesDecroissantes([math.nan, None], 1, 3, defaut=3).tolist() == [3, 3]
+
+@pytest.mark.parametrize("seuil_bon, seuil_mauv", [(1, 2), (2, 1), (2, 2), (3, 1), (4, 2), (1.5, 0.5)])
+def test_calcNoteVoie(seuil_bon, seuil_mauv):
+    voies = [0, 1, 2, 3, 4, math.nan]
+    comparer(outil.calcNoteVoie, calcCritereLane, [voies, voies, ["1", "2", "3", "4"], ["B", "T", "F", "N"], voies], seuil_bon, seuil_mauv)
+
+@pytest.mark.parametrize("seuil_bon, seuil_mauv", seuils)
+def test_calcNoteVitesse(seuil_bon, seuil_mauv):
+    comparer(outil.calcNoteVitesse, calcCritereVitesse, [valeurs, valeurs], seuil_bon, seuil_mauv)
+
+@pytest.mark.parametrize("seuil_bon, seuil_mauv", seuils_entiers)
+def test_calcNoteHoraire(seuil_bon, seuil_mauv):
+    comparer(outil.calcNoteHoraire, noteHoraire, [valeurs], seuil_bon, seuil_mauv)
+
+def test_calcNoteHoraireNone():
+    # Une durée non définie a la note 0, comme la branche else d'origine
+    assert outil.calcNoteHoraire(numpy.array([None, 24], dtype=float), 10, 8).tolist() == [0, 3]
+
+
+#-------------- Périodes de congestion -----------------
+def test_lirePeriodesCongestion():
+    assert outil.lirePeriodesCongestion("matin:7;8;9 soir:17;18") == {"matin" : [7, 8, 9], "soir" : [17, 18]}
+    assert outil.lirePeriodesCongestion("#") == dict()
+
+@pytest.mark.parametrize("periodes, message", [("matin", "format attendu"), ("matin:7;;8", "invalides"), (":7", "format attendu"), ("m:7:8", "format attendu"),
+                                               ("soir:25", "hors de 0 à 23"), ("a-b:7", "nom de champ"), ("matin:7 Matin:8", "en double")])
+def test_lirePeriodesCongestionInvalides(periodes, message):
+    with pytest.raises(ValueError, match=message):
+        outil.lirePeriodesCongestion(periodes)
+
+
+#-------------- Ratios de hiérarchie -----------------
+@pytest.mark.parametrize("ratio_hiera", ["1 2 3 4", "1 2 3 4 5 6"])
+def test_lireRatiosHierarchieInvalides(ratio_hiera):
+    with pytest.raises(ValueError, match="ratios de hiérarchie"):
+        outil.lireRatiosHierarchie(ratio_hiera)
+
+@pytest.mark.parametrize("func_class", [[1, 0, 2], [5, 6]])
+def test_lireFuncClassInvalides(func_class):
+    outil.table_attributs = pandas.DataFrame({"FUNC_CLASS" : func_class})
+    with pytest.raises(ValueError, match="FUNC_CLASS hors de 1 à 5"):
+        outil.lireFuncClass()
+
+
+#-------------- Masques horaires de la semaine -----------------
+def accesMinuteParMinute(restrictions, jours_etude):
+    # Référence minute par minute : (plages autorisées, ou toute la semaine s'il n'y en a pas) moins les plages interdites, sur les jours étudiés
+    autorise, interdit = set(), set()
+    for debut, fin, ref_date, ar_trucks in restrictions:
+        debut = int(debut[:-2])*60 + int(debut[-2:])
+        fin = int(fin[:-2])*60 + int(fin[-2:])
+        duree = fin-debut if fin > debut else fin-debut+1440
+        for jour, actif in enumerate(ref_date):
+            if actif == "Y":
+                (interdit if ar_trucks == "N" else autorise).update((jour*1440+debut+k) % 10080 for k in range(duree))
+    minutes = autorise if any(ar_trucks != "N" for debut, fin, ref_date, ar_trucks in restrictions) else set(range(10080))
+    nb_jours = jours_etude.count("Y")
+    return len([m for m in minutes - interdit if jours_etude[m // 1440] == "Y"])/60/nb_jours if nb_jours else 0
+
+def accesSemaine(restrictions_liens, jours_etude="YYYYYYY", taille_bloc=1024):
+    # restrictions_liens : {position du lien : [(STARTTIME, ENDTIME, REF_DATE, AR_TRUCKS), ...]}
+    lignes = [(position,)+restriction for position, restrictions in restrictions_liens.items() for restriction in restrictions]
+    positions, debut, fin, ref_date, ar_trucks = (numpy.array(colonne) for colonne in zip(*lignes))
+    liens, acces = outil.calcAccesSemaine(positions=positions, interdit=ar_trucks == "N", debut=outil.minutesHoraire(debut), fin=outil.minutesHoraire(fin),
+                                          jours=outil.joursSemaine(ref_date), jours_etude=outil.joursSemaine([jours_etude])[0], taille_bloc=taille_bloc)
+    return dict(zip(liens.tolist(), acces.tolist()))
+
+# Restrictions sans chevauchement ni passage de minuit : même résultat que la somme des durées d'origine
+restrictions_sans_chevauchement = [
+    [("0800", "1800", "YYYYYYY", "Y")],
+    [("0800", "1800", "NYYYYYN", "Y")],
+    [("0000", "2400", "NNNNNNY", "Y")],
+    [("1800", "2400", "YYYYYYY", "N")],
+    [("0700", "0900", "NYYYYYN", "N")],
+    [("0800", "1000", "YYYYYYY", "Y"), ("1400", "1600", "YYYYYYY", "Y")],
+    [("0700", "0900", "YYYYYYY", "N"), ("1600", "1900", "NYYYYYN", "N")],
+]
+
+@pytest.mark.parametrize("restrictions", restrictions_sans_chevauchement)
+def test_calcAccesSemaine(restrictions):
+    assert accesSemaine({0 : restrictions})[0] == pytest.approx(accesParJour(restrictions))
+
+@pytest.mark.parametrize("restrictions, jours_etude, attendu", [
+    # Passage de minuit : interdiction de 22h à 6h, 8h par jour
+    ([("2200", "0600", "YYYYYYY", "N")], "YYYYYYY", 16),
+    # Samedi soir replié sur le dimanche matin : le dimanche seul perd 6h
+    ([("2200", "0600", "NNNNNNY", "N")], "YNNNNNN", 18),
+    ([("2200", "0600", "NNNNNNY", "N")], "YYYYYYY", 24-8/7),
+    # 0000 -> 0000 : 24h
+    ([("0000", "0000", "NYNNNNN", "Y")], "YYYYYYY", 24/7),
+    # Chevauchement : 8h-12h et 10h-14h ne comptent que 6h
+    ([("0800", "1200", "YYYYYYY", "N"), ("1000", "1400", "YYYYYYY", "N")], "YYYYYYY", 18),
+    ([("0800", "1200", "YYYYYYY", "Y"), ("1000", "1400", "YYYYYYY", "Y")], "YYYYYYY", 6),
+    # Plage autorisée réduite par une interdiction
+    ([("0600", "2000", "YYYYYYY", "Y"), ("0700", "0900", "YYYYYYY", "N")], "YYYYYYY", 12),
+    # Filtre des jours : plage des jours ouvrés, comptée sur les jours ouvrés ou sur toute la semaine
+    ([("0800", "1800", "NYYYYYN", "Y")], "NYYYYYN", 10),
+    ([("0800", "1800", "NYYYYYN", "Y")], "YYYYYYY", 50/7),
+    ([("0800", "1800", "NYYYYYN", "Y")], "YNNNNNY", 0),
+    ([("0800", "1800", "YYYYYYY", "Y")], "NNNNNNN", 0),
+])
+def test_calcAccesSemaineCas(restrictions, jours_etude, attendu):
+    assert accesSemaine({0 : restrictions}, jours_etude)[0] == pytest.approx(attendu)
+    assert accesMinuteParMinute(restrictions, jours_etude) == pytest.approx(attendu)
+
+@pytest.mark.parametrize("jours_etude", ["YYYYYYY", "NYYYYYN", "YNNNNNY"])
+def test_calcAccesSemaineAleatoire(jours_etude):
+    # Plusieurs liens répartis sur des blocs de 3 liens, restrictions qui se chevauchent et passent minuit
+    generateur = numpy.random.default_rng(10)
+    heures = ["0000", "0600", "0730", "0800", "1000", "1200", "1400", "1730", "2000", "2200", "2400"]
+    restrictions_liens = {int(position) : [(str(generateur.choice(heures)), str(generateur.choice(heures)), "".join(generateur.choice(["Y", "N"], 7)),
+                                            str(generateur.choice(["Y", "N"]))) for i in range(generateur.integers(1, 5))]
+                          for position in generateur.choice(100, 20, replace=False)}
+    acces = accesSemaine(restrictions_liens, jours_etude, taille_bloc=3)
+    assert sorted(acces) == sorted(restrictions_liens)
+    for position, restrictions in restrictions_liens.items():
+        assert acces[position] == pytest.approx(accesMinuteParMinute(restrictions, jours_etude)), restrictions